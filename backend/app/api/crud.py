@@ -1,10 +1,29 @@
-from typing import Optional, cast, Sequence, List
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, cast, Sequence, List, Tuple
 import sqlalchemy
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, noload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, or_, and_, tuple_
+from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import insert
-from app.db.models.base import Conversation, Message, Document, ConversationDocument, KnowledgeGraph
+from app.db.models.base import (
+    Conversation,
+    Message,
+    Document,
+    ConversationDocument,
+    KnowledgeGraph,
+    MessageSubProcess,
+    OcrPageCache,
+    IngestionJob,
+    IngestionJobStatusEnum,
+    EmbeddingCache,
+    MessageStatusEnum,
+    StorageEntry,
+    KgTriplet,
+    KG_ENTITY_NORMALIZE_SQL,
+    KgEntityAlias,
+    KgAliasSourceEnum,
+)
 from app.schemas import pydantic_schema
 
 
@@ -40,6 +59,144 @@ async def fetch_conversation_with_messages(db: AsyncSession, conversation_id: st
     return None
 
 
+async def fetch_conversation_header(db: AsyncSession, conversation_id: str) -> Optional[pydantic_schema.ConversationHeader]:
+    """
+    Fetch a conversation with its documents but none of its messages
+    return None if the conversation with the given id does not exist
+    """
+
+    stmt = (
+        select(Conversation)
+        .options(
+            joinedload(Conversation.conversation_documents).subqueryload(
+                ConversationDocument.document
+            )
+        )
+        .where(Conversation.id == conversation_id)
+    )
+
+    result = await db.execute(stmt)
+    conversation = result.scalars().first()
+    if conversation is not None:
+        return pydantic_schema.ConversationHeader(
+            id=conversation.id,
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at,
+            documents=[convo_doc.document for convo_doc in conversation.conversation_documents],
+            history_summary=conversation.history_summary,
+            history_summary_until=conversation.history_summary_until,
+            retrieval_mode=conversation.retrieval_mode,
+        )
+
+    return None
+
+
+async def fetch_messages(
+    db: AsyncSession,
+    conversation_id: str,
+    limit: Optional[int],
+    before: Optional[str] = None,
+    status: Optional[MessageStatusEnum] = None,
+    with_sub_processes: bool = True,
+    after: Optional[datetime] = None,
+) -> Optional[List[pydantic_schema.Message]]:
+    """
+    Fetch the latest messages of a conversation, or the latest ones sent before the message with
+    id `before`, oldest first. Messages are read newest first using the (conversation_id, created_at)
+    index, so the cost of a page doesn't depend on the length of the conversation.
+    Only messages created after `after` are fetched if it is given, all of them if `limit` is None.
+    return None if the `before` message does not exist in the conversation
+    """
+
+    stmt = select(Message).where(Message.conversation_id == conversation_id)
+    if after is not None:
+        stmt = stmt.where(Message.created_at > after)
+    if before is not None:
+        cursor = (
+            await db.execute(
+                select(Message.created_at, Message.id).where(
+                    Message.id == before, Message.conversation_id == conversation_id
+                )
+            )
+        ).first()
+        if cursor is None:
+            return None
+        stmt = stmt.where(tuple_(Message.created_at, Message.id) < tuple_(cursor.created_at, cursor.id))
+    if status is not None:
+        stmt = stmt.where(Message.status == status)
+    stmt = stmt.options(
+        selectinload(Message.sub_processes) if with_sub_processes else noload(Message.sub_processes)
+    )
+    stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    result = await db.execute(stmt)
+    messages = [pydantic_schema.Message.from_orm(message) for message in result.scalars().all()]
+    messages.reverse()
+
+    return messages
+
+
+async def fetch_message_page(
+    db: AsyncSession, conversation_id: str, limit: int, before: Optional[str] = None
+) -> Optional[pydantic_schema.MessagePage]:
+    """
+    Fetch a page of a conversation's messages with their sub processes
+    return None if the `before` message does not exist in the conversation
+    """
+
+    # One extra message tells whether there is a previous page
+    messages = await fetch_messages(db, conversation_id, limit + 1, before=before)
+    if messages is None:
+        return None
+
+    has_previous_page = len(messages) > limit
+    messages = messages[-limit:]
+
+    return pydantic_schema.MessagePage(
+        messages=messages,
+        next_before=messages[0].id if has_previous_page else None,
+    )
+
+
+async def fetch_conversation_for_chat(db: AsyncSession, conversation_id: str) -> Optional[pydantic_schema.Conversation]:
+    """
+    Fetch a conversation with its documents and the successful messages that haven't been folded
+    into its history summary yet, without their sub processes, which is all that's needed to
+    answer a new message. Every such message is fetched, so that the ones that don't fit the chat
+    history's token budget can be summarized rather than lost.
+    return None if the conversation with the given id does not exist
+    """
+
+    header = await fetch_conversation_header(db, conversation_id)
+    if header is None:
+        return None
+
+    messages = await fetch_messages(
+        db,
+        conversation_id,
+        None,
+        status=MessageStatusEnum.SUCCESS,
+        with_sub_processes=False,
+        after=header.history_summary_until,
+    )
+
+    return pydantic_schema.Conversation(**header.dict(), messages=messages)
+
+
+async def update_conversation_history_summary(
+    db: AsyncSession, conversation_id: str, history_summary: str, history_summary_until: datetime
+) -> None:
+    stmt = (
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(history_summary=history_summary, history_summary_until=history_summary_until)
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
 async def delete_conversation(db: AsyncSession, conversation_id: str) -> bool:
     stmt = delete(Conversation).where(Conversation.id == conversation_id)
     result = await db.execute(stmt)
@@ -68,15 +225,48 @@ async def fetch_message_with_sub_processes(db: AsyncSession, message_id: str) ->
     return None
 
 
+async def insert_messages(db: AsyncSession, messages: List[Dict[str, Any]]) -> None:
+    await db.execute(insert(Message).values(messages))
+    await db.commit()
+
+
+async def update_message(db: AsyncSession, message_id: str, **values: Any) -> None:
+    await db.execute(update(Message).where(Message.id == message_id).values(**values))
+    await db.commit()
+
+
+async def upsert_message_sub_processes(db: AsyncSession, sub_processes: List[Dict[str, Any]]) -> None:
+    """
+    Insert sub-processes with a single multi-row INSERT, updating the status and metadata
+    of the ones that were already inserted
+    """
+
+    if not sub_processes:
+        return
+
+    stmt = insert(MessageSubProcess).values(sub_processes)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MessageSubProcess.id],
+        set_={
+            "status": stmt.excluded.status,
+            "metadata_map": stmt.excluded.metadata_map,
+            "updated_at": func.now(),
+        },
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
 async def fetch_documents(
     db: AsyncSession,
     id: Optional[str] = None,
     ids: Optional[List[str]] = None,
     url: Optional[str] = None,
+    content_hash: Optional[str] = None,
     limit: Optional[int] = None,
 ) -> Optional[Sequence[pydantic_schema.Document]]:
     """
-    Fetch a document by its url or id
+    Fetch a document by its url, id or content hash
     """
 
     stmt = select(Document)
@@ -87,6 +277,8 @@ async def fetch_documents(
         stmt = stmt.where(Document.id.in_(ids))
     if url is not None:
         stmt = stmt.where(Document.url == url)
+    if content_hash is not None:
+        stmt = stmt.where(Document.content_hash == content_hash)
     if limit is not None:
         stmt = stmt.limit(limit)
     result = await db.execute(stmt)
@@ -95,15 +287,47 @@ async def fetch_documents(
     return [pydantic_schema.Document.from_orm(doc) for doc in documents]
 
 
+async def fetch_indexed_document_by_content_hash(
+    db: AsyncSession, content_hash: str, url: str
+) -> Optional[pydantic_schema.Document]:
+    """
+    Fetch a document with the given contents whose most recent ingestion job succeeded, the one
+    at the given URL if there is one, return None if there is no such document
+    """
+
+    latest_job_status = (
+        select(IngestionJob.status)
+        .where(IngestionJob.document_id == Document.id)
+        .order_by(IngestionJob.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = (
+        select(Document)
+        .where(Document.content_hash == content_hash, latest_job_status == IngestionJobStatusEnum.SUCCESS)
+        .order_by((Document.url == url).desc(), Document.created_at)
+        .limit(1)
+    )
+    result = await db.execute(stmt)
+    document = result.scalars().first()
+    if document is not None:
+        return pydantic_schema.Document.from_orm(document)
+
+    return None
+
+
 async def upsert_document(db: AsyncSession, document: pydantic_schema.Document) -> pydantic_schema.Document:
     """
     Upsert a document
     """
 
+    update_fields = {"metadata_map"}
+    if document.content_hash is not None:
+        update_fields.add("content_hash")
     stmt = insert(Document).values(**document.dict(exclude_none=True))
     stmt = stmt.on_conflict_do_update(
         index_elements=[Document.url],
-        set_=document.dict(include={"metadata_map"}),
+        set_=document.dict(include=update_fields),
     )
     stmt = stmt.returning(Document)
     result = await db.execute(stmt)
@@ -114,7 +338,7 @@ async def upsert_document(db: AsyncSession, document: pydantic_schema.Document)
 
 
 async def create_conversation(db: AsyncSession, convo_payload: pydantic_schema.ConversationCreate) -> pydantic_schema.Conversation:
-    conversation = Conversation()
+    conversation = Conversation(retrieval_mode=convo_payload.retrieval_mode)
     convo_doc_db_objects = [
         ConversationDocument(document_id=doc_id, conversation=conversation)
         for doc_id in convo_payload.document_ids
@@ -156,3 +380,425 @@ async def fetch_kg_index(db: AsyncSession) -> str:
     index_ids = result.scalars().all()
 
     return str(index_ids[0])
+
+
+def _normalize_kg_entity(name: str) -> Any:
+    # Spelled like KG_ENTITY_NORMALIZE_SQL, which the subj_norm and obj_norm columns are computed with
+    return func.lower(func.regexp_replace(func.btrim(name), r"\s+", " ", "g"))
+
+
+# Breadth first walk of the knowledge graph from each subject, taking the first
+# :max_rels_per_subject relations of every subject reached within :depth hops and
+# not following a relation back to a subject already on the path
+KG_REL_MAP_QUERY = sqlalchemy.text(f"""
+WITH RECURSIVE walk AS (
+    SELECT roots.root_index, 1 AS depth, rels.subj, rels.rel, rels.obj, rels.obj_norm, ARRAY[rels.subj_norm] AS path
+    FROM unnest(CAST(:subjs AS VARCHAR[])) WITH ORDINALITY AS roots(subj, root_index)
+    CROSS JOIN LATERAL (
+        SELECT subj, rel, obj, subj_norm, obj_norm
+        FROM kgtriplet
+        WHERE subj_norm = {KG_ENTITY_NORMALIZE_SQL.format("roots.subj")}
+        ORDER BY created_at, id
+        LIMIT :max_rels_per_subject
+    ) AS rels
+    UNION ALL
+    SELECT walk.root_index, walk.depth + 1, rels.subj, rels.rel, rels.obj, rels.obj_norm, walk.path || rels.subj_norm
+    FROM walk
+    CROSS JOIN LATERAL (
+        SELECT subj, rel, obj, subj_norm, obj_norm
+        FROM kgtriplet
+        WHERE subj_norm = walk.obj_norm
+        ORDER BY created_at, id
+        LIMIT :max_rels_per_subject
+    ) AS rels
+    WHERE walk.depth < :depth AND NOT walk.obj_norm = ANY(walk.path)
+)
+SELECT root_index, subj, rel, obj FROM walk ORDER BY root_index, depth LIMIT :limit
+""")
+
+
+async def fetch_kg_rel_map(
+    db: AsyncSession,
+    subjs: Sequence[str],
+    depth: int,
+    limit: int,
+    max_rels_per_subject: Optional[int] = None,
+) -> Dict[str, List[List[str]]]:
+    """
+    Fetch the [subject, relation, object] triplets reachable from each of the subjects within
+    depth hops, nearest first and at most limit in total, keyed by the subject they were
+    reached from. Subjects are matched by their normalized names.
+    """
+
+    if not subjs or depth <= 0 or limit <= 0:
+        return {}
+
+    result = await db.execute(KG_REL_MAP_QUERY, {
+        "subjs": list(subjs),
+        "depth": depth,
+        "limit": limit,
+        "max_rels_per_subject": max_rels_per_subject or limit,
+    })
+    rel_map: Dict[str, List[List[str]]] = {}
+    for root_index, subj, rel, obj in result.all():
+        rel_map.setdefault(subjs[root_index - 1], []).append([subj, rel, obj])
+
+    return rel_map
+
+
+async def fetch_kg_triplets(db: AsyncSession, subjs: Optional[Sequence[str]] = None) -> Dict[str, List[List[str]]]:
+    """
+    Fetch the [relation, object] pairs of either every subject or only the given ones, matched by
+    their normalized names, keyed by subject
+    """
+
+    stmt = select(KgTriplet.subj, KgTriplet.rel, KgTriplet.obj).order_by(KgTriplet.created_at, KgTriplet.id)
+    if subjs is not None:
+        if not subjs:
+            return {}
+        stmt = stmt.where(KgTriplet.subj_norm.in_([_normalize_kg_entity(subj) for subj in subjs]))
+    result = await db.execute(stmt)
+    graph_dict: Dict[str, List[List[str]]] = {}
+    for subj, rel, obj in result.all():
+        graph_dict.setdefault(subj, []).append([rel, obj])
+
+    return graph_dict
+
+
+async def fetch_kg_entity_names(db: AsyncSession) -> List[str]:
+    """
+    Fetch the names of every subject and object of the knowledge graph
+    """
+
+    result = await db.execute(select(KgTriplet.subj).union(select(KgTriplet.obj)))
+
+    return list(result.scalars().all())
+
+
+async def fetch_kg_triplet_write_count(db: AsyncSession) -> int:
+    """
+    Fetch the number of triplet rows inserted or deleted by any process according to the
+    statistics collector, which is cheap to read and changes whenever the graph does. Other
+    processes' writes show up within a second or so of being committed.
+    """
+
+    rows_inserted = sqlalchemy.column("n_tup_ins", sqlalchemy.BigInteger)
+    rows_deleted = sqlalchemy.column("n_tup_del", sqlalchemy.BigInteger)
+    stmt = (
+        select(rows_inserted + rows_deleted)
+        .select_from(sqlalchemy.table("pg_stat_user_tables"))
+        .where(sqlalchemy.column("relname") == KgTriplet.__tablename__)
+    )
+    result = await db.execute(stmt)
+
+    return result.scalar() or 0
+
+
+async def fetch_similar_kg_subjects(db: AsyncSession, name: str, limit: int) -> List[str]:
+    """
+    Fetch the subjects whose normalized names are most similar to the name's by trigram similarity
+    """
+
+    name_norm = _normalize_kg_entity(name)
+    stmt = (
+        select(func.min(KgTriplet.subj))
+        .where(KgTriplet.subj_norm.op("%")(name_norm))
+        .group_by(KgTriplet.subj_norm)
+        .order_by(func.similarity(KgTriplet.subj_norm, name_norm).desc())
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+
+    return list(result.scalars().all())
+
+
+async def insert_kg_triplets(
+    db: AsyncSession, triplets: Sequence[Tuple[str, str, str]], statement_size: Optional[int] = None
+) -> int:
+    """
+    Insert (subject, relation, object) triplets in a single transaction, ignoring ones that already
+    exist, returning how many were inserted. Each INSERT has at most `statement_size` rows.
+    """
+
+    if not triplets:
+        return 0
+
+    statement_size = statement_size or len(triplets)
+    inserted = 0
+    for start in range(0, len(triplets), statement_size):
+        stmt = insert(KgTriplet).values([
+            {"subj": subj, "rel": rel, "obj": obj} for subj, rel, obj in triplets[start:start + statement_size]
+        ])
+        stmt = stmt.on_conflict_do_nothing(index_elements=[KgTriplet.subj, KgTriplet.rel, KgTriplet.obj])
+        result = await db.execute(stmt)
+        inserted += result.rowcount
+    await db.commit()
+
+    return inserted
+
+
+async def delete_kg_triplet(db: AsyncSession, subj: str, rel: str, obj: str) -> bool:
+    stmt = delete(KgTriplet).where(KgTriplet.subj == subj).where(KgTriplet.rel == rel).where(KgTriplet.obj == obj)
+    result = await db.execute(stmt)
+    await db.commit()
+
+    return result.rowcount > 0
+
+
+async def fetch_kg_aliases(db: AsyncSession, entity_keys: Sequence[str]) -> Dict[str, List[str]]:
+    """
+    Fetch the aliases of the given entity keys, keyed by entity key
+    """
+
+    if not entity_keys:
+        return {}
+
+    stmt = (
+        select(KgEntityAlias.entity_key, KgEntityAlias.alias)
+        .where(KgEntityAlias.entity_key.in_(entity_keys))
+        .order_by(KgEntityAlias.created_at, KgEntityAlias.id)
+    )
+    result = await db.execute(stmt)
+    aliases: Dict[str, List[str]] = {}
+    for entity_key, alias in result.all():
+        aliases.setdefault(entity_key, []).append(alias)
+
+    return aliases
+
+
+async def insert_kg_aliases(db: AsyncSession, aliases: Sequence[Tuple[str, str]], source: KgAliasSourceEnum) -> None:
+    """
+    Insert (entity key, alias) pairs, ignoring ones that already exist
+    """
+
+    if not aliases:
+        return
+
+    stmt = insert(KgEntityAlias).values([
+        {"entity_key": entity_key, "alias": alias, "source": source}
+        for entity_key, alias in aliases
+    ])
+    stmt = stmt.on_conflict_do_nothing(index_elements=[KgEntityAlias.entity_key, KgEntityAlias.alias])
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def fetch_ocr_pages(db: AsyncSession, content_hash: str, page_numbers: List[int]) -> Dict[int, str]:
+    """
+    Fetch cached OCR output for the given pages of a PDF, keyed by page number
+    """
+
+    stmt = (
+        select(OcrPageCache.page_number, OcrPageCache.text)
+        .where(OcrPageCache.content_hash == content_hash)
+        .where(OcrPageCache.page_number.in_(page_numbers))
+    )
+    result = await db.execute(stmt)
+
+    return {page_number: text for page_number, text in result.all()}
+
+
+async def insert_ocr_pages(db: AsyncSession, content_hash: str, page_texts: Dict[int, str]) -> None:
+    """
+    Cache OCR output for pages of a PDF, ignoring pages that are already cached
+    """
+
+    if not page_texts:
+        return
+
+    stmt = insert(OcrPageCache).values([
+        {"content_hash": content_hash, "page_number": page_number, "text": text}
+        for page_number, text in page_texts.items()
+    ])
+    stmt = stmt.on_conflict_do_nothing(index_elements=[OcrPageCache.content_hash, OcrPageCache.page_number])
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def create_ingestion_job(db: AsyncSession, document_id: str) -> pydantic_schema.IngestionJob:
+    """
+    Queue a document for ingestion
+    """
+
+    job = IngestionJob(document_id=document_id, status=IngestionJobStatusEnum.QUEUED, progress={}, attempts=0)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    return pydantic_schema.IngestionJob.from_orm(job)
+
+
+async def fetch_ingestion_job(db: AsyncSession, job_id: str) -> Optional[pydantic_schema.IngestionJob]:
+    """
+    Fetch an ingestion job by id
+    return None if the job with the given id does not exist
+    """
+
+    result = await db.execute(select(IngestionJob).where(IngestionJob.id == job_id))
+    job = result.scalars().first()
+    if job is not None:
+        return pydantic_schema.IngestionJob.from_orm(job)
+
+    return None
+
+
+async def claim_ingestion_job(
+    db: AsyncSession, stale_after: timedelta, max_attempts: int
+) -> Optional[pydantic_schema.IngestionJob]:
+    """
+    Claim the oldest queued ingestion job, or a running one whose worker stopped sending heartbeats.
+    Running jobs that went stale on their last attempt, e.g. because their document crashed the
+    process, are marked as failed instead of being retried.
+    Uses SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers never claim the same job.
+    """
+
+    is_stale = and_(
+        IngestionJob.status == IngestionJobStatusEnum.RUNNING,
+        IngestionJob.updated_at < func.now() - stale_after,
+    )
+    await db.execute(
+        update(IngestionJob)
+        .where(is_stale, IngestionJob.attempts >= max_attempts)
+        .values(status=IngestionJobStatusEnum.ERROR, error="Stopped sending heartbeats on its last attempt")
+    )
+    stmt = (
+        select(IngestionJob)
+        .where(
+            or_(
+                IngestionJob.status == IngestionJobStatusEnum.QUEUED,
+                and_(is_stale, IngestionJob.attempts < max_attempts),
+            )
+        )
+        .order_by(IngestionJob.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(stmt)
+    job = result.scalars().first()
+    if job is None:
+        await db.commit()
+        return None
+
+    job.status = IngestionJobStatusEnum.RUNNING
+    job.attempts += 1
+    job.error = None
+    await db.commit()
+    await db.refresh(job)
+
+    return pydantic_schema.IngestionJob.from_orm(job)
+
+
+async def update_ingestion_job(db: AsyncSession, job_id: str, **values: Any) -> None:
+    """
+    Update the status, stage or progress of an ingestion job
+    """
+
+    await db.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(**values))
+    await db.commit()
+
+
+async def fetch_cached_embeddings(db: AsyncSession, model_name: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+    """
+    Fetch cached embeddings keyed by text hash, marking them as recently used
+    """
+
+    if not text_hashes:
+        return {}
+
+    stmt = (
+        update(EmbeddingCache)
+        .where(EmbeddingCache.model_name == model_name)
+        .where(EmbeddingCache.text_hash.in_(text_hashes))
+        .values(last_used_at=func.now())
+        .returning(EmbeddingCache.text_hash, EmbeddingCache.embedding)
+    )
+    result = await db.execute(stmt)
+    embeddings = {text_hash: embedding for text_hash, embedding in result.all()}
+    await db.commit()
+
+    return embeddings
+
+
+async def insert_cached_embeddings(db: AsyncSession, model_name: str, embeddings: Dict[str, List[float]]) -> None:
+    """
+    Cache embeddings keyed by text hash, ignoring ones that are already cached
+    """
+
+    if not embeddings:
+        return
+
+    stmt = insert(EmbeddingCache).values([
+        {"model_name": model_name, "text_hash": text_hash, "embedding": embedding}
+        for text_hash, embedding in embeddings.items()
+    ])
+    stmt = stmt.on_conflict_do_nothing(index_elements=[EmbeddingCache.model_name, EmbeddingCache.text_hash])
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def estimate_cached_embeddings(db: AsyncSession) -> int:
+    """
+    The number of cached embeddings according to the planner statistics, which unlike a count
+    doesn't scan the table but is only as recent as the last (auto)vacuum or analyze
+    """
+
+    result = await db.execute(
+        select(sqlalchemy.column("reltuples", sqlalchemy.Float))
+        .select_from(sqlalchemy.table("pg_class"))
+        .where(sqlalchemy.column("relname") == EmbeddingCache.__tablename__)
+    )
+    # -1 if the table has never been analyzed
+    return max(int(result.scalar() or 0), 0)
+
+
+async def evict_cached_embeddings(db: AsyncSession, max_entries: int) -> int:
+    """
+    Delete the least recently used cached embeddings beyond max_entries, returning how many were deleted
+    """
+
+    keep = select(EmbeddingCache.id).order_by(EmbeddingCache.last_used_at.desc()).offset(max_entries)
+    result = await db.execute(delete(EmbeddingCache).where(EmbeddingCache.id.in_(keep)))
+    await db.commit()
+
+    return result.rowcount
+
+
+async def fetch_storage_entries(
+    db: AsyncSession, collection: str, keys: Optional[Sequence[str]] = None
+) -> Dict[str, dict]:
+    """
+    Fetch the values of a storage collection keyed by key, either all of them or only the given keys
+    """
+
+    stmt = select(StorageEntry.key, StorageEntry.value).where(StorageEntry.collection == collection)
+    if keys is not None:
+        if not keys:
+            return {}
+        stmt = stmt.where(StorageEntry.key.in_(keys))
+    result = await db.execute(stmt)
+
+    return {key: value for key, value in result.all()}
+
+
+async def upsert_storage_entries(db: AsyncSession, collection: str, entries: Dict[str, dict]) -> None:
+    if not entries:
+        return
+
+    stmt = insert(StorageEntry).values([
+        {"collection": collection, "key": key, "value": value}
+        for key, value in entries.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StorageEntry.collection, StorageEntry.key],
+        set_={"value": stmt.excluded.value, "updated_at": func.now()},
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def delete_storage_entry(db: AsyncSession, collection: str, key: str) -> bool:
+    stmt = delete(StorageEntry).where(StorageEntry.collection == collection).where(StorageEntry.key == key)
+    result = await db.execute(stmt)
+    await db.commit()
+
+    return result.rowcount > 0
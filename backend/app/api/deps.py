@@ -1,8 +1,23 @@
-from typing import Generator
+import secrets
+
+from typing import Generator, Optional
+from fastapi import HTTPException, Security
+from fastapi.security import APIKeyHeader
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.db.session import SessionLocal
 
 
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+
 async def get_db() -> Generator[AsyncSession, None, None]:
     async with SessionLocal() as db:
         yield db
+
+
+async def require_admin_api_key(api_key: Optional[str] = Security(api_key_header)) -> None:
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if api_key is None or not secrets.compare_digest(api_key, settings.ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid API key")
@@ -4,25 +4,22 @@ import datetime
 import asyncio
 import logging
 
-from fastapi import Depends, APIRouter, HTTPException, Response, status
+from typing import Optional
+from fastapi import Depends, APIRouter, Header, HTTPException, Query, Response, status
 from uuid import uuid4
-from collections import OrderedDict
 from sqlalchemy.ext.asyncio import AsyncSession
 from sse_starlette.sse import EventSourceResponse
 from app.api.deps import get_db
 from app.api import crud
+from app.core.config import settings
 from app.schemas import pydantic_schema
-from app.chat.messaging import (
-    handle_chat_message,
-    StreamedMessage,
-    StreamedMessageSubProcess,
-)
+from app.chat.messaging import handle_chat_message
+from app.chat.message_writer import MessageWriteBehind
+from app.chat.streaming import MessageStream, StreamFormatEnum, coalesce_events, get_stream_format
 from app.db.models.base import (
     Message,
-    MessageSubProcess,
     MessageRoleEnum,
     MessageStatusEnum,
-    MessageSubProcessStatusEnum,
 )
 from uuid import UUID
 
@@ -49,6 +46,36 @@ async def get_conversation(conversation_id: UUID, db: AsyncSession = Depends(get
     return conversation
 
 
+@router.get("/{conversation_id}/header")
+async def get_conversation_header(conversation_id: UUID, db: AsyncSession = Depends(get_db)) -> pydantic_schema.ConversationHeader:
+    """
+    Get a conversation by ID along with its documents, without its messages.
+    """
+    conversation = await crud.fetch_conversation_header(db, str(conversation_id))
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+
+@router.get("/{conversation_id}/messages")
+async def get_conversation_messages(
+    conversation_id: UUID,
+    before: Optional[UUID] = None,
+    limit: int = Query(settings.MESSAGE_PAGE_SIZE, ge=1, le=settings.MESSAGE_PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_db),
+) -> pydantic_schema.MessagePage:
+    """
+    Get the latest messages of a conversation along with their message subprocesses, oldest first.
+    Pass the page's `next_before` as `before` to get the messages sent before them.
+    """
+    page = await crud.fetch_message_page(
+        db, str(conversation_id), limit, before=str(before) if before is not None else None
+    )
+    if page is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return page
+
+
 @router.delete("/{conversation_id}", response_model=None, status_code=status.HTTP_204_NO_CONTENT)
 async def delete_conversation(conversation_id: UUID, db: AsyncSession = Depends(get_db)):
     """
@@ -61,19 +88,29 @@ async def delete_conversation(conversation_id: UUID, db: AsyncSession = Depends(
 
 
 @router.get("/{conversation_id}/message")
-async def message_conversation(conversation_id: UUID, user_message: str, db: AsyncSession = Depends(get_db)) -> EventSourceResponse:
+async def message_conversation(
+    conversation_id: UUID,
+    user_message: str,
+    stream_format: Optional[StreamFormatEnum] = None,
+    accept: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+) -> EventSourceResponse:
     """
     Send a message from a user to a conversation, receive a SSE stream of the assistant's response.
     Each event in the SSE stream is a Message object. As the assistant continues processing the response,
     the message object's sub_processes list and content string is appended to. While the message is being
     generated, the status of the message will be PENDING. Once the message is generated, the status will
     be SUCCESS. If there was an error in processing the message, the final status will be ERROR.
+
+    With `stream_format=delta` (or an Accept header including the delta media type) only the changes
+    are sent while the message is generated; see StreamFormatEnum.
     """
-    conversation = await crud.fetch_conversation_with_messages(db, str(conversation_id))
+    conversation = await crud.fetch_conversation_for_chat(db, str(conversation_id))
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     user_message = Message(
+        id=str(uuid4()),
         created_at=datetime.datetime.utcnow(),
         updated_at=datetime.datetime.utcnow(),
         conversation_id=conversation_id,
@@ -89,53 +126,26 @@ async def message_conversation(conversation_id: UUID, user_message: str, db: Asy
             task = asyncio.create_task(
                 handle_chat_message(conversation, user_message, send_chan)
             )
-            message_id = str(uuid4())
             message = Message(
-                id=message_id,
+                id=str(uuid4()),
+                created_at=datetime.datetime.utcnow(),
+                updated_at=datetime.datetime.utcnow(),
                 conversation_id=conversation_id,
                 content="",
                 role=MessageRoleEnum.assistant,
                 status=MessageStatusEnum.PENDING,
                 sub_processes=[],
             )
+            message_stream = MessageStream(message, get_stream_format(stream_format, accept))
+            message_writer = MessageWriteBehind(message_stream, user_message)
             final_status = MessageStatusEnum.ERROR
-            event_id_to_sub_process = OrderedDict()
             try:
-                async for message_obj in recv_chan:
-                    if isinstance(message_obj, StreamedMessage):
-                        message.content = message_obj.content
-                    elif isinstance(message_obj, StreamedMessageSubProcess):
-                        status = (
-                            MessageSubProcessStatusEnum.FINISHED
-                            if message_obj.has_ended
-                            else MessageSubProcessStatusEnum.PENDING
-                        )
-                        if message_obj.event_id in event_id_to_sub_process:
-                            created_at = event_id_to_sub_process[
-                                message_obj.event_id
-                            ].created_at
-                        else:
-                            created_at = datetime.datetime.utcnow()
-                        sub_process = MessageSubProcess(
-                            # NOTE: By setting the created_at to the current time, we are
-                            # no longer able to use the created_at field to determine the
-                            # time at which the subprocess was inserted into the database.
-                            created_at=created_at,
-                            message_id=message_id,
-                            source=message_obj.source,
-                            metadata_map=message_obj.metadata_map,
-                            status=status,
-                        )
-                        event_id_to_sub_process[message_obj.event_id] = sub_process
-
-                        message.sub_processes = list(
-                            event_id_to_sub_process.values())
-                    else:
-                        logger.error(
-                            f"Unknown message object type: {type(message_obj)}"
-                        )
-                        continue
-                    yield pydantic_schema.Message.from_orm(message).json()
+                await message_writer.start()
+                start_event = message_stream.start()
+                if start_event is not None:
+                    yield start_event
+                async for event in coalesce_events(recv_chan, message_stream):
+                    yield event
                 await task
                 if task.exception():
                     raise ValueError(
@@ -145,12 +155,9 @@ async def message_conversation(conversation_id: UUID, user_message: str, db: Asy
             except:
                 logger.error("Error in message publisher", exc_info=True)
                 final_status = MessageStatusEnum.ERROR
+            await message_writer.finish(final_status)
             message.status = final_status
-            db.add(user_message)
-            db.add(message)
-            await db.commit()
-            final_message = await crud.fetch_message_with_sub_processes(db, message_id)
-            yield final_message.json()
+            yield message_stream.snapshot()
 
     return EventSourceResponse(event_publisher())
 
@@ -165,7 +172,7 @@ async def test_message_conversation(
     Test version of /message endpoint that returns a single message object instead of a SSE stream.
     """
     response: EventSourceResponse = await message_conversation(
-        conversation_id, user_message, db
+        conversation_id, user_message, stream_format=None, accept=None, db=db
     )
     final_message = None
     async for message in response.body_iterator:
@@ -1,60 +1,132 @@
+import hashlib
 import logging
-import io
 import requests
 import shutil
 import re
 
 from datetime import date
 
-from typing import Annotated, List
-from fastapi import APIRouter, Form, HTTPException, Response, File, UploadFile
-from app.api import crud
-from app.chat.engine import build_doc_id_to_index_map, get_s3_fs, get_tool_service_context
+from typing import Annotated, Any, BinaryIO, Dict, List, Union
+from uuid import UUID
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, Response, File, UploadFile
+from fastapi.responses import StreamingResponse
+from app.api import crud, deps
+from app.chat.engine import get_s3_fs
+from app.chat.index_cache import document_index_cache
+from app.chat.kg_ingestion import TripletFormatEnum, aiter_lines, ingest_triplets, s3_ingest_lock
+from app.chat.answer_cache import answer_cache
+from app.chat.s3_io import iter_s3_object
 from app.db.session import SessionLocal
-from app.schemas.pydantic_schema import CHFiling, Document, DocumentTypeEnum
-from app.core.config import settings
+from app.schemas.pydantic_schema import CHFiling, Document, DocumentTypeEnum, IngestionJob
+from app.core.config import StorageBackendEnum, settings
 
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+def hash_file_object(file_obj: BinaryIO) -> str:
+    """
+    SHA-256 of a seekable file object's contents, leaving it rewound
+    """
+    content_hash = hashlib.sha256()
+    for chunk in iter(lambda: file_obj.read(settings.S3_READ_CHUNK_SIZE), b""):
+        content_hash.update(chunk)
+    file_obj.seek(0)
+
+    return content_hash.hexdigest()
+
+
+async def upsert_if_indexed(doc: Document) -> bool:
+    """
+    Update the metadata of the document at doc's URL if it has already been indexed with identical
+    contents, and return whether it was. Contents that were only indexed under another URL still
+    need an index of their own, but its embeddings and OCR output are looked up from their caches.
+    """
+    async with SessionLocal() as db:
+        duplicate = await crud.fetch_indexed_document_by_content_hash(db, doc.content_hash, doc.url)
+        if duplicate is None:
+            return False
+        if duplicate.url != doc.url:
+            logger.info(f"{doc.url} has the same contents as {duplicate.url}, reusing its cached embeddings")
+            return False
+        await crud.upsert_document(db, doc)
+
+    logger.info(f"{doc.url} has already been indexed with the same contents")
+    return True
+
+
+@router.post("/kg-triplets", dependencies=[Depends(deps.require_admin_api_key)])
+async def ingest_kg_triplets(request: Request, format: TripletFormatEnum = TripletFormatEnum.CSV) -> Dict[str, Any]:
+    """
+    Bulk insert (subject, relation, object) triplets into the knowledge graph from a CSV or JSONL
+    request body, which is read as it streams in. Returns the counts and the triplets/sec.
+    Only one ingest into the S3 graph runs at a time, others are rejected while it does.
+    """
+    if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.S3 and s3_ingest_lock.locked():
+        raise HTTPException(status_code=409, detail="Triplets are already being ingested, try again when done")
+    stats = await ingest_triplets(aiter_lines(request.stream()), format)
+    return stats.to_dict()
+
+
 @router.get("/{filename}")
 async def retrieve(filename: str) -> Response:
     fs = get_s3_fs()
-    with fs.open(f"{settings.S3_ASSET_BUCKET_NAME}/{filename}", "rb") as f:
-        return Response(io.BytesIO(f.read()).getvalue(), media_type="application/pdf")
+    return StreamingResponse(
+        iter_s3_object(fs, f"{settings.S3_ASSET_BUCKET_NAME}/{filename}"),
+        media_type="application/pdf",
+    )
+
+
+@router.get("/jobs/{job_id}")
+async def get_ingestion_job(job_id: UUID) -> IngestionJob:
+    """
+    Get the status and per-stage progress of an ingestion job
+    """
+    async with SessionLocal() as db:
+        job = await crud.fetch_ingestion_job(db, str(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+
+    return job
 
 
-@router.post("/upload")
-async def upload_file(file: Annotated[UploadFile, File()], company_name: Annotated[str, Form()], document_type: Annotated[str, Form()]) -> Response:
+@router.post("/upload", status_code=202, response_model=None)
+async def upload_file(file: Annotated[UploadFile, File()], company_name: Annotated[str, Form()], document_type: Annotated[str, Form()]) -> Union[IngestionJob, Response]:
+    """
+    Upload a PDF and queue it for indexing. Returns the ingestion job, or a 200 with
+    no body if the file has already been indexed with identical contents.
+    """
     logger.info(f"Uploading: {file.filename}...")
     if file.content_type != "application/pdf":
         logger.error(f"Can only upload pdf files. {file.content_type} not supported")
         raise HTTPException(status_code=422, detail=f"Can only upload pdf files. {file.content_type} not supported")
 
+    content_hash = hash_file_object(file.file)
+    metadata = {"name": company_name, "doc_type": document_type, "year": 2022}
+    doc = Document(url=f"data/{file.filename}", metadata_map=metadata, content_hash=content_hash)
+    if await upsert_if_indexed(doc):
+        return Response(status_code=200)
+
     fs = get_s3_fs()
     with fs.open(f"{settings.S3_ASSET_BUCKET_NAME}/{file.filename}", "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
     logger.info(f"File uploaded: {file.filename}\nIndexing...\n")
 
-    metadata = {"name": company_name, "doc_type": document_type, "year": 2022}
-    doc = Document(url=f"data/{file.filename}", metadata_map=metadata)
     async with SessionLocal() as db:
         document = await crud.upsert_document(db, doc)
+        # The cached index of a re-uploaded document and the answers given from it are out of date
+        document_index_cache.invalidate(str(document.id))
+        answer_cache.invalidate_document(str(document.id))
+        # Index the document in the background
+        return await crud.create_ingestion_job(db, str(document.id))
 
-    # Build index for the document
-    service_context = get_tool_service_context([])
-    await build_doc_id_to_index_map(service_context, [document], fs=fs)
-
-    return Response(status_code=200)
 
-
-@router.post("/search-ch")
-async def upload_from_ch(data: CHFiling) -> Response:
+@router.post("/search-ch", status_code=202, response_model=None)
+async def upload_from_ch(data: CHFiling) -> Union[IngestionJob, Response]:
     """
-    Upload a filing from Companies House
+    Upload a filing from Companies House and queue it for indexing
     """
 
     url_base = "https://api.company-information.service.gov.uk/"
@@ -70,21 +142,22 @@ async def upload_from_ch(data: CHFiling) -> Response:
     doc_response = requests.get(doc_link, auth=(settings.CH_API_KEY, ''), headers={'Accept': 'application/pdf'})
 
     url = f"data/{metadata['filename']}.pdf"
-    with open(url, "wb") as f:
-        f.write(doc_response.content)
-
+    content_hash = hashlib.sha256(doc_response.content).hexdigest()
     metadata = {
         "name": company_name,
         # TODO: hard code for now, will have to map CH categories to our metadata type enum
         "doc_type": DocumentTypeEnum.ANNUAL_REPORT,
         "year": date.fromisoformat(data.date).year
     }
-    doc = Document(url=url, metadata_map=metadata)
-    async with SessionLocal() as db:
-        document = await crud.upsert_document(db, doc)
+    doc = Document(url=url, metadata_map=metadata, content_hash=content_hash)
+    if await upsert_if_indexed(doc):
+        return Response(status_code=200)
 
-    fs = get_s3_fs()
-    service_context = get_tool_service_context([])
-    await build_doc_id_to_index_map(service_context, [document], fs=fs)
+    with open(url, "wb") as f:
+        f.write(doc_response.content)
 
-    return Response(status_code=200)
+    async with SessionLocal() as db:
+        document = await crud.upsert_document(db, doc)
+        document_index_cache.invalidate(str(document.id))
+        answer_cache.invalidate_document(str(document.id))
+        return await crud.create_ingestion_job(db, str(document.id))
@@ -1,9 +1,10 @@
-from typing import Dict
+from typing import Any, Dict
 
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
 from app.api import deps
+from app.chat import answer_cache, embedding, engine_cache, index_cache, kg_aliases, pdf_reader, streaming, sub_questions
 
 router = APIRouter()
 
@@ -16,3 +17,135 @@ async def health() -> Dict[str, str]:
     # """
     # await db.execute(text("SELECT 1"))
     return {"status": "alive"}
+
+
+@router.get("/pdf-extraction")
+async def pdf_extraction_stats() -> Dict[str, Any]:
+    """
+    PDF extraction pool size and pages/sec of the most recently extracted documents.
+    """
+    return {
+        "pool_size": pdf_reader.get_extraction_pool_size(),
+        "documents": {
+            document_id: {
+                "page_count": stats.page_count,
+                "shard_count": stats.shard_count,
+                "seconds": stats.seconds,
+                "pages_per_second": stats.pages_per_second,
+                "ocr_page_count": stats.ocr_page_count,
+                "ocr_cache_hits": stats.ocr_cache_hits,
+            }
+            for document_id, stats in pdf_reader.get_extraction_stats().items()
+        },
+    }
+
+
+@router.get("/embedding-cache")
+async def embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Embedding cache hit/miss/eviction counters since the process started.
+    """
+    stats = embedding.embedding_cache_stats
+    return {
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "evictions": stats.evictions,
+        "hit_rate": stats.hit_rate,
+    }
+
+
+@router.get("/index-cache")
+async def index_cache_stats() -> Dict[str, Any]:
+    """
+    Document index cache size and hit/miss/eviction counters since the process started.
+    """
+    cache = index_cache.document_index_cache
+    stats = cache.stats
+    return {
+        "size": cache.currsize,
+        "max_size": cache.maxsize,
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "evictions": stats.evictions,
+        "invalidations": stats.invalidations,
+        "hit_rate": stats.hit_rate,
+    }
+
+
+@router.get("/answer-cache")
+async def answer_cache_stats() -> Dict[str, Any]:
+    """
+    Semantic answer cache size and hit/miss counters since the process started.
+    """
+    cache = answer_cache.answer_cache
+    stats = cache.stats
+    return {
+        "size": cache.size,
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "stores": stats.stores,
+        "expirations": stats.expirations,
+        "invalidations": stats.invalidations,
+        "hit_rate": stats.hit_rate,
+    }
+
+
+@router.get("/kg-synonyms")
+async def kg_synonym_stats() -> Dict[str, Any]:
+    """
+    Knowledge graph synonym expansion cache size and hit/miss counters since the process started.
+    """
+    cache = kg_aliases.synonym_expansion_cache
+    stats = cache.stats
+    return {
+        "size": cache.currsize,
+        "max_size": cache.maxsize,
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "table_hits": stats.table_hits,
+        "llm_expansions": stats.llm_expansions,
+        "hit_rate": stats.hit_rate,
+    }
+
+
+@router.get("/sub-question-memo")
+async def sub_question_memo_stats() -> Dict[str, Any]:
+    """
+    Number of conversations with memoized sub-question answers and memo hit/miss counters since the process started.
+    """
+    stats = engine_cache.sub_question_memo_stats
+    return {
+        "conversations": len(engine_cache.conversation_sub_question_memos),
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "hit_rate": stats.hit_rate,
+    }
+
+
+@router.get("/sub-questions")
+async def sub_question_stats() -> Dict[str, Any]:
+    """
+    Sub-question latency histograms and timeout/error counts per tool since the process started.
+    """
+    governor = sub_questions.sub_question_governor
+    return {
+        tool_name: histogram.to_dict()
+        for tool_name, histogram in governor.tool_latencies.items()
+    }
+
+
+@router.get("/sse-streams")
+async def sse_stream_stats() -> Dict[str, Any]:
+    """
+    Streamed chat message frames/sec and receive queue depth since the process started.
+    """
+    stats = streaming.stream_stats
+    return {
+        "streams": stats.streams,
+        "objects": stats.objects,
+        "frames": stats.frames,
+        "frames_per_second": stats.frames_per_second,
+        "objects_per_frame": stats.objects_per_frame,
+        "mean_queue_depth": stats.mean_queue_depth,
+        "max_queue_depth": stats.max_queue_depth,
+    }
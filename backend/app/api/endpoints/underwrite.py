@@ -113,7 +113,7 @@ async def message_conversation(conversation_id: UUID, user_message: str, db: Asy
     generated, the status of the message will be PENDING. Once the message is generated, the status will
     be SUCCESS. If there was an error in processing the message, the final status will be ERROR.
     """
-    conversation = await crud.fetch_conversation_with_messages(db, str(conversation_id))
+    conversation = await crud.fetch_conversation_for_chat(db, str(conversation_id))
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -0,0 +1,178 @@
+import logging
+import time
+
+import numpy as np
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from cachetools import LRUCache
+from llama_index.embeddings.base import Embedding
+
+from app.chat.embedding import EmbeddingStats, cached_embed_texts
+from app.chat.engine import get_embedding_model
+from app.chat.engine_cache import ChatToolsKey, normalize_question
+from app.core.config import settings
+from app.db.models.base import MessageSubProcessSourceEnum
+from app.schemas.pydantic_schema import Conversation as ConversationSchema
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_answer_cacheable(conversation: ConversationSchema) -> bool:
+    """
+    Only the opening question of a conversation about some documents is answered from (and into)
+    the cache, as the answer to a follow-up question depends on what was said before it
+    """
+
+    return (
+        settings.ANSWER_CACHE_ENABLED
+        and bool(conversation.documents)
+        and not conversation.messages
+        and not conversation.history_summary
+    )
+
+
+async def embed_question(question: str) -> Embedding:
+    """
+    Embedding of the normalized question, through the embedding cache so that repeated
+    questions aren't sent to the embedding model again
+    """
+
+    embeddings = await cached_embed_texts(get_embedding_model(), [normalize_question(question)], EmbeddingStats())
+    return embeddings[0]
+
+
+@dataclass
+class AnswerCacheStats:
+    """
+    Semantic answer cache counters since the process started
+    """
+
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class CachedSubProcess:
+    source: MessageSubProcessSourceEnum
+    metadata_map: Optional[Dict[str, Any]]
+
+
+@dataclass
+class CachedAnswer:
+    """
+    An answer to a question about a set of documents, with the sub-processes that produced its
+    citations. `embedding` is the unit-length embedding of the normalized question.
+    """
+
+    question: str
+    embedding: np.ndarray
+    content: str
+    sub_processes: List[CachedSubProcess] = field(default_factory=list)
+    expires_at: float = 0.0
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by the documents they were given for (ids and content hashes, see
+    get_chat_tools_key) and looked up by the cosine similarity of the question's embedding.
+    Document sets are evicted least recently used first, each keeping its latest answers.
+    """
+
+    def __init__(
+        self,
+        max_document_sets: int,
+        max_answers_per_document_set: int,
+        ttl_seconds: float,
+        similarity_threshold: float,
+    ) -> None:
+        self.max_answers_per_document_set = max_answers_per_document_set
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._answers: "LRUCache[ChatToolsKey, List[CachedAnswer]]" = LRUCache(maxsize=max_document_sets)
+        self.stats = AnswerCacheStats()
+
+    @property
+    def size(self) -> int:
+        return sum(len(answers) for answers in self._answers.values())
+
+    def get_answer(self, key: ChatToolsKey, embedding: Embedding) -> Optional[CachedAnswer]:
+        """
+        The most similar unexpired answer given for the same documents, if it is similar enough
+        """
+
+        answers = self._answers.get(key)
+        now = time.monotonic()
+        if answers:
+            unexpired = [answer for answer in answers if answer.expires_at > now]
+            self.stats.expirations += len(answers) - len(unexpired)
+            answers[:] = unexpired
+        if not answers:
+            self.stats.misses += 1
+            return None
+
+        query = _unit(embedding)
+        similarities = np.stack([answer.embedding for answer in answers]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        logger.info("Answer cache hit with similarity %.3f for %r", similarities[best], answers[best].question)
+        return answers[best]
+
+    def put_answer(
+        self,
+        key: ChatToolsKey,
+        question: str,
+        embedding: Embedding,
+        content: str,
+        sub_processes: List[CachedSubProcess],
+    ) -> None:
+        answers = self._answers.get(key)
+        if answers is None:
+            answers = self._answers[key] = []
+        answers.append(CachedAnswer(
+            question=question,
+            embedding=_unit(embedding),
+            content=content,
+            sub_processes=sub_processes,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        ))
+        del answers[:-self.max_answers_per_document_set]
+        self.stats.stores += 1
+
+    def invalidate_document(self, doc_id: str) -> None:
+        """
+        Drop the answers given for any set of documents that includes the document
+        """
+
+        keys = [key for key in self._answers.keys() if any(key_doc_id == doc_id for key_doc_id, _ in key)]
+        for key in keys:
+            self.stats.invalidations += len(self._answers.pop(key))
+        if keys:
+            logger.info("Invalidated cached answers of %s document sets including %s", len(keys), doc_id)
+
+
+def _unit(embedding: Embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+answer_cache = SemanticAnswerCache(
+    max_document_sets=settings.ANSWER_CACHE_MAX_DOCUMENT_SETS,
+    max_answers_per_document_set=settings.ANSWER_CACHE_MAX_ANSWERS_PER_DOCUMENT_SET,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+from llama_index.embeddings.base import BaseEmbedding, Embedding
+from llama_index.schema import BaseNode, MetadataMode
+
+from app.api import crud
+from app.chat.tokens import count_tokens
+from app.core.config import settings
+from app.db.session import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# Keeps the number of bind parameters per cache query well below the Postgres limit
+EMBEDDING_CACHE_QUERY_BATCH_SIZE = 1000
+EMBEDDING_CACHE_INSERT_BATCH_SIZE = 500
+
+# time.monotonic() of this process's last check of the embedding cache size
+last_eviction_check: Optional[float] = None
+
+
+@dataclass
+class EmbeddingCacheStats:
+    """
+    Embedding cache counters since the process started
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+embedding_cache_stats = EmbeddingCacheStats()
+
+
+@dataclass
+class EmbeddingStats:
+    """
+    Throughput of a single embedding pipeline run
+    """
+
+    texts: int = 0
+    tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+    @property
+    def texts_per_second(self) -> float:
+        return self.texts / self.seconds if self.seconds > 0 else float(self.texts)
+
+
+def batch_by_tokens(token_counts: Sequence[int], max_tokens: int, max_batch_size: int) -> List[List[int]]:
+    """
+    Pack texts (given by their token counts) into batches of indices, in order, so that each
+    batch has at most max_batch_size texts and at most max_tokens tokens. A single text larger
+    than max_tokens gets a batch of its own.
+    """
+
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_tokens = 0
+    for idx, tokens in enumerate(token_counts):
+        if batch and (len(batch) >= max_batch_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(idx)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+async def _embed_batch_with_retry(
+    embed_model: BaseEmbedding,
+    texts: List[str],
+    semaphore: asyncio.Semaphore,
+    max_retries: int,
+    stats: EmbeddingStats,
+) -> List[Embedding]:
+    attempt = 0
+    while True:
+        async with semaphore:
+            try:
+                return await embed_model.aget_text_embedding_batch(texts)
+            except Exception:
+                if attempt >= max_retries:
+                    raise
+                logger.warning("Embedding batch of %s texts failed, retrying", len(texts), exc_info=True)
+        # Exponential backoff with full jitter, outside of the semaphore so other batches can proceed
+        delay = min(settings.EMBEDDING_RETRY_MAX_SECONDS, settings.EMBEDDING_RETRY_BASE_SECONDS * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, delay))
+        attempt += 1
+        stats.retries += 1
+
+
+async def embed_texts(
+    embed_model: BaseEmbedding,
+    texts: List[str],
+    max_tokens: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    max_retries: Optional[int] = None,
+    stats: Optional[EmbeddingStats] = None,
+) -> List[Embedding]:
+    """
+    Embed texts in token-budgeted batches with a bounded number of requests in flight.
+    Embeddings are returned in the same order as the texts.
+    """
+
+    stats = stats if stats is not None else EmbeddingStats()
+    started = time.perf_counter()
+    token_counts = [count_tokens(text) for text in texts]
+    batches = batch_by_tokens(
+        token_counts,
+        max_tokens or settings.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_size or settings.EMBEDDING_BATCH_MAX_SIZE,
+    )
+    semaphore = asyncio.Semaphore(concurrency or settings.EMBEDDING_MAX_CONCURRENCY)
+    max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+    batch_embeddings = await asyncio.gather(*[
+        _embed_batch_with_retry(embed_model, [texts[idx] for idx in batch], semaphore, max_retries, stats)
+        for batch in batches
+    ])
+
+    embeddings: List[Embedding] = [[] for _ in texts]
+    for batch, batch_result in zip(batches, batch_embeddings):
+        for idx, embedding in zip(batch, batch_result):
+            embeddings[idx] = embedding
+
+    stats.texts += len(texts)
+    stats.tokens += sum(token_counts)
+    stats.batches += len(batches)
+    stats.seconds += time.perf_counter() - started
+
+    return embeddings
+
+
+async def evict_cached_embeddings_if_full() -> int:
+    """
+    Evict the least recently used cached embeddings beyond EMBEDDING_CACHE_MAX_ENTRIES if the cache
+    is estimated to have grown past it, checking at most once per eviction interval, and return
+    how many were evicted
+    """
+
+    global last_eviction_check
+    now = time.monotonic()
+    if last_eviction_check is not None and now - last_eviction_check < settings.EMBEDDING_CACHE_EVICTION_INTERVAL_SECONDS:
+        return 0
+    last_eviction_check = now
+
+    async with SessionLocal() as db:
+        if await crud.estimate_cached_embeddings(db) <= settings.EMBEDDING_CACHE_MAX_ENTRIES:
+            return 0
+        evicted = await crud.evict_cached_embeddings(db, settings.EMBEDDING_CACHE_MAX_ENTRIES)
+
+    logger.info("Evicted %s cached embeddings", evicted)
+    return evicted
+
+
+async def cached_embed_texts(embed_model: BaseEmbedding, texts: List[str], stats: EmbeddingStats) -> List[Embedding]:
+    """
+    Embed texts, looking each one up in the embedding cache by (model name, SHA-256 of the text)
+    first so that only cache misses are sent to the embedding model
+    """
+
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return await embed_texts(embed_model, texts, stats=stats)
+
+    model_name = embed_model.model_name
+    text_hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+    cached: Dict[str, Embedding] = {}
+    async with SessionLocal() as db:
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        for start in range(0, len(unique_hashes), EMBEDDING_CACHE_QUERY_BATCH_SIZE):
+            cached.update(await crud.fetch_cached_embeddings(
+                db, model_name, unique_hashes[start:start + EMBEDDING_CACHE_QUERY_BATCH_SIZE]
+            ))
+
+    miss_hashes = list(dict.fromkeys(text_hash for text_hash in text_hashes if text_hash not in cached))
+    hash_to_text = dict(zip(text_hashes, texts))
+    fresh = dict(zip(
+        miss_hashes,
+        await embed_texts(embed_model, [hash_to_text[text_hash] for text_hash in miss_hashes], stats=stats),
+    ))
+
+    evicted = 0
+    if fresh:
+        async with SessionLocal() as db:
+            fresh_items = list(fresh.items())
+            for start in range(0, len(fresh_items), EMBEDDING_CACHE_INSERT_BATCH_SIZE):
+                await crud.insert_cached_embeddings(
+                    db, model_name, dict(fresh_items[start:start + EMBEDDING_CACHE_INSERT_BATCH_SIZE])
+                )
+        evicted = await evict_cached_embeddings_if_full()
+
+    hits = len(texts) - sum(1 for text_hash in text_hashes if text_hash not in cached)
+    stats.cache_hits += hits
+    stats.cache_misses += len(texts) - hits
+    embedding_cache_stats.hits += hits
+    embedding_cache_stats.misses += len(texts) - hits
+    embedding_cache_stats.evictions += evicted
+
+    return [cached.get(text_hash) or fresh[text_hash] for text_hash in text_hashes]
+
+
+async def embed_nodes(embed_model: BaseEmbedding, nodes: Sequence[BaseNode]) -> EmbeddingStats:
+    """
+    Set the embedding of every node that doesn't have one yet, batching across all of the given
+    nodes regardless of which document they came from
+    """
+
+    stats = EmbeddingStats()
+    nodes_to_embed = [node for node in nodes if node.embedding is None]
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes_to_embed]
+    embeddings = await cached_embed_texts(embed_model, texts, stats)
+    for node, embedding in zip(nodes_to_embed, embeddings):
+        node.embedding = embedding
+
+    logger.info(
+        "Embedded %s nodes (%s cache hits, %s tokens sent) in %s batches and %.2fs (%s retries)",
+        len(nodes_to_embed), stats.cache_hits, stats.tokens, stats.batches, stats.seconds, stats.retries,
+    )
+
+    return stats
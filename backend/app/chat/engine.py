@@ -1,12 +1,11 @@
-import io
 import logging
+import time
 import s3fs
+import fsspec
 import fitz
 import nest_asyncio
 
-from datetime import timedelta
-from cachetools import cached, TTLCache
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional
 from pathlib import Path
 from datetime import datetime
 from fsspec.asyn import AsyncFileSystem
@@ -20,18 +19,16 @@ from llama_index import (
 )
 from llama_index.prompts.prompt_type import PromptType
 from llama_index.vector_stores.types import VectorStore
-from llama_index.schema import Document as LlamaIndexDocument
+from llama_index.schema import BaseNode, Document as LlamaIndexDocument
 from llama_index.agent import OpenAIAgent
-from llama_index.llms import ChatMessage, OpenAI
+from llama_index.llms import OpenAI
 from llama_index.embeddings.openai import (
     OpenAIEmbedding,
     OpenAIEmbeddingMode,
     OpenAIEmbeddingModelType,
 )
-from llama_index.llms.base import MessageRole
 from llama_index.callbacks.base import BaseCallbackHandler, CallbackManager
 from llama_index.tools import QueryEngineTool, ToolMetadata
-from llama_index.query_engine import SubQuestionQueryEngine
 from llama_index.indices.query.base import BaseQueryEngine
 from llama_index import (
     ServiceContext,
@@ -43,13 +40,12 @@ from llama_index.query_engine import RetrieverQueryEngine
 from llama_index import get_response_synthesizer, load_index_from_storage
 from llama_index.node_parser.simple import SimpleNodeParser
 
-from app.core.config import settings
+from app.core.config import StorageBackendEnum, settings
 from app.schemas.pydantic_schema import (
-    Message as MessageSchema,
     Document as DocumentSchema,
     Conversation as ConversationSchema,
 )
-from app.db.models.base import MessageRoleEnum, MessageStatusEnum
+from app.db.models.base import IngestionStageEnum, RetrievalModeEnum
 from app.chat.constants import (
     DB_DOC_ID_KEY,
     SYSTEM_MESSAGE,
@@ -57,9 +53,29 @@ from app.chat.constants import (
     NODE_PARSER_CHUNK_SIZE,
 )
 from app.chat.kg_retriever_custom import KnowledgeGraphRAGRetriever
+from app.chat.kg_entities import GraphEntityExtractor
 from app.chat.tools import build_title_for_document
 from app.chat.pg_vector import get_vector_store_singleton
+from app.chat.pdf_reader import extract_pages
+from app.chat.embedding import embed_nodes
+from app.chat.s3_io import spool_s3_object
+from app.chat.storage import load_document_storage_context, persist_document_shards
+from app.chat.pg_storage import get_postgres_storage_context, load_postgres_storage_context, persist_storage_contexts
+from app.chat.index_cache import document_index_cache, with_service_context
+from app.chat.engine_cache import (
+    ChatTools,
+    MemoizedQueryEngine,
+    chat_tools_cache,
+    current_callback_handler,
+    current_sub_question_memo,
+    get_chat_tools_key,
+    get_sub_question_memo,
+    request_callback_handler,
+)
 from app.chat.qa_response_synth import get_custom_response_synth
+from app.chat.history import build_chat_history
+from app.chat.sub_questions import GovernedSubQuestionQueryEngine
+from app.chat.multi_document import CONSOLIDATED_TOOL_NAME, MultiDocumentRetriever, get_retrieval_mode
 from app.api.crud import fetch_kg_index
 from app.db.session import SessionLocal
 
@@ -68,6 +84,9 @@ logger = logging.getLogger(__name__)
 logger.info("Applying nested asyncio patch")
 nest_asyncio.apply()
 
+# Notified as a document moves through the ingestion stages
+StageCallback = Callable[[IngestionStageEnum], Awaitable[None]]
+
 
 def get_s3_fs() -> AsyncFileSystem:
     s3 = s3fs.S3FileSystem(
@@ -79,7 +98,16 @@ def get_s3_fs() -> AsyncFileSystem:
     return s3
 
 
-def fetch_and_read_document(document: DocumentSchema) -> List[LlamaIndexDocument]:
+def get_local_fs() -> fsspec.AbstractFileSystem:
+    return fsspec.filesystem("file", auto_mkdir=True)
+
+
+async def report_stage(on_stage: Optional[StageCallback], stage: IngestionStageEnum) -> None:
+    if on_stage is not None:
+        await on_stage(stage)
+
+
+async def fetch_and_read_document(document: DocumentSchema, on_stage: Optional[StageCallback] = None) -> List[LlamaIndexDocument]:
     """
     Reading a document (in the Pydantic schema format, as retrieved from database)
     and returning a LLaMA Index document
@@ -87,28 +115,29 @@ def fetch_and_read_document(document: DocumentSchema) -> List[LlamaIndexDocument
 
     s3 = get_s3_fs()
     filename = Path(document.url).name
-    f = s3.open(f"{settings.S3_ASSET_BUCKET_NAME}/{filename}", "rb")
-    doc = fitz.open(stream=io.BytesIO(f.read()), filetype="pdf")
+    # Spool to a local file rather than holding the whole PDF in memory
+    await report_stage(on_stage, IngestionStageEnum.DOWNLOAD)
+    with spool_s3_object(s3, f"{settings.S3_ASSET_BUCKET_NAME}/{filename}", suffix=".pdf") as spooled:
+        await report_stage(on_stage, IngestionStageEnum.EXTRACT)
+        with fitz.open(spooled.path, filetype="pdf") as doc:
+            page_count = len(doc)
+        page_texts = await extract_pages(str(document.id), spooled.path, page_count, spooled.sha256)
+
     extra_info = {
         DB_DOC_ID_KEY: str(document.id),
-        "total_pages": len(doc),
+        "total_pages": page_count,
         "file_path": document.url,
         "file_name": document.url
     }
 
     data = []
-    for page in doc:
-        # if there's no text, try ocr on the page
-        text = page.get_text().encode("utf-8")
-        if len(text) == 0:
-            text = page.get_textpage_ocr().extractText().encode("utf-8")
-
+    for page_number, page_text in enumerate(page_texts):
         data.append(LlamaIndexDocument(
-            text=text,
+            text=page_text.encode("utf-8"),
             metadata={},
             extra_info=dict(
                 extra_info,
-                **{"source": f"{page.number + 1}", "page_label": page.number + 1, },
+                **{"source": f"{page_number + 1}", "page_label": page_number + 1, },
             ),
         ))
 
@@ -121,82 +150,165 @@ def build_description_for_document(document: DocumentSchema) -> str:
 
 def index_to_query_engine(doc_id: str, index: VectorStoreIndex) -> BaseQueryEngine:
     kwargs = {"similarity_top_k": 3}
-    return index.as_query_engine(**kwargs)
+    return MemoizedQueryEngine(doc_id, index.as_query_engine(**kwargs))
+
+
+async def build_consolidated_query_engine_tool(
+    service_context: ServiceContext, documents: List[DocumentSchema]
+) -> QueryEngineTool:
+    """
+    A single tool answering from all of the documents with one vector store query per question,
+    rather than a tool per document. Documents are indexed by their ingestion jobs, so nothing
+    is loaded or indexed here.
+    """
+
+    retriever = MultiDocumentRetriever(
+        await get_vector_store_singleton(),
+        [str(doc.id) for doc in documents],
+        service_context,
+    )
+    query_engine = RetrieverQueryEngine.from_args(retriever, service_context=service_context)
+    titles = "\n".join("- " + build_title_for_document(doc) for doc in documents)
+
+    return QueryEngineTool(
+        query_engine=MemoizedQueryEngine(CONSOLIDATED_TOOL_NAME, query_engine),
+        metadata=ToolMetadata(
+            name=CONSOLIDATED_TOOL_NAME,
+            description=f"Searches all of the documents that the user pre-selected to discuss with the assistant:\n{titles}",
+        ),
+    )
 
 
-@cached(TTLCache(maxsize=10, ttl=timedelta(minutes=5).total_seconds()), key=lambda *args, **kwargs: "global_storage_context")
 def get_storage_context(persist_dir: str, vector_store: VectorStore, fs: Optional[AsyncFileSystem] = None) -> StorageContext:
     logger.info("Fetching storage context.")
     return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store, fs=fs)
 
 
-async def build_doc_id_to_index_map(service_context: ServiceContext, documents: List[DocumentSchema], fs: Optional[AsyncFileSystem] = None) -> Dict[str, VectorStoreIndex]:
+async def build_doc_id_to_index_map(
+    service_context: ServiceContext,
+    documents: List[DocumentSchema],
+    fs: Optional[AsyncFileSystem] = None,
+    on_stage: Optional[StageCallback] = None,
+) -> Dict[str, VectorStoreIndex]:
+    """
+    Get the index of each document from the in-process index cache, or else load it from Postgres
+    or from its own S3 storage shard (falling back to the legacy storage context persisted as a
+    whole), and index the documents not found
+    """
+
     persist_dir = f"{settings.S3_BUCKET_NAME}"
+    fs = fs or get_local_fs()
     vector_store = await get_vector_store_singleton()
-    try:
+    all_index_ids = [str(doc.id) for doc in documents]
+    id_to_content_hash = {str(doc.id): doc.content_hash for doc in documents}
+    doc_id_to_index: Dict[str, VectorStoreIndex] = {}
+    for index_id in all_index_ids:
+        cached_index = document_index_cache.get_index(index_id, id_to_content_hash[index_id])
+        if cached_index is not None:
+            doc_id_to_index[index_id] = with_service_context(cached_index, service_context)
+    index_ids = [index_id for index_id in all_index_ids if index_id not in doc_id_to_index]
+    if not index_ids:
+        return doc_id_to_index
+
+    if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.POSTGRES:
+        storage_context, missing_ids = await load_postgres_storage_context(index_ids, vector_store)
+    else:
+        storage_context, missing_ids = load_document_storage_context(persist_dir, index_ids, vector_store, fs)
+    loaded_ids = [index_id for index_id in index_ids if index_id not in missing_ids]
+    if loaded_ids:
+        indices = load_indices_from_storage(storage_context, index_ids=loaded_ids, service_context=service_context)
+        doc_id_to_index.update(zip(loaded_ids, indices))
+        logger.info("Loaded %s indices from %s storage.", len(loaded_ids), settings.INDEX_STORAGE_BACKEND.value)
+
+    if missing_ids and settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.S3:
         try:
-            storage_context = get_storage_context(persist_dir, vector_store, fs=fs)
+            legacy_storage_context = get_storage_context(persist_dir, vector_store, fs=fs)
+            legacy_ids = [
+                index_id for index_id in missing_ids
+                if legacy_storage_context.index_store.get_index_struct(index_id) is not None
+            ]
         except FileNotFoundError:
-            logger.error("Could not find storage context in S3. Creating new storage context.")
-            storage_context = StorageContext.from_defaults(vector_store=vector_store, fs=fs)
-            storage_context.persist(persist_dir=persist_dir, fs=fs)
-
-        index_ids = [str(doc.id) for doc in documents]
-        indices = load_indices_from_storage(
-            storage_context,
-            index_ids=index_ids,
-            service_context=service_context,
-        )
-
-        doc_id_to_index = dict(zip(index_ids, indices))
-        logger.info("Loaded indices from storage.")
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store, fs=fs)
-    except ValueError:
-        logger.error("Failed to load indices from storage. Creating new indices.", exc_info=True)
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store, fs=fs)
-        doc_id_to_index = {}
-        for doc in documents:
-            llama_index_docs = fetch_and_read_document(doc)
-            storage_context.docstore.add_documents(llama_index_docs)
-            index = VectorStoreIndex.from_documents(
-                llama_index_docs,
-                storage_context=storage_context,
+            legacy_ids = []
+        if legacy_ids:
+            indices = load_indices_from_storage(
+                legacy_storage_context,
+                index_ids=legacy_ids,
                 service_context=service_context,
             )
-            index.set_index_id(str(doc.id))
-            index.storage_context.persist(persist_dir=persist_dir, fs=fs)
-            doc_id_to_index[str(doc.id)] = index
+            doc_id_to_index.update(zip(legacy_ids, indices))
+            logger.info("Loaded %s indices from the legacy storage context.", len(legacy_ids))
+            missing_ids = [index_id for index_id in missing_ids if index_id not in legacy_ids]
 
-    return doc_id_to_index
+    if missing_ids:
+        logger.info("No stored index for %s documents. Creating new indices.", len(missing_ids))
+        missing_documents = [doc for doc in documents if str(doc.id) in missing_ids]
+        doc_id_to_index.update(await index_documents(service_context, missing_documents, fs=fs, on_stage=on_stage))
 
+    for index_id in index_ids:
+        if index_id in doc_id_to_index:
+            document_index_cache.put_index(index_id, id_to_content_hash[index_id], doc_id_to_index[index_id])
+
+    return {index_id: doc_id_to_index[index_id] for index_id in all_index_ids if index_id in doc_id_to_index}
 
-def get_chat_history(chat_messages: List[MessageSchema]) -> List[ChatMessage]:
-    """
-    Given a list of chat messages, return a list of ChatMessage instances.
 
-    Failed chat messages are filtered out and then the remaining ones are
-    sorted by created_at.
+async def index_documents(
+    service_context: ServiceContext,
+    documents: List[DocumentSchema],
+    fs: Optional[AsyncFileSystem] = None,
+    on_stage: Optional[StageCallback] = None,
+) -> Dict[str, VectorStoreIndex]:
+    """
+    Parse, embed and persist a new index for each of the given documents.
+    Nodes from all of the documents are embedded together in token-budgeted batches and
+    written to the vector store in bulk. Only the new documents' docstore and index store
+    entries are written, to Postgres or to their own S3 storage shards. Any nodes of an earlier
+    index of the documents are deleted along with the insert.
     """
 
-    # pre-process chat messages
-    chat_messages = [
-        m
-        for m in chat_messages
-        if m.content.strip() and m.status == MessageStatusEnum.SUCCESS
-    ]
-    # TODO: could be a source of high CPU utilization
-    chat_messages = sorted(chat_messages, key=lambda m: m.created_at)
-
-    chat_history = []
-    for message in chat_messages:
-        role = (
-            MessageRole.ASSISTANT
-            if message.role == MessageRoleEnum.assistant
-            else MessageRole.USER
-        )
-        chat_history.append(ChatMessage(content=message.content, role=role))
+    persist_dir = f"{settings.S3_BUCKET_NAME}"
+    fs = fs or get_local_fs()
+    vector_store = await get_vector_store_singleton()
+    doc_id_to_storage_context: Dict[str, StorageContext] = {}
+    doc_id_to_nodes: Dict[str, List[BaseNode]] = {}
+    for doc in documents:
+        llama_index_docs = await fetch_and_read_document(doc, on_stage=on_stage)
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        storage_context.docstore.add_documents(llama_index_docs)
+        for llama_index_doc in llama_index_docs:
+            storage_context.docstore.set_document_hash(llama_index_doc.get_doc_id(), llama_index_doc.hash)
+        doc_id_to_storage_context[str(doc.id)] = storage_context
+        doc_id_to_nodes[str(doc.id)] = service_context.node_parser.get_nodes_from_documents(llama_index_docs)
+
+    await report_stage(on_stage, IngestionStageEnum.EMBED)
+    all_nodes = [node for nodes in doc_id_to_nodes.values() for node in nodes]
+    await embed_nodes(service_context.embed_model, all_nodes)
+
+    await report_stage(on_stage, IngestionStageEnum.PERSIST)
+    # Drops the nodes of any earlier index of the documents, e.g. from a re-upload or a retried job
+    vector_store.replace_documents(list(doc_id_to_nodes), all_nodes)
+    doc_id_to_index = {}
+    for doc_id, storage_context in doc_id_to_storage_context.items():
+        # The vector store keeps the node text, so each index struct only needs to be registered;
+        # this matches what VectorStoreIndex.from_documents stores for a text-storing vector store
+        index = VectorStoreIndex([], storage_context=storage_context, service_context=service_context)
+        index.set_index_id(doc_id)
+        doc_id_to_index[doc_id] = index
+    if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.POSTGRES:
+        await persist_storage_contexts(doc_id_to_storage_context)
+    else:
+        persist_document_shards(persist_dir, doc_id_to_storage_context, fs)
 
-    return chat_history
+    return doc_id_to_index
+
+
+def get_embedding_model() -> OpenAIEmbedding:
+    return OpenAIEmbedding(
+        mode=OpenAIEmbeddingMode.SIMILARITY_MODE,
+        model_type=OpenAIEmbeddingModelType.TEXT_EMBED_ADA_002,
+        api_key=settings.OPENAI_API_KEY,
+        api_base=settings.EMBEDDING_API_BASE,
+        embed_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    )
 
 
 def get_tool_service_context(callback_handlers: List[BaseCallbackHandler]) -> ServiceContext:
@@ -208,11 +320,7 @@ def get_tool_service_context(callback_handlers: List[BaseCallbackHandler]) -> Se
         additional_kwargs={"api_key": settings.OPENAI_API_KEY},
     )
     callback_manager = CallbackManager(callback_handlers)
-    embedding_model = OpenAIEmbedding(
-        mode=OpenAIEmbeddingMode.SIMILARITY_MODE,
-        model_type=OpenAIEmbeddingModelType.TEXT_EMBED_ADA_002,
-        api_key=settings.OPENAI_API_KEY,
-    )
+    embedding_model = get_embedding_model()
     # Use a smaller chunk size to retrieve more granular results
     node_parser = SimpleNodeParser.from_defaults(
         chunk_size=NODE_PARSER_CHUNK_SIZE,
@@ -229,8 +337,13 @@ def get_tool_service_context(callback_handlers: List[BaseCallbackHandler]) -> Se
     return service_context
 
 
-async def get_chat_engine(callback_handler: BaseCallbackHandler, conversation: ConversationSchema) -> OpenAIAgent:
-    service_context = get_tool_service_context([callback_handler])
+async def build_chat_tools(conversation: ConversationSchema) -> ChatTools:
+    """
+    Build the LLM clients, query engines and tools of a chat engine for the conversation's documents.
+    Events are reported to the callback handler of whichever chat message is using them.
+    """
+
+    service_context = get_tool_service_context([request_callback_handler])
     s3_fs = get_s3_fs()
 
     # [TODO: hacky way to use the knowledge graph, please change this for the love of god]
@@ -239,13 +352,24 @@ async def get_chat_engine(callback_handler: BaseCallbackHandler, conversation: C
         service_context = ServiceContext.from_defaults(llm=llm, chunk_size=512)
         response_synthesizer = get_response_synthesizer(response_mode="tree_summarize")
         persist_dir = f"{settings.S3_BUCKET_NAME}"
-        storage_context = StorageContext.from_defaults(fs=s3_fs, persist_dir=persist_dir)
-
+        if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.POSTGRES:
+            storage_context = get_postgres_storage_context()
+        else:
+            storage_context = StorageContext.from_defaults(fs=s3_fs, persist_dir=persist_dir)
+
+        kg_retriever_kwargs = {}
+        if settings.KG_OFFLINE_ENTITY_EXTRACTION:
+            # Match the graph's own entities in the query, only asking the LLM when there are none
+            kg_retriever_kwargs = {
+                "entity_extract_fn": GraphEntityExtractor(storage_context.graph_store),
+                "entity_extract_policy": "fallback",
+            }
         graph_retriever = KnowledgeGraphRAGRetriever(
             storage_context=storage_context,
             service_context=service_context,
             llm=llm,
             verbose=True,
+            **kg_retriever_kwargs,
         )
         graph_query_engine = RetrieverQueryEngine.from_args(
             graph_retriever,
@@ -299,7 +423,7 @@ Answer:
             structured_answer_filtering=True,
         )
 
-        question_engine = SubQuestionQueryEngine.from_defaults(
+        question_engine = GovernedSubQuestionQueryEngine.from_defaults(
             query_engine_tools=query_engine_tools,
             service_context=service_context,
             response_synthesizer=response_synth,
@@ -319,27 +443,32 @@ A query engine that can answer questions about data in the knowledge graph that
             ),
         ]
     else:
-        doc_id_to_index = await build_doc_id_to_index_map(service_context, conversation.documents, fs=s3_fs)
-        id_to_doc: Dict[str, DocumentSchema] = {
-            str(doc.id): doc for doc in conversation.documents
-        }
-
-        query_engine_tools = [
-            QueryEngineTool(
-                query_engine=index_to_query_engine(doc_id, index),
-                metadata=ToolMetadata(
-                    name=doc_id,
-                    description=build_description_for_document(
-                        id_to_doc[doc_id]),
-                ),
-            )
-            for doc_id, index in doc_id_to_index.items()
-        ]
+        if get_retrieval_mode(conversation) == RetrievalModeEnum.CONSOLIDATED:
+            query_engine_tools = [
+                await build_consolidated_query_engine_tool(service_context, conversation.documents)
+            ]
+        else:
+            doc_id_to_index = await build_doc_id_to_index_map(service_context, conversation.documents, fs=s3_fs)
+            id_to_doc: Dict[str, DocumentSchema] = {
+                str(doc.id): doc for doc in conversation.documents
+            }
+
+            query_engine_tools = [
+                QueryEngineTool(
+                    query_engine=index_to_query_engine(doc_id, index),
+                    metadata=ToolMetadata(
+                        name=doc_id,
+                        description=build_description_for_document(
+                            id_to_doc[doc_id]),
+                    ),
+                )
+                for doc_id, index in doc_id_to_index.items()
+            ]
 
         response_synth = get_custom_response_synth(
             service_context, conversation.documents)
 
-        qualitative_question_engine = SubQuestionQueryEngine.from_defaults(
+        qualitative_question_engine = GovernedSubQuestionQueryEngine.from_defaults(
             query_engine_tools=query_engine_tools,
             service_context=service_context,
             response_synthesizer=response_synth,
@@ -367,8 +496,28 @@ A query engine that can answer questions about data in the knowledge graph that
         api_key=settings.OPENAI_API_KEY,
         additional_kwargs={"api_key": settings.OPENAI_API_KEY},
     )
-    chat_messages: List[MessageSchema] = conversation.messages
-    chat_history = get_chat_history(chat_messages)
+
+    return ChatTools(tools=top_level_sub_tools, llm=chat_llm, callback_manager=service_context.callback_manager)
+
+
+async def get_chat_engine(callback_handler: BaseCallbackHandler, conversation: ConversationSchema) -> OpenAIAgent:
+    """
+    Get a chat engine for the conversation. The tool graph is cached per set of documents and
+    retrieval mode, so only the chat history and the callback handler are new for each message.
+    """
+
+    current_callback_handler.set(callback_handler)
+    current_sub_question_memo.set(get_sub_question_memo(str(conversation.id)))
+    chat_tools_key = get_chat_tools_key(conversation.documents)
+    retrieval_mode = get_retrieval_mode(conversation)
+    chat_tools = chat_tools_cache.get((retrieval_mode, chat_tools_key))
+    if chat_tools is None:
+        started = time.perf_counter()
+        chat_tools = await build_chat_tools(conversation)
+        chat_tools_cache[(retrieval_mode, chat_tools_key)] = chat_tools
+        logger.info("Built chat tools for %s documents in %.2fs", len(chat_tools_key), time.perf_counter() - started)
+
+    chat_history = await build_chat_history(conversation)
     logger.debug("Chat history: %s", chat_history)
 
     if conversation.documents:
@@ -380,12 +529,12 @@ A query engine that can answer questions about data in the knowledge graph that
 
     curr_date = datetime.utcnow().strftime("%Y-%m-%d")
     chat_engine = OpenAIAgent.from_tools(
-        tools=top_level_sub_tools,
-        llm=chat_llm,
+        tools=chat_tools.tools,
+        llm=chat_tools.llm,
         chat_history=chat_history,
         verbose=settings.VERBOSE,
         system_prompt=SYSTEM_MESSAGE.format(doc_titles=doc_titles, curr_date=curr_date),
-        callback_manager=service_context.callback_manager,
+        callback_manager=chat_tools.callback_manager,
         max_function_calls=3,
     )
 
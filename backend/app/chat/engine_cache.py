@@ -0,0 +1,229 @@
+import logging
+import re
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from cachetools import LRUCache, TTLCache
+from llama_index.callbacks.base import BaseCallbackHandler, CallbackManager
+from llama_index.callbacks.schema import CBEventType
+from llama_index.indices.query.base import BaseQueryEngine
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.llms import OpenAI
+from llama_index.response.schema import RESPONSE_TYPE
+from llama_index.tools import QueryEngineTool
+
+from app.core.config import settings
+from app.schemas.pydantic_schema import Document as DocumentSchema
+
+
+logger = logging.getLogger(__name__)
+
+# Callback handler of the chat message being handled in the current asyncio task
+current_callback_handler: ContextVar[Optional[BaseCallbackHandler]] = ContextVar("current_callback_handler", default=None)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lower-cased, with runs of whitespace collapsed and trailing punctuation removed, so that
+    trivially different phrasings of a question embed (and hash) the same
+    """
+
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!.").strip().lower()
+
+
+class RequestCallbackHandler(BaseCallbackHandler):
+    """
+    Forwards events to the callback handler of the chat message being handled, so that a cached
+    tool graph reports to whichever request is using it. asyncio tasks inherit the context of the
+    task that created them, so events of sub-questions answered concurrently are forwarded too.
+    """
+
+    def __init__(self) -> None:
+        super().__init__([], [])
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        handler = current_callback_handler.get()
+        if handler is not None and event_type not in handler.event_starts_to_ignore:
+            handler.on_event_start(event_type, payload, event_id=event_id, parent_id=parent_id, **kwargs)
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        handler = current_callback_handler.get()
+        if handler is not None and event_type not in handler.event_ends_to_ignore:
+            handler.on_event_end(event_type, payload, event_id=event_id, **kwargs)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        handler = current_callback_handler.get()
+        if handler is not None:
+            handler.start_trace(trace_id)
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        handler = current_callback_handler.get()
+        if handler is not None:
+            handler.end_trace(trace_id, trace_map)
+
+
+request_callback_handler = RequestCallbackHandler()
+
+
+@dataclass
+class ChatTools:
+    """
+    The parts of a chat engine that only depend on the conversation's documents
+    """
+
+    tools: List[QueryEngineTool]
+    llm: OpenAI
+    callback_manager: CallbackManager
+
+
+ChatToolsKey = Tuple[Tuple[str, Optional[str]], ...]
+
+# Keyed by the retrieval mode and the documents' ChatToolsKey
+chat_tools_cache: "TTLCache[Tuple[str, ChatToolsKey], ChatTools]" = TTLCache(
+    maxsize=settings.CHAT_ENGINE_CACHE_MAX_ENTRIES,
+    ttl=settings.CHAT_ENGINE_CACHE_TTL_SECONDS,
+)
+
+
+def get_chat_tools_key(documents: Sequence[DocumentSchema]) -> ChatToolsKey:
+    """
+    The sorted document ids of a conversation, with their content hashes so that
+    re-uploaded documents get a new tool graph
+    """
+
+    return tuple(sorted((str(doc.id), doc.content_hash) for doc in documents))
+
+
+def invalidate_knowledge_graph_tools() -> None:
+    """
+    Drop the cached tools of conversations without documents, which query the knowledge graph,
+    so that the next message loads the graph with its newly added triplets
+    """
+
+    keys = [key for key in list(chat_tools_cache.keys()) if key[1] == ()]
+    for key in keys:
+        chat_tools_cache.pop(key, None)
+    if keys:
+        logger.info("Invalidated %s cached knowledge graph tools", len(keys))
+
+
+@dataclass
+class SubQuestionMemoStats:
+    """
+    Sub-question memo counters since the process started
+    """
+
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+sub_question_memo_stats = SubQuestionMemoStats()
+
+SubQuestionKey = Tuple[str, str]
+
+
+class SubQuestionMemo(LRUCache):
+    """
+    Responses of a conversation's document query engines keyed by (document id, normalized
+    sub-question), so that a sub-question asked again in the same conversation skips retrieval
+    and synthesis. Remembers which keys were answered from the memo, to report them as such.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize=maxsize)
+        self.hit_keys: Set[SubQuestionKey] = set()
+
+    def get_response(self, doc_id: str, question: str) -> Optional[RESPONSE_TYPE]:
+        key = (doc_id, normalize_question(question))
+        response = self.get(key)
+        if response is None:
+            sub_question_memo_stats.misses += 1
+            return None
+
+        sub_question_memo_stats.hits += 1
+        self.hit_keys.add(key)
+        return response
+
+    def put_response(self, doc_id: str, question: str, response: RESPONSE_TYPE) -> None:
+        key = (doc_id, normalize_question(question))
+        self[key] = response
+        self.hit_keys.discard(key)
+
+    def was_hit(self, doc_id: str, question: str) -> bool:
+        return (doc_id, normalize_question(question)) in self.hit_keys
+
+
+# Sub-question memo of the conversation whose message is being handled in the current asyncio task
+current_sub_question_memo: ContextVar[Optional[SubQuestionMemo]] = ContextVar("current_sub_question_memo", default=None)
+
+conversation_sub_question_memos: "TTLCache[str, SubQuestionMemo]" = TTLCache(
+    maxsize=settings.SUB_QUESTION_MEMO_MAX_CONVERSATIONS,
+    ttl=settings.SUB_QUESTION_MEMO_TTL_SECONDS,
+)
+
+
+def get_sub_question_memo(conversation_id: str) -> SubQuestionMemo:
+    memo = conversation_sub_question_memos.get(conversation_id)
+    if memo is None:
+        memo = SubQuestionMemo(settings.SUB_QUESTION_MEMO_MAX_ENTRIES)
+    # Setting the entry again keeps the memo of an active conversation from expiring
+    conversation_sub_question_memos[conversation_id] = memo
+    return memo
+
+
+class MemoizedQueryEngine(BaseQueryEngine):
+    """
+    Answers queries from the current conversation's sub-question memo, falling back to the
+    document's query engine. As the tool graph is shared by every conversation about the same
+    documents, the memo is looked up through current_sub_question_memo on each query.
+    """
+
+    def __init__(self, doc_id: str, query_engine: BaseQueryEngine) -> None:
+        super().__init__(query_engine.callback_manager)
+        self._doc_id = doc_id
+        self._query_engine = query_engine
+
+    def _get_prompt_modules(self) -> Dict[str, Any]:
+        return {"query_engine": self._query_engine}
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        memo = current_sub_question_memo.get()
+        response = memo.get_response(self._doc_id, query_bundle.query_str) if memo is not None else None
+        if response is None:
+            response = self._query_engine.query(query_bundle)
+            if memo is not None:
+                memo.put_response(self._doc_id, query_bundle.query_str, response)
+        return response
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        memo = current_sub_question_memo.get()
+        response = memo.get_response(self._doc_id, query_bundle.query_str) if memo is not None else None
+        if response is None:
+            response = await self._query_engine.aquery(query_bundle)
+            if memo is not None:
+                memo.put_response(self._doc_id, query_bundle.query_str, response)
+        return response
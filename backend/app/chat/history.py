@@ -0,0 +1,167 @@
+import logging
+
+from dataclasses import dataclass
+from typing import List, Optional
+from datetime import datetime
+from llama_index.llms import ChatMessage, OpenAI
+from llama_index.llms.base import LLM, MessageRole
+
+from app.api import crud
+from app.chat.tokens import count_tokens
+from app.core.config import settings
+from app.db.models.base import MessageRoleEnum, MessageStatusEnum
+from app.db.session import SessionLocal
+from app.schemas.pydantic_schema import Conversation as ConversationSchema, Message as MessageSchema
+
+
+logger = logging.getLogger(__name__)
+
+# Tokens the OpenAI chat format adds to every message on top of its content
+MESSAGE_TOKEN_OVERHEAD = 4
+
+SUMMARY_PROMPT = """\
+Below is a summary of the beginning of a conversation between a user and an assistant \
+answering questions about financial documents, followed by the messages that came after it.
+Write a new summary of the whole conversation in at most {max_words} words. Keep the \
+companies, figures, dates and conclusions that later questions may refer to.
+
+Summary so far:
+{summary}
+
+Messages:
+{transcript}
+
+New summary:"""
+
+SUMMARY_MESSAGE = "Summary of the earlier part of this conversation:\n{summary}"
+
+
+@dataclass
+class HistoryWindow:
+    """
+    The latest messages of a conversation that fit the token budget, and the older
+    messages that haven't been folded into the conversation's summary yet
+    """
+
+    messages: List[MessageSchema]
+    to_summarize: List[MessageSchema]
+
+
+def select_history_window(
+    chat_messages: List[MessageSchema],
+    token_budget: int,
+    summary_until: Optional[datetime] = None,
+) -> HistoryWindow:
+    """
+    Given a conversation's messages, oldest first, keep the latest successful ones whose tokens
+    fit the budget. The window always starts on a user message so that it never opens with the
+    answer to a question that was left out.
+    """
+
+    chat_messages = [
+        m
+        for m in chat_messages
+        if m.content.strip() and m.status == MessageStatusEnum.SUCCESS
+    ]
+
+    start = len(chat_messages)
+    tokens = 0
+    while start > 0:
+        message_tokens = count_tokens(chat_messages[start - 1].content) + MESSAGE_TOKEN_OVERHEAD
+        if tokens + message_tokens > token_budget:
+            break
+        tokens += message_tokens
+        start -= 1
+    while start < len(chat_messages) and chat_messages[start].role != MessageRoleEnum.user:
+        start += 1
+
+    return HistoryWindow(
+        messages=chat_messages[start:],
+        to_summarize=[
+            m for m in chat_messages[:start] if summary_until is None or m.created_at > summary_until
+        ],
+    )
+
+
+def get_chat_history(chat_messages: List[MessageSchema]) -> List[ChatMessage]:
+    """
+    Given a list of chat messages, oldest first, return a list of ChatMessage instances.
+
+    Failed chat messages are filtered out.
+    """
+
+    chat_history = []
+    for message in chat_messages:
+        if not message.content.strip() or message.status != MessageStatusEnum.SUCCESS:
+            continue
+        role = (
+            MessageRole.ASSISTANT
+            if message.role == MessageRoleEnum.assistant
+            else MessageRole.USER
+        )
+        chat_history.append(ChatMessage(content=message.content, role=role))
+
+    return chat_history
+
+
+def get_summary_llm() -> OpenAI:
+    return OpenAI(
+        temperature=0,
+        model=settings.CHAT_HISTORY_SUMMARY_MODEL,
+        max_tokens=settings.CHAT_HISTORY_SUMMARY_MAX_TOKENS,
+        api_key=settings.OPENAI_API_KEY,
+        additional_kwargs={"api_key": settings.OPENAI_API_KEY},
+    )
+
+
+async def summarize_messages(
+    summary: Optional[str], messages: List[MessageSchema], llm: Optional[LLM] = None
+) -> str:
+    """
+    Fold messages into the rolling summary of the conversation they came after
+    """
+
+    llm = llm or get_summary_llm()
+    transcript = "\n".join(f"{m.role.value}: {m.content.strip()}" for m in messages)
+    prompt = SUMMARY_PROMPT.format(
+        # Roughly 3 words for every 4 tokens
+        max_words=settings.CHAT_HISTORY_SUMMARY_MAX_TOKENS * 3 // 4,
+        summary=summary or "(none)",
+        transcript=transcript,
+    )
+    response = await llm.acomplete(prompt)
+
+    return response.text.strip()
+
+
+async def build_chat_history(
+    conversation: ConversationSchema, token_budget: Optional[int] = None, llm: Optional[LLM] = None
+) -> List[ChatMessage]:
+    """
+    The chat history to answer a new message of the conversation with: the conversation's rolling
+    summary followed by the latest messages within the token budget. The summary is only
+    recomputed, and saved on the conversation, when messages have moved out of the window
+    since it was last computed.
+    """
+
+    token_budget = token_budget or settings.CHAT_HISTORY_TOKEN_BUDGET
+    window = select_history_window(conversation.messages, token_budget, conversation.history_summary_until)
+    summary = conversation.history_summary
+    if window.to_summarize:
+        try:
+            summary = await summarize_messages(summary, window.to_summarize, llm=llm)
+            async with SessionLocal() as db:
+                await crud.update_conversation_history_summary(
+                    db, str(conversation.id), summary, window.to_summarize[-1].created_at
+                )
+            logger.info(
+                "Summarized %s messages of conversation %s", len(window.to_summarize), conversation.id
+            )
+        except Exception:
+            logger.error("Failed to summarize the history of conversation %s", conversation.id, exc_info=True)
+
+    chat_history = get_chat_history(window.messages)
+    if summary:
+        chat_history.insert(0, ChatMessage(content=SUMMARY_MESSAGE.format(summary=summary), role=MessageRole.SYSTEM))
+
+    return chat_history
@@ -0,0 +1,79 @@
+import logging
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from cachetools import LRUCache
+from llama_index import ServiceContext, VectorStoreIndex
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IndexCacheStats:
+    """
+    Document index cache counters since the process started
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class DocumentIndexCache(LRUCache):
+    """
+    LRU cache of loaded VectorStoreIndex objects keyed by document id.
+    Each entry remembers the content hash of the document it was loaded for, so an index
+    is treated as stale once the document has been re-uploaded with different contents,
+    even when it was re-indexed by another process.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize=maxsize)
+        self.stats = IndexCacheStats()
+
+    def popitem(self) -> Tuple[str, Tuple[Optional[str], VectorStoreIndex]]:
+        item = super().popitem()
+        self.stats.evictions += 1
+        return item
+
+    def get_index(self, doc_id: str, content_hash: Optional[str]) -> Optional[VectorStoreIndex]:
+        entry = self.get(doc_id)
+        if entry is None or entry[0] != content_hash:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return entry[1]
+
+    def put_index(self, doc_id: str, content_hash: Optional[str], index: VectorStoreIndex) -> None:
+        self[doc_id] = (content_hash, index)
+
+    def invalidate(self, doc_id: str) -> None:
+        if self.pop(doc_id, None) is not None:
+            self.stats.invalidations += 1
+            logger.info("Invalidated cached index of document %s", doc_id)
+
+
+document_index_cache = DocumentIndexCache(settings.INDEX_CACHE_MAX_ENTRIES)
+
+
+def with_service_context(index: VectorStoreIndex, service_context: ServiceContext) -> VectorStoreIndex:
+    """
+    A view of a cached index that uses the given service context, so that the LLM and callback
+    handlers of the current request are used rather than those of the request that loaded it
+    """
+
+    return VectorStoreIndex(
+        index_struct=index.index_struct,
+        storage_context=index.storage_context,
+        service_context=service_context,
+    )
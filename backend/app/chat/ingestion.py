@@ -0,0 +1,132 @@
+import asyncio
+import logging
+
+from datetime import timedelta
+from typing import Dict, List, Optional
+from sqlalchemy.sql import func
+
+from app.api import crud
+from app.chat.engine import get_s3_fs, get_tool_service_context, index_documents
+from app.chat.index_cache import document_index_cache
+from app.chat.answer_cache import answer_cache
+from app.core.config import settings
+from app.db.models.base import IngestionJobStatusEnum, IngestionStageEnum
+from app.db.session import SessionLocal
+from app.schemas import pydantic_schema
+
+
+logger = logging.getLogger(__name__)
+
+_worker_tasks: List[asyncio.Task] = []
+
+
+async def run_ingestion_job(job: pydantic_schema.IngestionJob) -> None:
+    """
+    Parse, embed and persist the index of the job's document, recording progress per stage
+    """
+
+    progress: Dict[str, str] = {}
+
+    async def on_stage(stage: IngestionStageEnum) -> None:
+        for started_stage, status in progress.items():
+            if status == IngestionJobStatusEnum.RUNNING.value:
+                progress[started_stage] = IngestionJobStatusEnum.SUCCESS.value
+        progress[stage.value] = IngestionJobStatusEnum.RUNNING.value
+        async with SessionLocal() as db:
+            await crud.update_ingestion_job(db, str(job.id), stage=stage, progress=dict(progress))
+
+    async with SessionLocal() as db:
+        documents = await crud.fetch_documents(db, id=str(job.document_id))
+    if not documents:
+        raise ValueError(f"Document {job.document_id} not found")
+
+    # A job always (re)indexes its document, e.g. after it was re-uploaded with new contents
+    document_index_cache.invalidate(str(job.document_id))
+    answer_cache.invalidate_document(str(job.document_id))
+    service_context = get_tool_service_context([])
+    await index_documents(service_context, documents, fs=get_s3_fs(), on_stage=on_stage)
+
+    progress = {stage: IngestionJobStatusEnum.SUCCESS.value for stage in progress}
+    async with SessionLocal() as db:
+        await crud.update_ingestion_job(db, str(job.id), status=IngestionJobStatusEnum.SUCCESS, progress=progress)
+
+
+async def send_heartbeats(job_id: str) -> None:
+    """
+    Keep a running job from being reclaimed while a long stage runs, until cancelled
+    """
+
+    while True:
+        await asyncio.sleep(settings.INGESTION_HEARTBEAT_INTERVAL_SECONDS)
+        try:
+            async with SessionLocal() as db:
+                await crud.update_ingestion_job(db, job_id, updated_at=func.now())
+        except Exception:
+            logger.warning("Failed to send a heartbeat for ingestion job %s", job_id, exc_info=True)
+
+
+async def run_claimed_ingestion_job(job: pydantic_schema.IngestionJob) -> None:
+    """
+    Run a claimed job while sending heartbeats for it. If the worker is stopped meanwhile, the
+    job is queued again without counting the attempt.
+    """
+
+    heartbeats = asyncio.create_task(send_heartbeats(str(job.id)))
+    try:
+        await run_ingestion_job(job)
+    except asyncio.CancelledError:
+        async with SessionLocal() as db:
+            await crud.update_ingestion_job(
+                db, str(job.id), status=IngestionJobStatusEnum.QUEUED, attempts=job.attempts - 1
+            )
+        raise
+    finally:
+        heartbeats.cancel()
+
+
+async def ingestion_worker(worker_number: int) -> None:
+    """
+    Claim and run ingestion jobs until cancelled
+    """
+
+    stale_after = timedelta(seconds=settings.INGESTION_JOB_TIMEOUT_SECONDS)
+    while True:
+        try:
+            async with SessionLocal() as db:
+                job = await crud.claim_ingestion_job(db, stale_after, settings.INGESTION_MAX_ATTEMPTS)
+            if job is None:
+                await asyncio.sleep(settings.INGESTION_POLL_INTERVAL_SECONDS)
+                continue
+
+            logger.info("Ingestion worker %s claimed job %s (attempt %s)", worker_number, job.id, job.attempts)
+            try:
+                await run_claimed_ingestion_job(job)
+                logger.info("Ingestion job %s finished", job.id)
+            except Exception as e:
+                logger.error("Ingestion job %s failed", job.id, exc_info=True)
+                status = (
+                    IngestionJobStatusEnum.QUEUED
+                    if job.attempts < settings.INGESTION_MAX_ATTEMPTS
+                    else IngestionJobStatusEnum.ERROR
+                )
+                async with SessionLocal() as db:
+                    await crud.update_ingestion_job(db, str(job.id), status=status, error=str(e))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.error("Error in ingestion worker %s", worker_number, exc_info=True)
+            await asyncio.sleep(settings.INGESTION_POLL_INTERVAL_SECONDS)
+
+
+def start_ingestion_workers(concurrency: Optional[int] = None) -> None:
+    concurrency = settings.INGESTION_WORKER_CONCURRENCY if concurrency is None else concurrency
+    logger.info("Starting %s ingestion workers", concurrency)
+    for worker_number in range(concurrency):
+        _worker_tasks.append(asyncio.create_task(ingestion_worker(worker_number)))
+
+
+async def stop_ingestion_workers() -> None:
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
@@ -0,0 +1,67 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+def get_graph_version(graph_store: Any) -> Optional[int]:
+    """
+    Version of the graph held by the store, which changes whenever a triplet is written to it.
+    None for graph stores that don't track one, whose graph is then only loaded once.
+    """
+
+    return getattr(graph_store, "version", None)
+
+
+class AdjacencyIndex:
+    """
+    The relations of each subject of a knowledge graph keyed by the case-folded subject, built
+    once from the graph store's graph_dict so that traversals don't copy the whole graph
+    """
+
+    def __init__(self, graph_dict: Dict[str, Sequence[Sequence[str]]]) -> None:
+        self._rels: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        self.num_triplets = 0
+        for subj, rels in graph_dict.items():
+            for rel, obj in rels:
+                self.add(subj, rel, obj)
+
+    @property
+    def num_subjects(self) -> int:
+        return len(self._rels)
+
+    def add(self, subj: str, rel: str, obj: str) -> None:
+        self._rels[subj.casefold()].append((rel, obj))
+        self.num_triplets += 1
+
+    def get(self, subj: str) -> List[Tuple[str, str]]:
+        return self._rels.get(subj.casefold(), [])
+
+    def get_rel_map(
+        self, subj: str, depth: int, limit: int, max_rels_per_subject: Optional[int] = None
+    ) -> List[List[str]]:
+        """
+        The [subject, relation, object] triplets reachable from subj within depth hops, nearest
+        first. Each subject is expanded once and contributes at most max_rels_per_subject of its
+        relations, and the traversal stops as soon as limit triplets are found.
+        """
+
+        max_rels_per_subject = max_rels_per_subject or limit
+        rel_map: List[List[str]] = []
+        if limit <= 0:
+            return rel_map
+        visited = {subj.casefold()}
+        frontier = [subj]
+        for _ in range(depth):
+            next_frontier = []
+            for name in frontier:
+                for rel, obj in self.get(name)[:max_rels_per_subject]:
+                    rel_map.append([name, rel, obj])
+                    if len(rel_map) >= limit:
+                        return rel_map
+                    if obj.casefold() not in visited:
+                        visited.add(obj.casefold())
+                        next_frontier.append(obj)
+            frontier = next_frontier
+            if not frontier:
+                break
+
+        return rel_map
@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from cachetools import LRUCache
+
+from app.api import crud
+from app.chat.kg_entities import get_entity_key
+from app.core.config import settings
+from app.db.models.base import KgAliasSourceEnum
+from app.db.session import SessionLocal
+
+
+# Writes the aliases of this many names at once
+ALIAS_INSERT_BATCH_SIZE = 1000
+
+ExpansionKey = Tuple[str, ...]
+
+
+def get_alias_key(term: str) -> str:
+    return " ".join(get_entity_key(term))
+
+
+def get_expansion_key(keywords: Iterable[str]) -> ExpansionKey:
+    return tuple(sorted({get_alias_key(keyword) for keyword in keywords}))
+
+
+def parse_keyword_synonyms(response: str, keywords: Sequence[str], max_synonyms: int) -> Dict[str, List[str]]:
+    """
+    The synonyms of each keyword from an LLM response with a '<keyword>: <synonyms>' line per
+    keyword, at most `max_synonyms` in total. Keywords the response has no line for get none.
+    """
+
+    keywords_by_key: Dict[str, List[str]] = {}
+    for keyword in keywords:
+        keywords_by_key.setdefault(get_alias_key(keyword), []).append(keyword)
+    keyword_synonyms: Dict[str, List[str]] = {keyword: [] for keyword in keywords}
+    remaining = max_synonyms
+    for line in response.splitlines():
+        keyword, separator, synonyms = line.partition(":")
+        matched = keywords_by_key.get(get_alias_key(keyword))
+        if not separator or not matched:
+            continue
+        for synonym in synonyms.split(","):
+            synonym = synonym.strip().strip("'\"")
+            if not synonym or remaining <= 0:
+                continue
+            remaining -= 1
+            for keyword in matched:
+                keyword_synonyms[keyword].append(synonym)
+    return keyword_synonyms
+
+
+@dataclass
+class SynonymExpansionStats:
+    """
+    Synonym expansion counters since the process started
+    """
+
+    # Keyword sets expanded from the LRU cache, or not
+    hits: int = 0
+    misses: int = 0
+    # Keywords whose aliases were found in the alias table, or had to be asked of the LLM
+    table_hits: int = 0
+    llm_expansions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SynonymExpansionCache(LRUCache):
+    """
+    Synonyms of the most recently expanded keyword sets, keyed by their sorted alias keys
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__(maxsize=maxsize)
+        self.stats = SynonymExpansionStats()
+
+    def get_expansion(self, keywords: Iterable[str]) -> Optional[List[str]]:
+        expansion = self.get(get_expansion_key(keywords))
+        if expansion is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return expansion
+
+    def put_expansion(self, keywords: Iterable[str], expansion: List[str]) -> None:
+        self[get_expansion_key(keywords)] = expansion
+
+
+synonym_expansion_cache = SynonymExpansionCache(settings.KG_SYNONYM_CACHE_MAX_ENTRIES)
+
+
+async def aget_aliases(keywords: Sequence[str]) -> Dict[str, List[str]]:
+    """
+    The aliases in the alias table of each keyword that has any
+    """
+
+    alias_keys = {keyword: get_alias_key(keyword) for keyword in keywords}
+    async with SessionLocal() as db:
+        aliases = await crud.fetch_kg_aliases(db, list(set(alias_keys.values())))
+
+    return {keyword: aliases[alias_key] for keyword, alias_key in alias_keys.items() if alias_key in aliases}
+
+
+async def aput_llm_aliases(keyword_synonyms: Dict[str, List[str]]) -> None:
+    """
+    Remember the synonyms the LLM gave for each keyword. The keyword is stored as an alias of
+    itself, so that a keyword without synonyms isn't asked about again either.
+    """
+
+    rows = [
+        (get_alias_key(keyword), alias)
+        for keyword, synonyms in keyword_synonyms.items()
+        for alias in dict.fromkeys([keyword, *synonyms])
+    ]
+    async with SessionLocal() as db:
+        await crud.insert_kg_aliases(db, rows, KgAliasSourceEnum.LLM)
+
+
+async def aput_graph_aliases(names: Iterable[str]) -> None:
+    """
+    Make each knowledge graph entity name an alias of its entity key, so that the names of an
+    entity that differ only by case, punctuation or company suffix are aliases of one another
+    """
+
+    rows = list(dict.fromkeys((get_alias_key(name), name) for name in names))
+    async with SessionLocal() as db:
+        for start in range(0, len(rows), ALIAS_INSERT_BATCH_SIZE):
+            await crud.insert_kg_aliases(db, rows[start:start + ALIAS_INSERT_BATCH_SIZE], KgAliasSourceEnum.GRAPH)
+    # Expansions cached before these names were added may be missing them
+    synonym_expansion_cache.clear()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import re
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.chat.kg_adjacency import get_graph_version
+from app.chat.pg_storage import PostgresGraphStore, run_sync
+
+
+logger = logging.getLogger(__name__)
+
+# Legal suffixes of company names, which mentions of a company often leave out or spell differently
+COMPANY_SUFFIXES = (
+    ("public", "limited", "company"),
+    ("limited",),
+    ("ltd",),
+    ("plc",),
+    ("llp",),
+    ("llc",),
+    ("inc",),
+    ("corp",),
+    ("co",),
+)
+# Names shorter than this once normalized are too likely to match ordinary words
+MIN_ENTITY_KEY_LENGTH = 3
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+# The graph store's version and, for Postgres, its triplet write count
+Watermark = Tuple[Optional[int], Optional[int]]
+
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(_NON_WORD_RE.sub(" ", text.casefold()).split())
+
+
+def get_entity_key(name: str) -> Tuple[str, ...]:
+    """
+    The tokens an entity name is matched by: case-folded words without punctuation or
+    trailing company suffixes, so that "SME Lending Ltd." and "SME LENDING LIMITED" match alike
+    """
+
+    tokens = tokenize(name)
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in COMPANY_SUFFIXES:
+            if len(tokens) > len(suffix) and tokens[-len(suffix):] == suffix:
+                tokens = tokens[:-len(suffix)]
+                stripped = True
+    return tokens
+
+
+class _TrieNode:
+    __slots__ = ("children", "names")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.names: List[str] = []
+
+
+class EntityMatcher:
+    """
+    A trie of the entity names of a knowledge graph by their tokens, finding the longest
+    names mentioned in a text in a single pass over its words
+    """
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self._root = _TrieNode()
+        self.num_names = 0
+        for name in names:
+            key = get_entity_key(name)
+            if len(" ".join(key)) < MIN_ENTITY_KEY_LENGTH:
+                continue
+            node = self._root
+            for token in key:
+                node = node.children.setdefault(token, _TrieNode())
+            node.names.append(name)
+            self.num_names += 1
+
+    def match(self, text: str) -> List[str]:
+        """
+        The names mentioned in the text, each mention matched to the longest name it spells.
+        Every name with the same key is returned, e.g. both "SME LENDING" and "SME Lending Ltd".
+        """
+
+        tokens = tokenize(text)
+        matches: Dict[str, None] = {}
+        start = 0
+        while start < len(tokens):
+            node = self._root
+            longest: Optional[Tuple[int, List[str]]] = None
+            for end in range(start, len(tokens)):
+                node = node.children.get(tokens[end])
+                if node is None:
+                    break
+                if node.names:
+                    longest = (end, node.names)
+            if longest is None:
+                start += 1
+                continue
+            end, names = longest
+            matches.update(dict.fromkeys(names))
+            start = end + 1
+        return list(matches)
+
+
+class GraphEntityExtractor:
+    """
+    An entity_extract_fn for KnowledgeGraphRAGRetriever finding the graph's own entities in a
+    query without calling the LLM. The matcher is built from the graph's subjects and objects on
+    first use, and rebuilt whenever the graph's watermark changes: the graph store's version,
+    which counts this process's writes, and for Postgres the triplet rows written by any process.
+    A single rebuild runs at a time, in the background, while queries are matched with the
+    previous matcher.
+    """
+
+    def __init__(self, graph_store: Any) -> None:
+        self._graph_store = graph_store
+        self._matcher: Optional[EntityMatcher] = None
+        self._watermark: Optional[Watermark] = None
+        self._rebuild: Optional["asyncio.Task[None]"] = None
+
+    async def _aget_watermark(self) -> Watermark:
+        version = get_graph_version(self._graph_store)
+        if isinstance(self._graph_store, PostgresGraphStore):
+            return version, await self._graph_store.aget_write_count()
+        return version, None
+
+    async def _arebuild(self, watermark: Watermark) -> None:
+        try:
+            if isinstance(self._graph_store, PostgresGraphStore):
+                names = await self._graph_store.aget_entity_names()
+            else:
+                names = _get_entity_names(self._graph_store.to_dict()["graph_dict"])
+        except Exception:
+            # Awaited when there's no matcher yet, otherwise the previous one keeps being used
+            if self._matcher is None:
+                raise
+            logger.exception("Failed to rebuild the entity matcher, keeping the previous one")
+            return
+        self._matcher = EntityMatcher(names)
+        self._watermark = watermark
+        logger.info(f"Built entity matcher of {self._matcher.num_names} names for graph watermark {watermark}")
+
+    def __call__(self, query_str: str) -> List[str]:
+        return run_sync(self.aextract(query_str))
+
+    async def aextract(self, query_str: str) -> List[str]:
+        watermark = await self._aget_watermark()
+        if watermark != self._watermark and (self._rebuild is None or self._rebuild.done()):
+            self._rebuild = asyncio.create_task(self._arebuild(watermark))
+        if self._matcher is None:
+            # Shielded so that a cancelled query doesn't cancel the build other queries wait for
+            await asyncio.shield(self._rebuild)
+        return self._matcher.match(query_str)
+
+
+def _get_entity_names(graph_dict: Dict[str, List[List[str]]]) -> List[str]:
+    names = dict.fromkeys(graph_dict)
+    for rels in graph_dict.values():
+        names.update(dict.fromkeys(obj for _, obj in rels))
+    return list(names)
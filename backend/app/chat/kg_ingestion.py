@@ -0,0 +1,261 @@
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import time
+
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple, Union
+from fsspec.asyn import AsyncFileSystem
+from llama_index.graph_stores import SimpleGraphStore
+from llama_index.graph_stores.types import DEFAULT_PERSIST_FNAME
+
+from app.chat.engine import get_s3_fs
+from app.chat.engine_cache import invalidate_knowledge_graph_tools
+from app.chat.kg_aliases import aput_graph_aliases
+from app.chat.pg_storage import PostgresGraphStore
+from app.core.config import StorageBackendEnum, settings
+
+
+logger = logging.getLogger(__name__)
+
+Triplet = Tuple[str, str, str]
+# Header row of a triplets CSV, which is skipped if present
+CSV_HEADER = ("subject", "relation", "object")
+# Keys of a triplet's fields in a JSONL line, in (subject, relation, object) order
+JSONL_KEYS = (("subject", "relation", "object"), ("subj", "rel", "obj"))
+# Number of invalid lines kept in the stats to report back
+MAX_REPORTED_ERRORS = 10
+
+# Held by the ingest writing to the S3 graph of this process, as concurrent writers would
+# overwrite each other's triplets
+s3_ingest_lock = asyncio.Lock()
+
+
+class TripletFormatEnum(str, Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+
+@dataclass
+class TripletIngestionStats:
+    lines: int = 0
+    invalid: int = 0
+    # Repeated within a batch, or already in the graph
+    duplicates: int = 0
+    inserted: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def triplets_per_second(self) -> float:
+        return (self.lines - self.invalid) / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "lines": self.lines,
+            "invalid": self.invalid,
+            "duplicates": self.duplicates,
+            "inserted": self.inserted,
+            "batches": self.batches,
+            "seconds": self.seconds,
+            "triplets_per_second": self.triplets_per_second,
+            "errors": self.errors,
+        }
+
+
+class S3GraphStoreWriter:
+    """
+    Adds triplets to the knowledge graph kept in S3, which is what the chat tools read when
+    INDEX_STORAGE_BACKEND is S3. The graph is loaded on the first batch, kept in memory as batches
+    are added, and written back once by aflush. Ingests into S3 must not run concurrently, as the
+    last write wins: ingest_triplets holds s3_ingest_lock, but nothing stops another process.
+    """
+
+    def __init__(self, fs: Optional[AsyncFileSystem] = None, persist_dir: Optional[str] = None) -> None:
+        self._fs = fs or get_s3_fs()
+        self._persist_dir = persist_dir or settings.S3_BUCKET_NAME
+        self._graph_store: Optional[SimpleGraphStore] = None
+        self._triplets: Set[Triplet] = set()
+        self._dirty = False
+
+    def _load(self) -> None:
+        try:
+            self._graph_store = SimpleGraphStore.from_persist_dir(self._persist_dir, fs=self._fs)
+        except FileNotFoundError:
+            self._graph_store = SimpleGraphStore(fs=self._fs)
+        graph_dict = self._graph_store.to_dict()["graph_dict"]
+        self._triplets = {(subj, rel, obj) for subj, rels in graph_dict.items() for rel, obj in rels}
+
+    async def aupsert_triplets(self, triplets: Sequence[Triplet]) -> int:
+        """
+        Add the triplets that aren't in the graph yet, returning how many were added
+        """
+
+        if self._graph_store is None:
+            await asyncio.to_thread(self._load)
+        inserted = 0
+        for subj, rel, obj in triplets:
+            # Checked here as SimpleGraphStore.upsert_triplet compares a tuple with the stored lists
+            if (subj, rel, obj) in self._triplets:
+                continue
+            self._graph_store.upsert_triplet(subj, rel, obj)
+            self._triplets.add((subj, rel, obj))
+            inserted += 1
+        self._dirty = self._dirty or inserted > 0
+        return inserted
+
+    async def aflush(self) -> None:
+        """
+        Write the graph back to S3 if triplets were added to it. The whole graph is rewritten,
+        so this is done once per ingest rather than per batch.
+        """
+
+        if not self._dirty:
+            return
+        persist_path = f"{self._persist_dir}/{DEFAULT_PERSIST_FNAME}"
+        await asyncio.to_thread(self._graph_store.persist, persist_path, self._fs)
+        self._dirty = False
+
+
+def get_graph_store_writer() -> Union[PostgresGraphStore, S3GraphStoreWriter]:
+    """
+    Where ingested triplets are written: the graph store of the configured storage backend
+    """
+    if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.POSTGRES:
+        return PostgresGraphStore()
+    return S3GraphStoreWriter()
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    The UTF-8 lines of a stream of byte chunks, without their line endings
+    """
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def parse_triplet(line: str, triplet_format: TripletFormatEnum) -> Optional[Triplet]:
+    """
+    The (subject, relation, object) of a CSV or JSONL line, or None for a CSV header.
+    Raises a ValueError if the line isn't a triplet.
+    """
+
+    if triplet_format == TripletFormatEnum.CSV:
+        values = next(csv.reader([line]), [])
+        if tuple(value.strip().lower() for value in values) == CSV_HEADER:
+            return None
+    else:
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid JSON: {e}")
+        if isinstance(value, dict):
+            keys = next((keys for keys in JSONL_KEYS if all(key in value for key in keys)), None)
+            if keys is None:
+                raise ValueError(f"expected the keys {', '.join(JSONL_KEYS[0])}")
+            values = [value[key] for key in keys]
+        else:
+            values = value
+
+    if not isinstance(values, list) or len(values) != 3:
+        raise ValueError("expected a subject, a relation and an object")
+    triplet = tuple(str(value).strip() for value in values)
+    if not all(triplet):
+        raise ValueError("empty subject, relation or object")
+    return triplet
+
+
+async def ingest_triplets(
+    lines: AsyncIterable[str],
+    triplet_format: TripletFormatEnum,
+    graph_store: Optional[Union[PostgresGraphStore, S3GraphStoreWriter]] = None,
+    batch_size: Optional[int] = None,
+) -> TripletIngestionStats:
+    """
+    Insert the triplets of a stream of CSV or JSONL lines into the knowledge graph of the
+    configured storage backend, committing a batch at a time. Triplets repeated within a batch
+    are only written once, and ones already in the graph are skipped. Invalid lines are counted
+    and skipped. The subjects and objects of each batch are added to the entity alias table.
+    Ingests into S3 wait for any other one in this process to finish, and write the graph back
+    once at the end.
+    """
+
+    graph_store = graph_store or get_graph_store_writer()
+    if isinstance(graph_store, S3GraphStoreWriter):
+        async with s3_ingest_lock:
+            try:
+                stats = await _ingest_triplets(lines, triplet_format, graph_store, batch_size)
+            finally:
+                await graph_store.aflush()
+    else:
+        stats = await _ingest_triplets(lines, triplet_format, graph_store, batch_size)
+    if stats.inserted:
+        invalidate_knowledge_graph_tools()
+    return stats
+
+
+async def _ingest_triplets(
+    lines: AsyncIterable[str],
+    triplet_format: TripletFormatEnum,
+    graph_store: Union[PostgresGraphStore, S3GraphStoreWriter],
+    batch_size: Optional[int],
+) -> TripletIngestionStats:
+    batch_size = batch_size or settings.KG_INGEST_BATCH_SIZE
+    stats = TripletIngestionStats()
+    # Keyed by triplet to dedupe the batch while keeping its order
+    batch: Dict[Triplet, None] = {}
+    batch_lines = 0
+    started = time.perf_counter()
+
+    async def write_batch() -> None:
+        nonlocal batch, batch_lines
+        inserted = await graph_store.aupsert_triplets(list(batch))
+        if isinstance(graph_store, PostgresGraphStore):
+            await aput_graph_aliases(name for subj, _, obj in batch for name in (subj, obj))
+        stats.inserted += inserted
+        stats.duplicates += batch_lines - inserted
+        stats.batches += 1
+        batch, batch_lines = {}, 0
+
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            triplet = parse_triplet(line, triplet_format)
+        except ValueError as e:
+            stats.lines += 1
+            stats.invalid += 1
+            if len(stats.errors) < MAX_REPORTED_ERRORS:
+                stats.errors.append(f"line {line_number}: {e}")
+            continue
+        if triplet is None:
+            continue
+        stats.lines += 1
+        batch[triplet] = None
+        batch_lines += 1
+        if len(batch) >= batch_size:
+            await write_batch()
+    if batch:
+        await write_batch()
+
+    stats.seconds = time.perf_counter() - started
+    logger.info(
+        "Ingested %s of %s triplets in %s batches at %.0f triplets/sec",
+        stats.inserted, stats.lines - stats.invalid, stats.batches, stats.triplets_per_second,
+    )
+    return stats
@@ -16,6 +16,11 @@ from llama_index.schema import BaseNode, MetadataMode, NodeWithScore, TextNode
 from llama_index.storage.storage_context import StorageContext
 from llama_index.utils import print_text, truncate_text
 
+from app.chat.kg_adjacency import AdjacencyIndex, get_graph_version
+from app.chat.kg_aliases import aget_aliases, aput_llm_aliases, parse_keyword_synonyms, synonym_expansion_cache
+from app.chat.kg_entities import GraphEntityExtractor
+from app.chat.pg_storage import PostgresGraphStore, run_sync
+
 DQKET = DEFAULT_QUERY_KEYWORD_EXTRACT_TEMPLATE
 DEFAULT_NODE_SCORE = 1000.0
 GLOBAL_EXPLORE_NODE_LIMIT = 3
@@ -57,6 +62,21 @@ DEFAULT_SYNONYM_EXPAND_PROMPT = PromptTemplate(
     prompt_type=PromptType.QUERY_KEYWORD_EXTRACT,
 )
 
+DEFAULT_KEYWORD_SYNONYMS_TEMPLATE = """
+Generate synonyms or possible form of each of the keywords up to {max_keywords} in total,
+considering possible cases of capitalization, pluralization, common expressions, etc.
+Provide the synonyms of each keyword on a line of its own, in comma-separated format: '<keyword>: <synonyms>'
+Note, the result should have one line per keyword, starting with the keyword as given
+----
+KEYWORDS: {question}
+----
+"""
+
+DEFAULT_KEYWORD_SYNONYMS_PROMPT = PromptTemplate(
+    DEFAULT_KEYWORD_SYNONYMS_TEMPLATE,
+    prompt_type=PromptType.QUERY_KEYWORD_EXTRACT,
+)
+
 
 class KnowledgeGraphRAGRetriever(BaseRetriever):
     """
@@ -72,7 +92,9 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
             Extraction Prompt (see :ref:`Prompt-Templates`).
         entity_extract_policy (Optional[str]): The entity extraction policy to use.
             default: "union"
-            possible values: "union", "intersection"
+            possible values: "union", "intersection", "fallback" (only ask the
+            LLM when the entity extract function finds nothing, and don't expand
+            the synonyms of the entities it finds)
         synonym_expand_fn (Optional[Callable]): A function to expand synonyms.
         synonym_expand_template (Optional[QueryKeywordExpandPrompt]): A Query Key Entity
              Expansion Prompt (see :ref:`Prompt-Templates`).
@@ -92,6 +114,8 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
             default: 2
         max_knowledge_sequence (int): The maximum number of knowledge sequence to
             include in the response. By default, it's 30.
+        max_rels_per_subject (Optional[int]): The maximum number of relations of
+            each subject to follow. By default, max_knowledge_sequence.
         verbose (bool): Whether to print out debug info.
     """
 
@@ -111,6 +135,7 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
         with_nl2graphquery: bool = False,
         graph_traversal_depth: int = 2,
         max_knowledge_sequence: int = REL_TEXT_LIMIT,
+        max_rels_per_subject: Optional[int] = None,
         verbose: bool = False,
         **kwargs: Any,
     ) -> None:
@@ -143,7 +168,11 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
         self._with_nl2graphquery = with_nl2graphquery
         self._graph_traversal_depth = graph_traversal_depth
         self._max_knowledge_sequence = max_knowledge_sequence
+        self._max_rels_per_subject = max_rels_per_subject or max_knowledge_sequence
         self._verbose = verbose
+        # Loaded on first use and again whenever the graph store's version changes
+        self._adjacency_index: Optional[AdjacencyIndex] = None
+        self._adjacency_version: Optional[int] = None
         refresh_schema = kwargs.get("refresh_schema", False)
         try:
             self._graph_schema = self._graph_store.get_schema(refresh=refresh_schema)
@@ -236,7 +265,7 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
         entities_llm: Set[str] = set()
 
         if handle_fn is not None:
-            enitities_fn = handle_fn(query_str)
+            enitities_fn = await self._acall_extract_fn(handle_fn, query_str)
         if handle_llm_prompt_template is not None:
             response = await self._service_context.llm_predictor.apredict(
                 handle_llm_prompt_template,
@@ -256,13 +285,29 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
 
         return entities
 
+    async def _acall_extract_fn(self, handle_fn: Callable, query_str: str) -> List[str]:
+        if isinstance(handle_fn, GraphEntityExtractor):
+            return await handle_fn.aextract(query_str)
+        return handle_fn(query_str)
+
     def _get_entities(self, query_str: str) -> List[str]:
         """Get entities from query string."""
+        entity_extract_fn = self._entity_extract_fn
+        entity_extract_policy = self._entity_extract_policy
+        if entity_extract_policy == "fallback":
+            assert entity_extract_fn is not None, "Must provide entity extract function."
+            entities = entity_extract_fn(query_str)
+            if entities:
+                if self._verbose:
+                    print_text(f"Entities matched: {entities}\n", color="green")
+                return entities
+            entity_extract_fn, entity_extract_policy = None, "union"
+
         entities = self._process_entities(
             query_str,
-            self._entity_extract_fn,
+            entity_extract_fn,
             self._entity_extract_template,
-            self._entity_extract_policy,
+            entity_extract_policy,
             self._max_entities,
             "KEYWORDS:",
         )
@@ -271,11 +316,22 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
 
     async def _aget_entities(self, query_str: str) -> List[str]:
         """Get entities from query string."""
+        entity_extract_fn = self._entity_extract_fn
+        entity_extract_policy = self._entity_extract_policy
+        if entity_extract_policy == "fallback":
+            assert entity_extract_fn is not None, "Must provide entity extract function."
+            entities = await self._acall_extract_fn(entity_extract_fn, query_str)
+            if entities:
+                if self._verbose:
+                    print_text(f"Entities matched: {entities}\n", color="green")
+                return entities
+            entity_extract_fn, entity_extract_policy = None, "union"
+
         entities = await self._aprocess_entities(
             query_str,
-            self._entity_extract_fn,
+            entity_extract_fn,
             self._entity_extract_template,
-            self._entity_extract_policy,
+            entity_extract_policy,
             self._max_entities,
             "KEYWORDS:",
         )
@@ -284,18 +340,13 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
 
     def _expand_synonyms(self, keywords: List[str]) -> List[str]:
         """Expand synonyms or similar expressions for keywords."""
-        return self._process_entities(
-            str(keywords),
-            self._synonym_expand_fn,
-            self._synonym_expand_template,
-            self._synonym_expand_policy,
-            self._max_synonyms,
-            "SYNONYMS:",
-        )
+        if not keywords:
+            return []
+        synonyms = synonym_expansion_cache.get_expansion(keywords)
+        if synonyms is not None:
+            return synonyms
 
-    async def _aexpand_synonyms(self, keywords: List[str]) -> List[str]:
-        """Expand synonyms or similar expressions for keywords."""
-        return await self._aprocess_entities(
+        synonyms = self._process_entities(
             str(keywords),
             self._synonym_expand_fn,
             self._synonym_expand_template,
@@ -303,66 +354,119 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
             self._max_synonyms,
             "SYNONYMS:",
         )
+        synonym_expansion_cache.stats.llm_expansions += len(keywords)
+        synonym_expansion_cache.put_expansion(keywords, synonyms)
+        return synonyms
 
-    def _get_knowledge_sequence(self, entities: List[str]) -> Tuple[List[str], Optional[Dict[Any, Any]]]:
-        """Get knowledge sequence from entities."""
-        # Get SubGraph from Graph Store as Knowledge Sequence
-        rel_map: Optional[Dict] = self._graph_store.get_rel_map(
-            entities, self._graph_traversal_depth, limit=self._max_knowledge_sequence
+    async def _aexpand_synonyms(self, keywords: List[str]) -> List[str]:
+        """
+        Expand synonyms or similar expressions for keywords. Expansions of the same keywords
+        are cached, and with a Postgres graph store the aliases of each keyword are looked up in
+        the alias table, so only keywords never seen before are expanded by the LLM.
+        """
+        if not keywords:
+            return []
+        synonyms = synonym_expansion_cache.get_expansion(keywords)
+        if synonyms is not None:
+            return synonyms
+
+        use_alias_table = isinstance(self._graph_store, PostgresGraphStore)
+        aliases = await aget_aliases(keywords) if use_alias_table else {}
+        synonym_expansion_cache.stats.table_hits += len(aliases)
+        missing = [keyword for keyword in keywords if keyword not in aliases]
+        if missing:
+            expansions = await self._aexpand_keyword_synonyms(missing)
+            synonym_expansion_cache.stats.llm_expansions += len(missing)
+            if use_alias_table:
+                await aput_llm_aliases(expansions)
+            aliases.update(expansions)
+
+        synonyms = list(dict.fromkeys(alias for keyword in keywords for alias in aliases[keyword]))
+        if self._verbose:
+            print_text(f"Synonyms expanded: {synonyms}\n", color="green")
+        synonym_expansion_cache.put_expansion(keywords, synonyms)
+        return synonyms
+
+    async def _aexpand_keyword_synonyms(self, keywords: List[str]) -> Dict[str, List[str]]:
+        """
+        Expand the synonyms of each keyword with a single LLM call, asking for a line of synonyms
+        per keyword so that they can be stored as its aliases. Up to max_synonyms in total.
+        """
+        response = await self._service_context.llm_predictor.apredict(
+            DEFAULT_KEYWORD_SYNONYMS_PROMPT,
+            max_keywords=self._max_synonyms,
+            question=str(keywords),
         )
-        logger.info(f"rel_map: {rel_map}")
-
-        # Build Knowledge Sequence
-        knowledge_sequence = []
-        if rel_map:
-            knowledge_sequence.extend(
-                [str(rel_obj) for rel_objs in rel_map.values() for rel_obj in rel_objs]
+        keyword_synonyms = parse_keyword_synonyms(response, keywords, self._max_synonyms)
+        if self._synonym_expand_fn is not None:
+            for keyword, synonyms in keyword_synonyms.items():
+                fn_synonyms = self._synonym_expand_fn(keyword)
+                if self._synonym_expand_policy == "union":
+                    keyword_synonyms[keyword] = list(dict.fromkeys([*synonyms, *fn_synonyms]))
+                else:
+                    keyword_synonyms[keyword] = [synonym for synonym in synonyms if synonym in fn_synonyms]
+        return keyword_synonyms
+
+    def _get_adjacency_index(self) -> AdjacencyIndex:
+        """Get the adjacency index of the graph, loading it if the graph changed."""
+        version = get_graph_version(self._graph_store)
+        if self._adjacency_index is None or version != self._adjacency_version:
+            self._adjacency_index = AdjacencyIndex(self._graph_store.to_dict()["graph_dict"])
+            self._adjacency_version = version
+            logger.info(
+                f"Loaded adjacency index of {self._adjacency_index.num_triplets} triplets"
+                f" for graph version {version}"
             )
-        else:
-            logger.info("> No knowledge sequence extracted from entities.")
-            return [], None
+        return self._adjacency_index
 
-        return knowledge_sequence, rel_map
-    
-    async def _get_rel_map(self, subj, depth, limit):
-        """Get one subect's rel map in max depth."""
-        graph_dict = { k.lower(): v for k, v in self._graph_store.to_dict()['graph_dict'].items() }
-        if depth == 0:
-            return []
-        rel_map = []
-        rel_count = 0
-        if subj.lower() in graph_dict:
-            for rel, obj in graph_dict[subj.lower()]:
-                if rel_count >= limit:
-                    break
-                rel_map.append([subj, rel, obj])
-                rel_map += await self._get_rel_map(obj, depth - 1, limit)
-                rel_count += 1
-        return rel_map
-
-    async def _aget_knowledge_sequence(self, entities: List[str]) -> Tuple[List[str], Optional[Dict[Any, Any]]]:
-        depth = self._graph_traversal_depth
+    def _get_indexed_rel_map(
+        self, adjacency_index: AdjacencyIndex, entities: List[str]
+    ) -> Dict[str, List[List[str]]]:
+        """Get subjects' rel map in max depth, up to max_knowledge_sequence in total."""
         limit = self._max_knowledge_sequence
-        
-        """Get subjects' rel map in max depth."""
-        rel_map = {}
-        for subj in entities:
-            rel_map[subj] = await self._get_rel_map(subj, depth=depth, limit=limit)
-            
-        # TBD, truncate the rel_map in a spread way, now just truncate based
-        # on iteration order
+        # TBD, truncate the rel_map in a spread way, now the first subjects
+        # take the whole limit
+        rel_map: Dict[str, List[List[str]]] = {}
         rel_count = 0
-        return_map = {}
-        for subj in rel_map:
-            if rel_count + len(rel_map[subj]) > limit:
-                return_map[subj] = rel_map[subj][: limit - rel_count]
+        for subj in entities:
+            if rel_count >= limit:
                 break
-            else:
-                return_map[subj] = rel_map[subj]
-                rel_count += len(rel_map[subj])
+            rel_map[subj] = adjacency_index.get_rel_map(
+                subj,
+                depth=self._graph_traversal_depth,
+                limit=limit - rel_count,
+                max_rels_per_subject=self._max_rels_per_subject,
+            )
+            rel_count += len(rel_map[subj])
+        return rel_map
+
+    async def _aget_postgres_rel_map(self, entities: List[str]) -> Dict[str, List[List[str]]]:
+        """
+        Get subjects' rel map in max depth from Postgres, falling back to the
+        subjects most similar to the entities when none of them is in the graph.
+        """
+        assert isinstance(self._graph_store, PostgresGraphStore)
+        kwargs = {
+            "depth": self._graph_traversal_depth,
+            "limit": self._max_knowledge_sequence,
+            "max_rels_per_subject": self._max_rels_per_subject,
+        }
+        rel_map = await self._graph_store.aget_rel_map(entities, **kwargs)
+        if rel_map:
+            return rel_map
 
-        rel_map = return_map
+        similar_subjects: List[str] = []
+        for entity in entities:
+            similar_subjects.extend(await self._graph_store.aget_similar_subjects(entity))
+        if not similar_subjects:
+            return {}
+        if self._verbose:
+            print_text(f"Similar subjects: {similar_subjects}\n", color="green")
+        return await self._graph_store.aget_rel_map(list(dict.fromkeys(similar_subjects)), **kwargs)
 
+    def _rel_map_to_knowledge_sequence(
+        self, rel_map: Dict[str, List[List[str]]]
+    ) -> Tuple[List[str], Optional[Dict[Any, Any]]]:
         # Build Knowledge Sequence
         knowledge_sequence = []
         if rel_map:
@@ -375,6 +479,23 @@ class KnowledgeGraphRAGRetriever(BaseRetriever):
 
         return knowledge_sequence, rel_map
 
+    def _get_knowledge_sequence(self, entities: List[str]) -> Tuple[List[str], Optional[Dict[Any, Any]]]:
+        """Get knowledge sequence from entities."""
+        if isinstance(self._graph_store, PostgresGraphStore):
+            # Postgres walks the graph itself, without loading it
+            rel_map = run_sync(self._aget_postgres_rel_map(entities))
+        else:
+            rel_map = self._get_indexed_rel_map(self._get_adjacency_index(), entities)
+        return self._rel_map_to_knowledge_sequence(rel_map)
+
+    async def _aget_knowledge_sequence(self, entities: List[str]) -> Tuple[List[str], Optional[Dict[Any, Any]]]:
+        """Get knowledge sequence from entities."""
+        if isinstance(self._graph_store, PostgresGraphStore):
+            rel_map = await self._aget_postgres_rel_map(entities)
+        else:
+            rel_map = self._get_indexed_rel_map(self._get_adjacency_index(), entities)
+        return self._rel_map_to_knowledge_sequence(rel_map)
+
     def _build_nodes(self, knowledge_sequence: List[str], rel_map: Optional[Dict[Any, Any]] = None) -> List[NodeWithScore]:
         """Build nodes from knowledge sequence."""
         if len(knowledge_sequence) == 0:
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+
+from typing import Any, Dict, List, Optional
+from app.api import crud
+from app.chat.streaming import MessageStream
+from app.core.config import settings
+from app.db.models.base import Message, MessageStatusEnum
+from app.db.session import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_message_row(message: Message) -> Dict[str, Any]:
+    return {
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "content": message.content,
+        "role": message.role,
+        "status": message.status,
+        "created_at": message.created_at,
+        "updated_at": message.updated_at,
+    }
+
+
+class MessageWriteBehind:
+    """
+    Persists the assistant message of a MessageStream while it is being generated.
+    The user message and the PENDING assistant message are inserted up front, then a background
+    checkpoint upserts the sub-processes that changed and the content generated so far, so that
+    an answer is not lost if the worker dies before it is finished. Checkpoints use their own
+    session, as the request's session may not be shared with the task that streams the answer.
+    """
+
+    def __init__(
+        self,
+        message_stream: MessageStream,
+        user_message: Message,
+        checkpoint_interval: Optional[float] = None,
+    ) -> None:
+        self.message_stream = message_stream
+        self.user_message = user_message
+        self.checkpoint_interval = (
+            settings.MESSAGE_CHECKPOINT_INTERVAL_SECONDS if checkpoint_interval is None else checkpoint_interval
+        )
+        self._persisted_content = message_stream.message.content
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        async with SessionLocal() as db:
+            await crud.insert_messages(
+                db, [get_message_row(self.user_message), get_message_row(self.message_stream.message)]
+            )
+        self._task = asyncio.create_task(self._run_checkpoints())
+
+    async def _run_checkpoints(self) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self.checkpoint()
+
+    async def checkpoint(self, status: Optional[MessageStatusEnum] = None) -> None:
+        """
+        Write the sub-processes that changed since the last checkpoint and the message's content,
+        if it changed, along with the given status. Failed writes are retried by the next checkpoint.
+        """
+
+        async with self._lock:
+            message_stream = self.message_stream
+            changed_event_ids = set(message_stream.changed_event_ids)
+            message_stream.changed_event_ids.clear()
+            sub_process_rows: List[Dict[str, Any]] = [
+                {
+                    "id": sub_process.id,
+                    "message_id": sub_process.message_id,
+                    "source": sub_process.source,
+                    "status": sub_process.status,
+                    "metadata_map": sub_process.metadata_map,
+                    "created_at": sub_process.created_at,
+                }
+                for event_id, sub_process in message_stream.event_id_to_sub_process.items()
+                if event_id in changed_event_ids
+            ]
+            content = message_stream.content
+            message_values: Dict[str, Any] = {}
+            if content != self._persisted_content:
+                message_values["content"] = content
+            if status is not None:
+                message_values["status"] = status
+
+            try:
+                async with SessionLocal() as db:
+                    await crud.upsert_message_sub_processes(db, sub_process_rows)
+                    if message_values:
+                        await crud.update_message(db, str(message_stream.message.id), **message_values)
+            except Exception:
+                logger.error("Failed to checkpoint message %s", message_stream.message.id, exc_info=True)
+                message_stream.changed_event_ids.update(changed_event_ids)
+                return
+            self._persisted_content = content
+
+    async def finish(self, status: MessageStatusEnum) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.checkpoint(status)
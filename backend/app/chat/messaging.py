@@ -15,12 +15,21 @@ from app.schemas import pydantic_schema
 from app.schemas.pydantic_schema import SubProcessMetadataKeysEnum, SubProcessMetadataMap
 from app.db.models.base import MessageSubProcessSourceEnum
 from app.chat.engine import get_chat_engine
+from app.chat.engine_cache import current_sub_question_memo, get_chat_tools_key
+from app.chat.answer_cache import (
+    CachedAnswer,
+    CachedSubProcess,
+    answer_cache,
+    embed_question,
+    is_answer_cacheable,
+)
 
 logger = logging.getLogger(__name__)
 
 
 class StreamedMessage(BaseModel):
-    content: str
+    # Text appended to the assistant message
+    delta: str
 
 
 class StreamedMessageSubProcess(BaseModel):
@@ -36,6 +45,8 @@ class ChatCallbackHandler(BaseCallbackHandler):
         ignored_events = [CBEventType.CHUNKING, CBEventType.NODE_PARSING]
         super().__init__(ignored_events, ignored_events)
         self._send_chan = send_chan
+        # Sub-processes that finished, in order, to be cached along with the answer
+        self.finished_sub_processes: List[StreamedMessageSubProcess] = []
 
     def on_event_start(
         self,
@@ -73,10 +84,15 @@ class ChatCallbackHandler(BaseCallbackHandler):
     ) -> SubProcessMetadataMap:
         metadata_map = {}
 
-        if (event_type == CBEventType.SUB_QUESTION and EventPayload.SUB_QUESTION in payload):
+        if (event_type == CBEventType.SUB_QUESTION and payload and EventPayload.SUB_QUESTION in payload):
             sub_q: SubQuestionAnswerPair = payload[EventPayload.SUB_QUESTION]
             metadata_map[SubProcessMetadataKeysEnum.SUB_QUESTION.value] = pydantic_schema.QuestionAnswerPair.from_sub_question_answer_pair(
                 sub_q).dict()
+            memo = current_sub_question_memo.get()
+            if not is_start_event and memo is not None and memo.was_hit(sub_q.sub_q.tool_name, sub_q.sub_q.sub_question):
+                metadata_map[SubProcessMetadataKeysEnum.MEMOIZED.value] = True
+            if payload.get(SubProcessMetadataKeysEnum.TIMED_OUT.value):
+                metadata_map[SubProcessMetadataKeysEnum.TIMED_OUT.value] = True
 
         return metadata_map
 
@@ -96,14 +112,15 @@ class ChatCallbackHandler(BaseCallbackHandler):
         if self._send_chan._closed:
             logger.debug("Received event after send channel closed. Ignoring.")
             return
-        await self._send_chan.send(
-            StreamedMessageSubProcess(
-                source=source,
-                metadata_map=metadata_map,
-                event_id=event_id,
-                has_ended=not is_start_event,
-            )
+        sub_process = StreamedMessageSubProcess(
+            source=source,
+            metadata_map=metadata_map,
+            event_id=event_id,
+            has_ended=not is_start_event,
         )
+        if sub_process.has_ended:
+            self.finished_sub_processes.append(sub_process)
+        await self._send_chan.send(sub_process)
 
     def start_trace(self, trace_id: Optional[str] = None) -> None:
         """No-op."""
@@ -115,11 +132,44 @@ class ChatCallbackHandler(BaseCallbackHandler):
         """No-op."""
 
 
+async def send_cached_answer(cached_answer: CachedAnswer, send_chan: MemoryObjectSendStream) -> None:
+    """
+    Stream a cached answer like a freshly generated one: its sub-processes (with their
+    citations) followed by its content
+    """
+
+    for sub_process in cached_answer.sub_processes:
+        await send_chan.send(
+            StreamedMessageSubProcess(
+                event_id=str(uuid4()),
+                has_ended=True,
+                source=sub_process.source,
+                metadata_map=sub_process.metadata_map,
+            )
+        )
+    await send_chan.send(StreamedMessage(delta=cached_answer.content))
+
+
 async def handle_chat_message(conversation: pydantic_schema.Conversation,  user_message: pydantic_schema.UserMessageCreate,
                               send_chan: MemoryObjectSendStream,
                               ) -> None:
     async with send_chan:
-        chat_engine = await get_chat_engine(ChatCallbackHandler(send_chan), conversation)
+        answer_key = question_embedding = None
+        if is_answer_cacheable(conversation):
+            try:
+                answer_key = get_chat_tools_key(conversation.documents)
+                question_embedding = await embed_question(user_message.content)
+            except Exception:
+                logger.warning("Could not embed the question, skipping the answer cache", exc_info=True)
+                answer_key = None
+            if answer_key is not None:
+                cached_answer = answer_cache.get_answer(answer_key, question_embedding)
+                if cached_answer is not None:
+                    await send_cached_answer(cached_answer, send_chan)
+                    return
+
+        callback_handler = ChatCallbackHandler(send_chan)
+        chat_engine = await get_chat_engine(callback_handler, conversation)
         await send_chan.send(
             StreamedMessageSubProcess(
                 event_id=str(uuid4()),
@@ -136,19 +186,31 @@ Remember - if I have asked a relevant financial question, use your tools.
         streaming_chat_response: StreamingAgentChatResponse = (
             await chat_engine.astream_chat(templated_message)
         )
-        response_str = ""
+        answer_parts: List[str] = []
         async for text in streaming_chat_response.async_response_gen():
-            response_str += text
+            if text.strip() or answer_parts:
+                answer_parts.append(text)
             if send_chan._closed:
                 logger.debug(
                     "Received streamed token after send channel closed. Ignoring."
                 )
                 return
-            await send_chan.send(StreamedMessage(content=response_str))
+            await send_chan.send(StreamedMessage(delta=text))
 
-        if response_str.strip() == "":
+        if not answer_parts:
             await send_chan.send(
                 StreamedMessage(
-                    content="Sorry, I either wasn't able to understand your question or I don't have an answer for it."
+                    delta="Sorry, I either wasn't able to understand your question or I don't have an answer for it."
                 )
             )
+        elif answer_key is not None:
+            answer_cache.put_answer(
+                answer_key,
+                user_message.content,
+                question_embedding,
+                "".join(answer_parts),
+                [
+                    CachedSubProcess(source=sub_process.source, metadata_map=sub_process.metadata_map)
+                    for sub_process in callback_handler.finished_sub_processes
+                ],
+            )
@@ -0,0 +1,75 @@
+import math
+
+from typing import List, Optional, Sequence
+from llama_index import ServiceContext
+from llama_index.indices.base_retriever import BaseRetriever
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.schema import NodeWithScore
+from llama_index.vector_stores.types import VectorStoreQueryResult
+
+from app.chat.pg_vector import CustomPGVectorStore
+from app.core.config import settings
+from app.db.models.base import RetrievalModeEnum
+from app.schemas.pydantic_schema import Conversation as ConversationSchema
+
+
+# Name of the single query engine tool of the consolidated retrieval mode
+CONSOLIDATED_TOOL_NAME = "documents"
+
+
+def get_retrieval_mode(conversation: ConversationSchema) -> RetrievalModeEnum:
+    return conversation.retrieval_mode or RetrievalModeEnum(settings.DEFAULT_RETRIEVAL_MODE)
+
+
+def get_max_per_document(similarity_top_k: int, num_documents: int) -> int:
+    """
+    The most nodes one document may contribute: an even share of the top k, but at least
+    CONSOLIDATED_RETRIEVAL_MIN_PER_DOCUMENT so that a few relevant documents can fill it
+    """
+
+    even_share = math.ceil(similarity_top_k / max(num_documents, 1))
+    return max(even_share, settings.CONSOLIDATED_RETRIEVAL_MIN_PER_DOCUMENT)
+
+
+class MultiDocumentRetriever(BaseRetriever):
+    """
+    Retrieves the top k nodes across a set of documents with a single vector store query
+    filtered on their db_document_id, capping the nodes taken from each document
+    """
+
+    def __init__(
+        self,
+        vector_store: CustomPGVectorStore,
+        doc_ids: Sequence[str],
+        service_context: ServiceContext,
+        similarity_top_k: Optional[int] = None,
+    ) -> None:
+        self._vector_store = vector_store
+        self._doc_ids = list(doc_ids)
+        self._service_context = service_context
+        self._similarity_top_k = similarity_top_k or settings.CONSOLIDATED_RETRIEVAL_TOP_K
+        self._max_per_document = get_max_per_document(self._similarity_top_k, len(self._doc_ids))
+
+    def _to_nodes_with_scores(self, result: VectorStoreQueryResult) -> List[NodeWithScore]:
+        return [
+            NodeWithScore(node=node, score=similarity)
+            for node, similarity in zip(result.nodes, result.similarities)
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or self._service_context.embed_model.get_agg_embedding_from_queries(
+            query_bundle.embedding_strs
+        )
+        result = self._vector_store.query_documents(
+            embedding, self._doc_ids, self._similarity_top_k, self._max_per_document
+        )
+        return self._to_nodes_with_scores(result)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or await self._service_context.embed_model.aget_agg_embedding_from_queries(
+            query_bundle.embedding_strs
+        )
+        result = await self._vector_store.aquery_documents(
+            embedding, self._doc_ids, self._similarity_top_k, self._max_per_document
+        )
+        return self._to_nodes_with_scores(result)
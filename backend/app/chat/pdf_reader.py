@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import time
+import fitz
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from app.api import crud
+from app.core.config import settings
+from app.db.session import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# Sharding a small document across processes costs more than it saves
+MIN_PAGES_PER_SHARD = 16
+# Number of per-document extraction metrics kept around for inspection
+EXTRACTION_STATS_HISTORY = 100
+# A page whose images cover at least this fraction of it and that has little
+# text is most likely a scan with a sparse text layer (e.g. a stamped filing)
+MIXED_PAGE_IMAGE_COVERAGE = 0.5
+MIXED_PAGE_MAX_TEXT_CHARS = 200
+
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+_ocr_queue: Optional[asyncio.Semaphore] = None
+_extraction_stats: "OrderedDict[str, ExtractionStats]" = OrderedDict()
+
+
+class PageKindEnum(str, Enum):
+    """
+    How the content of a PDF page is stored
+    """
+
+    TEXT = "text"
+    SCANNED = "scanned"
+    MIXED = "mixed"
+    EMPTY = "empty"
+
+
+@dataclass
+class PageExtraction:
+    page_number: int
+    kind: PageKindEnum
+    text: str
+
+    @property
+    def needs_ocr(self) -> bool:
+        return self.kind in (PageKindEnum.SCANNED, PageKindEnum.MIXED)
+
+
+@dataclass
+class ExtractionStats:
+    """
+    Throughput of a single document extraction
+    """
+
+    document_id: str
+    page_count: int
+    shard_count: int
+    seconds: float
+    ocr_page_count: int = 0
+    ocr_cache_hits: int = 0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.page_count / self.seconds if self.seconds > 0 else float(self.page_count)
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    global _extraction_pool
+    if _extraction_pool is None:
+        logger.info("Starting PDF extraction pool with %s workers", settings.PDF_EXTRACTION_POOL_SIZE)
+        _extraction_pool = ProcessPoolExecutor(max_workers=settings.PDF_EXTRACTION_POOL_SIZE)
+
+    return _extraction_pool
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    global _ocr_pool
+    if _ocr_pool is None:
+        logger.info("Starting OCR pool with %s workers", settings.PDF_OCR_POOL_SIZE)
+        _ocr_pool = ProcessPoolExecutor(max_workers=settings.PDF_OCR_POOL_SIZE)
+
+    return _ocr_pool
+
+
+def get_ocr_queue() -> asyncio.Semaphore:
+    """
+    Bounds the number of OCR jobs submitted to the OCR pool across all documents
+    """
+
+    global _ocr_queue
+    if _ocr_queue is None:
+        _ocr_queue = asyncio.Semaphore(settings.PDF_OCR_QUEUE_SIZE)
+
+    return _ocr_queue
+
+
+def get_extraction_pool_size() -> int:
+    return settings.PDF_EXTRACTION_POOL_SIZE
+
+
+def get_extraction_stats() -> Dict[str, ExtractionStats]:
+    """
+    Most recent extraction metrics, keyed by document id
+    """
+
+    return dict(_extraction_stats)
+
+
+def _record_extraction_stats(stats: ExtractionStats) -> None:
+    _extraction_stats.pop(stats.document_id, None)
+    _extraction_stats[stats.document_id] = stats
+    while len(_extraction_stats) > EXTRACTION_STATS_HISTORY:
+        _extraction_stats.popitem(last=False)
+
+
+def split_page_ranges(page_count: int, shard_count: int) -> List[Tuple[int, int]]:
+    """
+    Split [0, page_count) into at most shard_count contiguous (start, stop) ranges
+    """
+
+    shard_count = max(1, min(shard_count, page_count // MIN_PAGES_PER_SHARD or 1))
+    shard_size, remainder = divmod(page_count, shard_count)
+    ranges = []
+    start = 0
+    for shard in range(shard_count):
+        stop = start + shard_size + (1 if shard < remainder else 0)
+        if stop > start:
+            ranges.append((start, stop))
+        start = stop
+
+    return ranges
+
+
+def classify_page(text: str, image_coverage: float) -> PageKindEnum:
+    """
+    Classify a page from the length of its text layer and the fraction of it covered by images
+    """
+
+    text_chars = len(text.strip())
+    if text_chars == 0:
+        return PageKindEnum.SCANNED if image_coverage > 0 else PageKindEnum.EMPTY
+    if image_coverage >= MIXED_PAGE_IMAGE_COVERAGE and text_chars < MIXED_PAGE_MAX_TEXT_CHARS:
+        return PageKindEnum.MIXED
+
+    return PageKindEnum.TEXT
+
+
+def _image_coverage(page: fitz.Page) -> float:
+    page_area = abs(page.rect)
+    if page_area == 0:
+        return 0.0
+    image_area = sum(abs(fitz.Rect(image["bbox"]) & page.rect) for image in page.get_image_info())
+
+    return min(image_area / page_area, 1.0)
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> List[PageExtraction]:
+    """
+    Extract the text layer of pages [start, stop) and classify each page.
+    Runs inside a pool worker, so the document is opened from the local file in the worker itself.
+    """
+
+    doc = fitz.open(pdf_path, filetype="pdf")
+    pages = []
+    for page_number in range(start, stop):
+        page = doc[page_number]
+        text = page.get_text()
+        pages.append(PageExtraction(
+            page_number=page_number,
+            kind=classify_page(text, _image_coverage(page)),
+            text=text,
+        ))
+    doc.close()
+
+    return pages
+
+
+def ocr_page(pdf_path: str, page_number: int) -> str:
+    """
+    OCR a single page. Runs inside an OCR pool worker.
+    """
+
+    doc = fitz.open(pdf_path, filetype="pdf")
+    text = doc[page_number].get_textpage_ocr().extractText()
+    doc.close()
+
+    return text
+
+
+async def _queue_ocr_page(pdf_path: str, page_number: int) -> str:
+    async with get_ocr_queue():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_ocr_pool(), ocr_page, pdf_path, page_number)
+
+
+async def ocr_pages(pdf_path: str, content_hash: str, page_numbers: List[int]) -> Tuple[Dict[int, str], int]:
+    """
+    OCR the given pages, reusing cached output for pages of the same PDF contents.
+    Returns the OCR text keyed by page number and the number of cache hits.
+    """
+
+    async with SessionLocal() as db:
+        cached = await crud.fetch_ocr_pages(db, content_hash, page_numbers)
+
+    missing = [page_number for page_number in page_numbers if page_number not in cached]
+    texts = await asyncio.gather(*[_queue_ocr_page(pdf_path, page_number) for page_number in missing])
+    fresh = dict(zip(missing, texts))
+    if fresh:
+        async with SessionLocal() as db:
+            await crud.insert_ocr_pages(db, content_hash, fresh)
+
+    return {**cached, **fresh}, len(cached)
+
+
+async def extract_pages(document_id: str, pdf_path: str, page_count: int, content_hash: str) -> List[str]:
+    """
+    Extract the text of every page of a local PDF file, returned in page order.
+    Text layers are read across the extraction pool; only pages classified as scanned
+    or mixed are sent to OCR.
+    """
+
+    started = time.perf_counter()
+    page_ranges = split_page_ranges(page_count, get_extraction_pool_size())
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    shards = await asyncio.gather(*[
+        loop.run_in_executor(pool, extract_page_range, pdf_path, start, stop)
+        for start, stop in page_ranges
+    ])
+    pages = [page for shard in shards for page in shard]
+
+    ocr_page_numbers = [page.page_number for page in pages if page.needs_ocr]
+    ocr_cache_hits = 0
+    if ocr_page_numbers:
+        ocr_texts, ocr_cache_hits = await ocr_pages(pdf_path, content_hash, ocr_page_numbers)
+        for page in pages:
+            # Mixed pages keep their text layer unless OCR recovered more
+            ocr_text = ocr_texts.get(page.page_number, "")
+            if page.needs_ocr and len(ocr_text.strip()) > len(page.text.strip()):
+                page.text = ocr_text
+
+    stats = ExtractionStats(
+        document_id=document_id,
+        page_count=page_count,
+        shard_count=len(page_ranges),
+        seconds=time.perf_counter() - started,
+        ocr_page_count=len(ocr_page_numbers),
+        ocr_cache_hits=ocr_cache_hits,
+    )
+    _record_extraction_stats(stats)
+    logger.info(
+        "Extracted %s pages from document %s in %.2fs (%.1f pages/sec, %s shards, %s OCR pages, %s OCR cache hits)",
+        stats.page_count, document_id, stats.seconds, stats.pages_per_second, stats.shard_count,
+        stats.ocr_page_count, stats.ocr_cache_hits,
+    )
+
+    return [page.text for page in pages]
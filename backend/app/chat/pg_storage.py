@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple, TypeVar
+from llama_index import StorageContext
+from llama_index.graph_stores.simple import SimpleGraphStoreData
+from llama_index.graph_stores.types import GraphStore
+from llama_index.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.storage.index_store import SimpleIndexStore
+from llama_index.storage.index_store.keyval_index_store import KVIndexStore
+from llama_index.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+from llama_index.vector_stores.types import VectorStore
+
+from app.api import crud
+from app.db.session import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_STORE_COLLECTION = "index_store/data"
+# Keeps the number of bind parameters per upsert well below the Postgres limit
+STORAGE_UPSERT_BATCH_SIZE = 500
+
+T = TypeVar("T")
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion from the synchronous LlamaIndex storage interfaces.
+    Inside the app this re-enters the running event loop, which relies on the
+    nest_asyncio patch applied by app.chat.engine.
+    """
+
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def _strip_nul(value: dict) -> dict:
+    # Postgres can't store NUL characters in JSONB strings and PDF text layers sometimes contain them
+    return json.loads(json.dumps(value).replace("\\u0000", ""))
+
+
+class PostgresKVStore(BaseKVStore):
+    """
+    Key-value store kept in the storageentry table, using the same connection pool as the FastAPI app.
+    """
+
+    async def aput_all(self, entries: Dict[str, dict], collection: str = DEFAULT_COLLECTION) -> None:
+        items = [(key, _strip_nul(value)) for key, value in entries.items()]
+        async with SessionLocal() as db:
+            for start in range(0, len(items), STORAGE_UPSERT_BATCH_SIZE):
+                await crud.upsert_storage_entries(db, collection, dict(items[start:start + STORAGE_UPSERT_BATCH_SIZE]))
+
+    async def aget_many(self, keys: Sequence[str], collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        async with SessionLocal() as db:
+            return await crud.fetch_storage_entries(db, collection, keys=keys)
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        async with SessionLocal() as db:
+            return await crud.fetch_storage_entries(db, collection)
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        async with SessionLocal() as db:
+            return await crud.delete_storage_entry(db, collection, key)
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        run_sync(self.aput_all({key: val}, collection=collection))
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return run_sync(self.aget_many([key], collection=collection)).get(key)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return run_sync(self.aget_all(collection=collection))
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return run_sync(self.adelete(key, collection=collection))
+
+
+class PostgresDocumentStore(KVDocumentStore):
+    def __init__(self, kvstore: Optional[PostgresKVStore] = None, namespace: Optional[str] = None) -> None:
+        super().__init__(kvstore or PostgresKVStore(), namespace)
+
+
+class PostgresIndexStore(KVIndexStore):
+    def __init__(self, kvstore: Optional[PostgresKVStore] = None, namespace: Optional[str] = None) -> None:
+        super().__init__(kvstore or PostgresKVStore(), namespace)
+
+
+class PostgresGraphStore(GraphStore):
+    """
+    Graph store keeping each triplet as a row of the kgtriplet table, so that a traversal is a
+    single query whose cost depends on the size of the subgraph it walks rather than of the graph.
+    Subjects are matched by their normalized names.
+    """
+
+    # Bumped on every write by this process, so that graphs loaded in memory can tell they're stale
+    _version = 0
+
+    @property
+    def client(self) -> None:
+        return
+
+    @property
+    def version(self) -> int:
+        return PostgresGraphStore._version
+
+    @classmethod
+    def _bump_version(cls) -> None:
+        PostgresGraphStore._version += 1
+
+    async def aget_many(self, subjs: Sequence[str]) -> Dict[str, List[List[str]]]:
+        async with SessionLocal() as db:
+            return await crud.fetch_kg_triplets(db, subjs=subjs)
+
+    async def aget_rel_map(
+        self,
+        subjs: Optional[List[str]] = None,
+        depth: int = 2,
+        limit: int = 30,
+        max_rels_per_subject: Optional[int] = None,
+    ) -> Dict[str, List[List[str]]]:
+        """
+        The triplets reachable from subjs within depth hops, at most limit in total, walked by
+        Postgres with a recursive query
+        """
+
+        if subjs is None:
+            return SimpleGraphStoreData(graph_dict=await self.aget_all()).get_rel_map(depth=depth, limit=limit)
+
+        async with SessionLocal() as db:
+            return await crud.fetch_kg_rel_map(db, subjs, depth, limit, max_rels_per_subject)
+
+    async def aget_similar_subjects(self, name: str, limit: int = 3) -> List[str]:
+        async with SessionLocal() as db:
+            return await crud.fetch_similar_kg_subjects(db, name, limit)
+
+    async def aget_entity_names(self) -> List[str]:
+        async with SessionLocal() as db:
+            return await crud.fetch_kg_entity_names(db)
+
+    async def aget_write_count(self) -> int:
+        async with SessionLocal() as db:
+            return await crud.fetch_kg_triplet_write_count(db)
+
+    async def aget_all(self) -> Dict[str, List[List[str]]]:
+        async with SessionLocal() as db:
+            return await crud.fetch_kg_triplets(db)
+
+    async def aput_all(self, graph_dict: Dict[str, List[List[str]]]) -> None:
+        triplets = [(subj, rel, obj) for subj, rels in graph_dict.items() for rel, obj in rels]
+        await self.aupsert_triplets(triplets)
+
+    async def aupsert_triplets(self, triplets: Sequence[Tuple[str, str, str]]) -> int:
+        """
+        Insert the triplets that aren't in the graph yet in a single transaction, returning how
+        many were inserted
+        """
+
+        async with SessionLocal() as db:
+            inserted = await crud.insert_kg_triplets(db, triplets, statement_size=STORAGE_UPSERT_BATCH_SIZE)
+        self._bump_version()
+        return inserted
+
+    async def adelete(self, subj: str, rel: str, obj: str) -> bool:
+        async with SessionLocal() as db:
+            deleted = await crud.delete_kg_triplet(db, subj, rel, obj)
+        self._bump_version()
+        return deleted
+
+    def get(self, subj: str) -> List[List[str]]:
+        return [rel_obj for rels in run_sync(self.aget_many([subj])).values() for rel_obj in rels]
+
+    def get_rel_map(
+        self,
+        subjs: Optional[List[str]] = None,
+        depth: int = 2,
+        limit: int = 30,
+        max_rels_per_subject: Optional[int] = None,
+    ) -> Dict[str, List[List[str]]]:
+        return run_sync(
+            self.aget_rel_map(subjs=subjs, depth=depth, limit=limit, max_rels_per_subject=max_rels_per_subject)
+        )
+
+    def upsert_triplet(self, subj: str, rel: str, obj: str) -> None:
+        run_sync(self.aupsert_triplets([(subj, rel, obj)]))
+
+    def delete(self, subj: str, rel: str, obj: str) -> None:
+        run_sync(self.adelete(subj, rel, obj))
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # Every change is written to Postgres as it happens
+        return
+
+    def to_dict(self) -> dict:
+        return {"graph_dict": run_sync(self.aget_all())}
+
+    def get_schema(self, refresh: bool = False) -> str:
+        raise NotImplementedError("PostgresGraphStore does not support get_schema")
+
+    def query(self, query: str, param_map: Optional[Dict[str, Any]] = {}) -> Any:
+        raise NotImplementedError("PostgresGraphStore does not support query")
+
+
+def get_postgres_storage_context(vector_store: Optional[VectorStore] = None) -> StorageContext:
+    return StorageContext.from_defaults(
+        docstore=PostgresDocumentStore(),
+        index_store=PostgresIndexStore(),
+        graph_store=PostgresGraphStore(),
+        vector_store=vector_store,
+    )
+
+
+async def persist_storage_data(docstore_data: Dict[str, dict], index_store_data: Dict[str, dict]) -> None:
+    """
+    Bulk write the collections of in-memory docstores and index stores (as returned by their to_dict)
+    """
+
+    kvstore = PostgresKVStore()
+    for data in (docstore_data, index_store_data):
+        for collection, entries in data.items():
+            await kvstore.aput_all(entries, collection=collection)
+
+
+async def persist_storage_contexts(doc_id_to_storage_context: Dict[str, StorageContext]) -> None:
+    """
+    Write the in-memory docstores and index stores of the documents' storage contexts to Postgres
+    with one bulk upsert per collection
+    """
+
+    docstore_data: Dict[str, dict] = {}
+    index_store_data: Dict[str, dict] = {}
+    for storage_context in doc_id_to_storage_context.values():
+        for merged, data in (
+            (docstore_data, storage_context.docstore.to_dict()),
+            (index_store_data, storage_context.index_store.to_dict()),
+        ):
+            for collection, entries in data.items():
+                merged.setdefault(collection, {}).update(entries)
+    await persist_storage_data(docstore_data, index_store_data)
+    logger.info("Persisted %s documents to Postgres storage", len(doc_id_to_storage_context))
+
+
+async def load_postgres_storage_context(
+    doc_ids: Sequence[str], vector_store: VectorStore
+) -> Tuple[StorageContext, List[str]]:
+    """
+    Build a storage context whose index store holds the index structs of the given documents,
+    fetched with a single query, and whose docstore reads from Postgres on demand.
+    Returns the storage context and the ids of the documents that have no index struct.
+    """
+
+    kvstore = PostgresKVStore()
+    index_structs = await kvstore.aget_many(doc_ids, collection=INDEX_STORE_COLLECTION)
+    storage_context = StorageContext.from_defaults(
+        docstore=PostgresDocumentStore(kvstore),
+        index_store=SimpleIndexStore.from_dict({INDEX_STORE_COLLECTION: index_structs}),
+        vector_store=vector_store,
+    )
+
+    return storage_context, [doc_id for doc_id in doc_ids if doc_id not in index_structs]
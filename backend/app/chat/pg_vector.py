@@ -1,11 +1,17 @@
-from llama_index.vector_stores.types import VectorStore
-from llama_index.vector_stores.postgres import PGVectorStore
+from typing import Any, List, Sequence
+from llama_index.schema import BaseNode, MetadataMode
+from llama_index.vector_stores.types import VectorStore, VectorStoreQueryResult
+from llama_index.vector_stores.utils import node_to_metadata_dict
+from llama_index.vector_stores.postgres import DBEmbeddingRow, PGVectorStore
 from sqlalchemy.engine import make_url
 from app.db.session import SessionLocal as AppSessionLocal, engine as app_engine
 import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.chat.constants import DB_DOC_ID_KEY
+
+VECTOR_STORE_INSERT_BATCH_SIZE = 1000
 
 singleton_instance = None
 did_run_setup = False
@@ -30,6 +36,110 @@ class CustomPGVectorStore(PGVectorStore):
 
         await self._async_engine.dispose()
 
+    def _doc_id_column(self) -> Any:
+        # Spelled like the expression index created in run_setup so that it can be used
+        return self._table_class.metadata_.op("->>")(sqlalchemy.literal_column(f"'{DB_DOC_ID_KEY}'"))
+
+    def _insert_nodes(self, session: Any, nodes: List[BaseNode]) -> None:
+        rows = [
+            {
+                "node_id": node.node_id,
+                "embedding": node.get_embedding(),
+                "text": node.get_content(metadata_mode=MetadataMode.NONE),
+                "metadata_": node_to_metadata_dict(node, remove_text=True, flat_metadata=self.flat_metadata),
+            }
+            for node in nodes
+        ]
+        for start in range(0, len(rows), VECTOR_STORE_INSERT_BATCH_SIZE):
+            session.execute(
+                sqlalchemy.insert(self._table_class),
+                rows[start:start + VECTOR_STORE_INSERT_BATCH_SIZE],
+            )
+
+    def add(self, nodes: List[BaseNode]) -> List[str]:
+        """
+        Insert nodes with multi-row INSERTs of VECTOR_STORE_INSERT_BATCH_SIZE rows
+        rather than one ORM object per node
+        """
+        self._initialize()
+        with self._session() as session, session.begin():
+            self._insert_nodes(session, nodes)
+
+        return [node.node_id for node in nodes]
+
+    def _build_delete_documents_query(self, doc_ids: Sequence[str]) -> Any:
+        return sqlalchemy.delete(self._table_class).where(self._doc_id_column().in_(list(doc_ids)))
+
+    def replace_documents(self, doc_ids: Sequence[str], nodes: List[BaseNode]) -> List[str]:
+        """
+        Replace the nodes of the given documents with new ones in a single transaction, so that
+        re-indexing a document never leaves its previous nodes behind next to the new ones
+        """
+        self._initialize()
+        with self._session() as session, session.begin():
+            session.execute(self._build_delete_documents_query(doc_ids))
+            self._insert_nodes(session, nodes)
+
+        return [node.node_id for node in nodes]
+
+    def _build_documents_query(
+        self,
+        embedding: List[float],
+        doc_ids: Sequence[str],
+        limit: int,
+        max_per_document: int,
+    ) -> Any:
+        """
+        The `limit` nodes of the given documents closest to the embedding, taking at most
+        `max_per_document` from each so that a single document can't crowd out the others
+        """
+        distance = self._table_class.embedding.cosine_distance(embedding)
+        doc_id = self._doc_id_column()
+        ranked = (
+            sqlalchemy.select(
+                self._table_class.node_id,
+                self._table_class.text,
+                self._table_class.metadata_,
+                distance.label("distance"),
+                sqlalchemy.func.row_number().over(partition_by=doc_id, order_by=distance).label("document_rank"),
+            )
+            .where(doc_id.in_(list(doc_ids)))
+            .subquery()
+        )
+        return (
+            sqlalchemy.select(ranked.c.node_id, ranked.c.text, ranked.c.metadata_, ranked.c.distance)
+            .where(ranked.c.document_rank <= max_per_document)
+            .order_by(ranked.c.distance)
+            .limit(limit)
+        )
+
+    def _documents_rows_to_query_result(self, rows: Sequence[Any]) -> VectorStoreQueryResult:
+        return self._db_rows_to_query_result([
+            DBEmbeddingRow(
+                node_id=row.node_id,
+                text=row.text,
+                metadata=row.metadata_,
+                similarity=(1 - row.distance) if row.distance is not None else 0,
+            )
+            for row in rows
+        ])
+
+    def query_documents(
+        self, embedding: List[float], doc_ids: Sequence[str], limit: int, max_per_document: int
+    ) -> VectorStoreQueryResult:
+        self._initialize()
+        stmt = self._build_documents_query(embedding, doc_ids, limit, max_per_document)
+        with self._session() as session, session.begin():
+            return self._documents_rows_to_query_result(session.execute(stmt).all())
+
+    async def aquery_documents(
+        self, embedding: List[float], doc_ids: Sequence[str], limit: int, max_per_document: int
+    ) -> VectorStoreQueryResult:
+        self._initialize()
+        stmt = self._build_documents_query(embedding, doc_ids, limit, max_per_document)
+        async with self._async_session() as session, session.begin():
+            return self._documents_rows_to_query_result((await session.execute(stmt)).all())
+
     def _create_tables_if_not_exists(self) -> None:
         pass
 
@@ -54,6 +164,16 @@ class CustomPGVectorStore(PGVectorStore):
             async with session.begin():
                 conn = await session.connection()
                 await conn.run_sync(self._base.metadata.create_all)
+
+        # Consolidated retrieval filters nodes by the document they belong to
+        table_name = self._table_class.__tablename__
+        async with self._async_session() as session:
+            async with session.begin():
+                statement = sqlalchemy.text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{DB_DOC_ID_KEY} "
+                    f"ON {table_name} ((metadata_ ->> '{DB_DOC_ID_KEY}'))"
+                )
+                await session.execute(statement)
         did_run_setup = True
 
 
@@ -0,0 +1,68 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from fsspec.asyn import AsyncFileSystem
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def iter_s3_object(fs: AsyncFileSystem, path: str, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Yield an S3 object in fixed-size chunks so that at most one chunk is held in memory
+    """
+
+    chunk_size = chunk_size or settings.S3_READ_CHUNK_SIZE
+    size = fs.size(path)
+    if size >= settings.S3_RANGED_READ_THRESHOLD:
+        # Large objects are fetched with explicit byte-range requests
+        for start in range(0, size, chunk_size):
+            yield fs.cat_file(path, start=start, end=min(start + chunk_size, size))
+        return
+
+    with fs.open(path, "rb", block_size=chunk_size) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+@dataclass
+class SpooledObject:
+    """
+    An S3 object spooled to a local file along with its SHA-256 content hash
+    """
+
+    path: str
+    size: int
+    sha256: str
+
+
+@contextmanager
+def spool_s3_object(fs: AsyncFileSystem, path: str, suffix: str = "") -> Iterator[SpooledObject]:
+    """
+    Spool an S3 object to a local temporary file, hashing its contents on the way through.
+    The temporary file is removed when the context exits.
+    """
+
+    fd, local_path = tempfile.mkstemp(suffix=suffix)
+    try:
+        content_hash = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_s3_object(fs, path):
+                content_hash.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        logger.debug("Spooled %s to %s", path, local_path)
+        yield SpooledObject(path=local_path, size=size, sha256=content_hash.hexdigest())
+    finally:
+        os.remove(local_path)
@@ -0,0 +1,128 @@
+import json
+import logging
+
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from fsspec import AbstractFileSystem
+from llama_index import StorageContext
+from llama_index.storage.docstore import SimpleDocumentStore
+from llama_index.storage.index_store import SimpleIndexStore
+from llama_index.vector_stores.types import VectorStore
+
+
+logger = logging.getLogger(__name__)
+
+# Each document's docstore and index struct are stored under documents/<doc id>/
+DOCUMENT_SHARDS_DIR = "documents"
+MANIFEST_FNAME = "manifest.json"
+DOCSTORE_FNAME = "docstore.json"
+INDEX_STORE_FNAME = "index_store.json"
+
+# Maps a document id to a summary of its shard
+Manifest = Dict[str, Dict[str, object]]
+
+
+def get_shard_dir(persist_dir: str, doc_id: str) -> str:
+    return f"{persist_dir}/{DOCUMENT_SHARDS_DIR}/{doc_id}"
+
+
+def get_manifest_path(persist_dir: str) -> str:
+    return f"{persist_dir}/{DOCUMENT_SHARDS_DIR}/{MANIFEST_FNAME}"
+
+
+def load_manifest(persist_dir: str, fs: AbstractFileSystem) -> Manifest:
+    try:
+        return json.loads(fs.cat_file(get_manifest_path(persist_dir)))
+    except FileNotFoundError:
+        return {}
+
+
+def update_manifest(persist_dir: str, entries: Manifest, fs: AbstractFileSystem) -> Manifest:
+    """
+    Add entries to the manifest. Loading doesn't rely on the manifest, so an entry lost to
+    a concurrent writer only costs a redundant shard lookup.
+    """
+
+    manifest = load_manifest(persist_dir, fs)
+    manifest.update(entries)
+    fs.pipe_file(get_manifest_path(persist_dir), json.dumps(manifest).encode("utf-8"))
+
+    return manifest
+
+
+def persist_document_shards(
+    persist_dir: str,
+    doc_id_to_storage_context: Dict[str, StorageContext],
+    fs: AbstractFileSystem,
+) -> None:
+    """
+    Write the docstore and index store of each document's own storage context to its shard,
+    then record the documents in the manifest. Nothing belonging to other documents is rewritten.
+    """
+
+    if not doc_id_to_storage_context:
+        return
+
+    shard_files: Dict[str, bytes] = {}
+    entries: Manifest = {}
+    persisted_at = datetime.utcnow().isoformat()
+    for doc_id, storage_context in doc_id_to_storage_context.items():
+        shard_dir = get_shard_dir(persist_dir, doc_id)
+        docstore_dict = storage_context.docstore.to_dict()
+        shard_files[f"{shard_dir}/{DOCSTORE_FNAME}"] = json.dumps(docstore_dict).encode("utf-8")
+        shard_files[f"{shard_dir}/{INDEX_STORE_FNAME}"] = json.dumps(storage_context.index_store.to_dict()).encode("utf-8")
+        entries[doc_id] = {
+            "document_count": len(storage_context.docstore.docs),
+            "persisted_at": persisted_at,
+        }
+
+    # Uploads every shard file concurrently on async filesystems such as s3fs
+    fs.pipe(shard_files)
+    update_manifest(persist_dir, entries, fs)
+    logger.info("Persisted %s document shards", len(entries))
+
+
+def _merge_kv_data(merged: Dict[str, dict], data: Dict[str, dict]) -> None:
+    for collection, items in data.items():
+        merged.setdefault(collection, {}).update(items)
+
+
+def load_document_storage_context(
+    persist_dir: str,
+    doc_ids: Sequence[str],
+    vector_store: VectorStore,
+    fs: AbstractFileSystem,
+) -> Tuple[StorageContext, List[str]]:
+    """
+    Build a storage context from the shards of the given documents only.
+    Returns the storage context and the ids of the documents that have no shard.
+    """
+
+    paths = []
+    for doc_id in doc_ids:
+        shard_dir = get_shard_dir(persist_dir, doc_id)
+        paths += [f"{shard_dir}/{DOCSTORE_FNAME}", f"{shard_dir}/{INDEX_STORE_FNAME}"]
+    # Fetched concurrently on async filesystems; missing shards are left out of the result,
+    # which is keyed by the paths with their protocol stripped
+    contents = fs.cat(paths, on_error="omit") if paths else {}
+
+    docstore_data: Dict[str, dict] = {}
+    index_store_data: Dict[str, dict] = {}
+    missing_doc_ids = []
+    for doc_id in doc_ids:
+        shard_dir = fs._strip_protocol(get_shard_dir(persist_dir, doc_id))
+        docstore_json: Optional[bytes] = contents.get(f"{shard_dir}/{DOCSTORE_FNAME}")
+        index_store_json: Optional[bytes] = contents.get(f"{shard_dir}/{INDEX_STORE_FNAME}")
+        if docstore_json is None or index_store_json is None:
+            missing_doc_ids.append(doc_id)
+            continue
+        _merge_kv_data(docstore_data, json.loads(docstore_json))
+        _merge_kv_data(index_store_data, json.loads(index_store_json))
+
+    storage_context = StorageContext.from_defaults(
+        docstore=SimpleDocumentStore.from_dict(docstore_data),
+        index_store=SimpleIndexStore.from_dict(index_store_data),
+        vector_store=vector_store,
+    )
+
+    return storage_context, missing_doc_ids
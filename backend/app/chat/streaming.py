@@ -0,0 +1,263 @@
+import anyio
+import datetime
+import logging
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from typing import AsyncIterator, List, Optional, Sequence, Set, Union
+from uuid import uuid4
+from anyio.streams.memory import MemoryObjectReceiveStream
+from sse_starlette.sse import ServerSentEvent
+
+from app.chat.messaging import StreamedMessage, StreamedMessageSubProcess
+from app.db.models.base import Message, MessageSubProcess, MessageSubProcessStatusEnum
+from app.core.config import settings
+from app.schemas import pydantic_schema
+
+
+logger = logging.getLogger(__name__)
+
+# Accept header media type that opts a client into the delta stream format
+DELTA_MEDIA_TYPE = "application/vnd.pdf-insight.delta+json"
+CONTENT_DELTA_EVENT = "content_delta"
+SUB_PROCESS_EVENT = "sub_process"
+
+StreamedObject = Union[StreamedMessage, StreamedMessageSubProcess]
+
+
+class StreamFormatEnum(str, Enum):
+    """
+    How the assistant message is sent while it is being generated.
+
+    SNAPSHOT: every event is the whole Message.
+    DELTA: a Message snapshot when the stream starts, then `content_delta` events with the text
+    appended to the message and `sub_process` events with each sub-process that started or
+    finished, then a final Message snapshot. Snapshots are unnamed (i.e. "message") events.
+    """
+
+    SNAPSHOT = "snapshot"
+    DELTA = "delta"
+
+
+def get_stream_format(stream_format: Optional[StreamFormatEnum], accept: Optional[str]) -> StreamFormatEnum:
+    if stream_format is not None:
+        return stream_format
+    if accept and DELTA_MEDIA_TYPE in accept:
+        return StreamFormatEnum.DELTA
+
+    return StreamFormatEnum.SNAPSHOT
+
+
+@dataclass
+class StreamStats:
+    """
+    Counters of streamed chat messages, for a single stream or since the process started
+    """
+
+    streams: int = 0
+    objects: int = 0
+    frames: int = 0
+    seconds: float = 0.0
+    queue_depth_total: int = 0
+    max_queue_depth: int = 0
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def objects_per_frame(self) -> float:
+        return self.objects / self.frames if self.frames else 0.0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        return self.queue_depth_total / self.frames if self.frames else 0.0
+
+    def add(self, other: "StreamStats") -> None:
+        self.streams += other.streams
+        self.objects += other.objects
+        self.frames += other.frames
+        self.seconds += other.seconds
+        self.queue_depth_total += other.queue_depth_total
+        self.max_queue_depth = max(self.max_queue_depth, other.max_queue_depth)
+
+
+stream_stats = StreamStats()
+
+
+class MessageStream:
+    """
+    Applies the objects streamed by handle_chat_message to the assistant message being
+    generated and renders them as server-sent events in the requested format
+    """
+
+    def __init__(self, message: Message, stream_format: StreamFormatEnum = StreamFormatEnum.SNAPSHOT) -> None:
+        self.message = message
+        self.stream_format = stream_format
+        self.event_id_to_sub_process: "OrderedDict[str, MessageSubProcess]" = OrderedDict()
+        # Event ids of the sub-processes that changed since they were last persisted
+        self.changed_event_ids: Set[str] = set()
+        self._content_parts: List[str] = [message.content or ""]
+
+    @property
+    def content(self) -> str:
+        if len(self._content_parts) > 1:
+            self._content_parts = ["".join(self._content_parts)]
+        return self._content_parts[0]
+
+    def sync_message(self) -> Message:
+        """
+        Bring the message's content and sub-processes up to date with everything applied so far
+        """
+
+        self.message.content = self.content
+        self.message.sub_processes = list(self.event_id_to_sub_process.values())
+        return self.message
+
+    def snapshot(self) -> str:
+        return pydantic_schema.Message.from_orm(self.sync_message()).json()
+
+    def start(self) -> Optional[ServerSentEvent]:
+        """
+        The event sent before anything has been generated, if any
+        """
+
+        if self.stream_format == StreamFormatEnum.DELTA:
+            return ServerSentEvent(data=self.snapshot())
+
+        return None
+
+    def apply(self, message_obj: StreamedObject) -> Optional[Union[str, ServerSentEvent]]:
+        """
+        Apply a streamed object to the message and return the event to send for it, if any
+        """
+
+        events = self.apply_batch([message_obj])
+        return events[0] if events else None
+
+    def apply_batch(self, message_objs: Sequence[StreamedObject]) -> List[Union[str, ServerSentEvent]]:
+        """
+        Apply streamed objects to the message and return the events to send for all of them:
+        a single snapshot, or a delta per sub-process that changed and one for the appended text
+        """
+
+        content_deltas: List[str] = []
+        upserts: "OrderedDict[str, pydantic_schema.MessageSubProcessUpsert]" = OrderedDict()
+        for message_obj in message_objs:
+            if isinstance(message_obj, StreamedMessage):
+                content_deltas.append(message_obj.delta)
+            elif isinstance(message_obj, StreamedMessageSubProcess):
+                sub_process = self.upsert_sub_process(message_obj)
+                upserts[message_obj.event_id] = pydantic_schema.MessageSubProcessUpsert(
+                    event_id=message_obj.event_id,
+                    source=sub_process.source,
+                    status=sub_process.status,
+                    metadata_map=sub_process.metadata_map,
+                    created_at=sub_process.created_at,
+                )
+            else:
+                logger.error(f"Unknown message object type: {type(message_obj)}")
+        self._content_parts.extend(content_deltas)
+
+        if not content_deltas and not upserts:
+            return []
+        if self.stream_format == StreamFormatEnum.SNAPSHOT:
+            return [self.snapshot()]
+
+        events: List[Union[str, ServerSentEvent]] = [
+            ServerSentEvent(data=upsert.json(), event=SUB_PROCESS_EVENT) for upsert in upserts.values()
+        ]
+        if content_deltas:
+            delta = pydantic_schema.MessageContentDelta(delta="".join(content_deltas))
+            events.append(ServerSentEvent(data=delta.json(), event=CONTENT_DELTA_EVENT))
+
+        return events
+
+    def upsert_sub_process(self, message_obj: StreamedMessageSubProcess) -> MessageSubProcess:
+        status = (
+            MessageSubProcessStatusEnum.FINISHED
+            if message_obj.has_ended
+            else MessageSubProcessStatusEnum.PENDING
+        )
+        previous = self.event_id_to_sub_process.get(message_obj.event_id)
+        sub_process = MessageSubProcess(
+            # The id is assigned here so that the row can be upserted as the sub-process progresses
+            id=previous.id if previous is not None else str(uuid4()),
+            # NOTE: By setting the created_at to the current time, we are
+            # no longer able to use the created_at field to determine the
+            # time at which the subprocess was inserted into the database.
+            created_at=previous.created_at if previous is not None else datetime.datetime.utcnow(),
+            message_id=self.message.id,
+            source=message_obj.source,
+            metadata_map=message_obj.metadata_map,
+            status=status,
+        )
+        self.event_id_to_sub_process[message_obj.event_id] = sub_process
+        self.changed_event_ids.add(message_obj.event_id)
+
+        return sub_process
+
+
+async def coalesce_events(
+    recv_chan: MemoryObjectReceiveStream,
+    message_stream: MessageStream,
+    flush_interval: Optional[float] = None,
+    max_pending: Optional[int] = None,
+    stats: Optional[StreamStats] = None,
+) -> AsyncIterator[Union[str, ServerSentEvent]]:
+    """
+    Receive streamed objects until the channel is closed, merging the ones that arrive within
+    flush_interval seconds of the first pending one (or until max_pending are pending) into a
+    single flush of events. With a flush_interval of 0, objects are only merged with the ones
+    already queued behind them.
+    """
+
+    flush_interval = settings.SSE_FLUSH_INTERVAL_SECONDS if flush_interval is None else flush_interval
+    max_pending = max_pending or settings.SSE_FLUSH_MAX_PENDING
+    stats = stats if stats is not None else StreamStats()
+    stats.streams += 1
+    started = anyio.current_time()
+    pending: List[StreamedObject] = []
+    deadline = 0.0
+    closed = False
+
+    def flush() -> List[Union[str, ServerSentEvent]]:
+        events = message_stream.apply_batch(pending)
+        queue_depth = recv_chan.statistics().current_buffer_used
+        stats.objects += len(pending)
+        stats.frames += len(events)
+        stats.queue_depth_total += queue_depth * len(events)
+        stats.max_queue_depth = max(stats.max_queue_depth, queue_depth)
+        pending.clear()
+        return events
+
+    try:
+        while not closed:
+            timed_out = False
+            try:
+                if pending:
+                    with anyio.move_on_after(max(deadline - anyio.current_time(), 0)) as scope:
+                        pending.append(await recv_chan.receive())
+                    timed_out = scope.cancel_called
+                else:
+                    pending.append(await recv_chan.receive())
+                    deadline = anyio.current_time() + flush_interval
+                # Take whatever else is already queued without waiting
+                while len(pending) < max_pending:
+                    pending.append(recv_chan.receive_nowait())
+            except anyio.WouldBlock:
+                pass
+            except anyio.EndOfStream:
+                closed = True
+
+            if closed or timed_out or len(pending) >= max_pending or anyio.current_time() >= deadline:
+                for event in flush():
+                    yield event
+    finally:
+        stats.seconds += anyio.current_time() - started
+        stream_stats.add(stats)
+        logger.debug(
+            "Streamed %s objects in %s frames (%.1f frames/sec, mean queue depth %.1f, max %s)",
+            stats.objects, stats.frames, stats.frames_per_second, stats.mean_queue_depth, stats.max_queue_depth,
+        )
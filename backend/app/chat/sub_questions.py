@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import logging
+import time
+
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+from llama_index.callbacks.schema import CBEventType, EventPayload
+from llama_index.indices.query.base import BaseQueryEngine
+from llama_index.indices.service_context import ServiceContext
+from llama_index.llms.base import LLM
+from llama_index.query_engine import SubQuestionQueryEngine
+from llama_index.query_engine.sub_question_query_engine import SubQuestionAnswerPair
+from llama_index.question_gen.types import SubQuestion
+from llama_index.response.schema import RESPONSE_TYPE
+from llama_index.utils import print_text
+
+from app.core.config import settings
+from app.schemas.pydantic_schema import SubProcessMetadataKeysEnum
+
+
+logger = logging.getLogger(__name__)
+
+# Payload key of a sub-question event that ended because its deadline passed
+TIMED_OUT_PAYLOAD_KEY = SubProcessMetadataKeysEnum.TIMED_OUT.value
+DEFAULT_PROVIDER = "openai"
+# Upper bounds (in seconds) of the sub-question latency histogram buckets
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, float("inf"))
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Histogram of a tool's sub-question latencies (each bucket counts the latencies above the
+    previous bound), with the number of sub-questions that timed out or failed
+    """
+
+    bucket_counts: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    count: int = 0
+    total_seconds: float = 0.0
+    timeouts: int = 0
+    errors: int = 0
+
+    def observe(self, seconds: float) -> None:
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total_seconds += seconds
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_seconds": self.mean_seconds,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): bucket_count
+                for bound, bucket_count in zip(LATENCY_BUCKETS, self.bucket_counts)
+            },
+        }
+
+
+class SubQuestionGovernor:
+    """
+    Bounds the number of sub-questions being answered at once by the process, overall and per
+    provider of the LLM behind the tools, and keeps a latency histogram per tool
+    """
+
+    def __init__(self, max_concurrency: int, max_concurrency_per_provider: int) -> None:
+        self.max_concurrency_per_provider = max_concurrency_per_provider
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.tool_latencies: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+
+    @asynccontextmanager
+    async def slot(self, provider: str) -> AsyncIterator[None]:
+        provider_semaphore = self._provider_semaphores.get(provider)
+        if provider_semaphore is None:
+            provider_semaphore = self._provider_semaphores[provider] = asyncio.Semaphore(
+                self.max_concurrency_per_provider
+            )
+        async with self._semaphore, provider_semaphore:
+            yield
+
+
+sub_question_governor = SubQuestionGovernor(
+    settings.SUB_QUESTION_MAX_CONCURRENCY,
+    settings.SUB_QUESTION_MAX_CONCURRENCY_PER_PROVIDER,
+)
+
+
+def get_llm_provider(llm: Optional[LLM]) -> str:
+    """
+    The provider of an LLM, named after the llama_index module of its class, e.g. "openai"
+    """
+    if llm is None:
+        return DEFAULT_PROVIDER
+    return type(llm).__module__.rsplit(".", 1)[-1]
+
+
+class GovernedSubQuestionQueryEngine(SubQuestionQueryEngine):
+    """
+    A SubQuestionQueryEngine that answers its sub-questions through the sub-question governor,
+    giving each one a deadline that starts when it is asked, so that time spent waiting for a slot
+    counts against it. A sub-question that misses it ends without an answer and the response is
+    synthesized from the others, so a single slow tool can't hold up the answer.
+    """
+
+    def __init__(
+        self,
+        *args,
+        deadline_seconds: Optional[float] = None,
+        provider: str = DEFAULT_PROVIDER,
+        governor: Optional[SubQuestionGovernor] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._deadline_seconds = deadline_seconds or settings.SUB_QUESTION_DEADLINE_SECONDS
+        self._provider = provider
+        self._governor = governor or sub_question_governor
+
+    @classmethod
+    def from_defaults(
+        cls,
+        *args,
+        service_context: Optional[ServiceContext] = None,
+        provider: Optional[str] = None,
+        **kwargs,
+    ) -> "GovernedSubQuestionQueryEngine":
+        """
+        Like SubQuestionQueryEngine.from_defaults, taking the provider of the sub-questions from
+        the service context's LLM, which the tools' query engines are built with, unless given
+        """
+        engine = super().from_defaults(*args, service_context=service_context, **kwargs)
+        engine._provider = provider or get_llm_provider(service_context.llm if service_context else None)
+        return engine
+
+    async def _aquery_in_slot(self, query_engine: BaseQueryEngine, question: str) -> RESPONSE_TYPE:
+        async with self._governor.slot(self._provider):
+            return await query_engine.aquery(question)
+
+    async def _aquery_subq(
+        self, sub_q: SubQuestion, color: Optional[str] = None
+    ) -> Optional[SubQuestionAnswerPair]:
+        latencies = self._governor.tool_latencies[sub_q.tool_name]
+        started = time.perf_counter()
+        try:
+            with self.callback_manager.event(
+                CBEventType.SUB_QUESTION,
+                payload={EventPayload.SUB_QUESTION: SubQuestionAnswerPair(sub_q=sub_q)},
+            ) as event:
+                question = sub_q.sub_question
+                query_engine = self._query_engines[sub_q.tool_name]
+
+                if self._verbose:
+                    print_text(f"[{sub_q.tool_name}] Q: {question}\n", color=color)
+
+                try:
+                    response = await asyncio.wait_for(
+                        self._aquery_in_slot(query_engine, question), self._deadline_seconds
+                    )
+                except asyncio.TimeoutError:
+                    latencies.timeouts += 1
+                    logger.warning(
+                        "[%s] Sub-question missed its %ss deadline: %s",
+                        sub_q.tool_name, self._deadline_seconds, question,
+                    )
+                    event.on_end(payload={
+                        EventPayload.SUB_QUESTION: SubQuestionAnswerPair(sub_q=sub_q),
+                        TIMED_OUT_PAYLOAD_KEY: True,
+                    })
+                    return None
+                response_text = str(response)
+
+                if self._verbose:
+                    print_text(f"[{sub_q.tool_name}] A: {response_text}\n", color=color)
+
+                qa_pair = SubQuestionAnswerPair(
+                    sub_q=sub_q, answer=response_text, sources=response.source_nodes
+                )
+
+                event.on_end(payload={EventPayload.SUB_QUESTION: qa_pair})
+
+            return qa_pair
+        except ValueError:
+            latencies.errors += 1
+            logger.warning(f"[{sub_q.tool_name}] Failed to run {sub_q.sub_question}")
+            return None
+        finally:
+            latencies.observe(time.perf_counter() - started)
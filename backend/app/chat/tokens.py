@@ -0,0 +1,36 @@
+import logging
+
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_ENCODING = "cl100k_base"
+# Rough number of characters per token for English text with the OpenAI tokenizers
+APPROX_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Optional[Callable[[str], List[int]]]:
+    """
+    The tiktoken encoder used by the OpenAI chat and embedding models, or None when its
+    BPE files aren't available locally and can't be downloaded
+    """
+
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        return lambda text: encoding.encode(text, disallowed_special=())
+    except Exception:
+        logger.warning("Could not load the %s tokenizer, approximating token counts", TOKENIZER_ENCODING)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return max(1, -(-len(text) // APPROX_CHARS_PER_TOKEN)) if text else 0
+
+    return len(tokenizer(text))
@@ -33,6 +33,15 @@ class AppEnvironment(str, Enum):
     PRODUCTION = "production"
 
 
+class StorageBackendEnum(str, Enum):
+    """
+    Where LlamaIndex docstores, index stores and graph stores are kept.
+    """
+
+    S3 = "s3"
+    POSTGRES = "postgres"
+
+
 is_pull_request: bool = os.environ.get("IS_PULL_REQUEST") == "true"
 is_preview_env: bool = os.environ.get("IS_PREVIEW_ENV") == "true"
 
@@ -55,6 +64,8 @@ class PreviewPrefixedSettings(BaseSettings):
     AWS_KEY: str
     AWS_SECRET: str
     POLYGON_IO_API_KEY: str
+    # Sent in the X-API-Key header to call the admin endpoints, which are disabled when not set
+    ADMIN_API_KEY: Optional[str] = None
 
     class Config(AppConfig):
         env_prefix = "PREVIEW_" if is_pull_request or is_preview_env else ""
@@ -79,6 +90,86 @@ class Settings(PreviewPrefixedSettings):
     SENTRY_DSN: Optional[str]
     RENDER_GIT_COMMIT: Optional[str]
     LOADER_IO_VERIFICATION_STR: str = "loaderio-e51043c635e0f4656473d3570ae5d9ec"
+    # Number of worker processes used to extract text from PDF pages
+    PDF_EXTRACTION_POOL_SIZE: int = cpu_count()
+    # Number of worker processes dedicated to OCR, and how many OCR jobs may be queued on them
+    PDF_OCR_POOL_SIZE: int = max(1, cpu_count() // 2)
+    PDF_OCR_QUEUE_SIZE: int = 32
+    # Number of concurrent ingestion workers run inside each app process (0 disables them)
+    INGESTION_WORKER_CONCURRENCY: int = 1
+    INGESTION_POLL_INTERVAL_SECONDS: float = 2.0
+    # Running jobs send a heartbeat this often, and are reclaimed once they haven't sent one for the timeout
+    INGESTION_HEARTBEAT_INTERVAL_SECONDS: int = 60
+    INGESTION_JOB_TIMEOUT_SECONDS: int = 30 * 60
+    INGESTION_MAX_ATTEMPTS: int = 3
+    # Override the OpenAI API base for embeddings, e.g. to point at scripts/fake_embedding_server.py
+    EMBEDDING_API_BASE: Optional[str] = None
+    # Token and size budget of each embedding request, and how many may be in flight at once
+    EMBEDDING_BATCH_MAX_TOKENS: int = 60_000
+    EMBEDDING_BATCH_MAX_SIZE: int = 512
+    EMBEDDING_MAX_CONCURRENCY: int = 8
+    EMBEDDING_MAX_RETRIES: int = 5
+    EMBEDDING_RETRY_BASE_SECONDS: float = 1.0
+    EMBEDDING_RETRY_MAX_SECONDS: float = 30.0
+    # Embeddings of chunk text are cached in Postgres, keeping at most this many entries
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 1_000_000
+    # How often each process checks the size of the embedding cache, evicting entries if it's full
+    EMBEDDING_CACHE_EVICTION_INTERVAL_SECONDS: int = 600
+    # Number of documents indexed together by scripts/seed_storage_context.py
+    SEED_BATCH_SIZE: int = 20
+    # Opt in to Postgres only after running scripts/migrate_storage_to_postgres.py, which copies the S3 stores,
+    # otherwise every stored document is re-indexed
+    INDEX_STORAGE_BACKEND: StorageBackendEnum = StorageBackendEnum.S3
+    # Number of loaded document indices kept in memory by each app process
+    INDEX_CACHE_MAX_ENTRIES: int = 256
+    # Chat tool graphs are cached per set of documents by each app process
+    CHAT_ENGINE_CACHE_MAX_ENTRIES: int = 64
+    CHAT_ENGINE_CACHE_TTL_SECONDS: int = 30 * 60
+    # Number of triplets deduped and written together by the knowledge graph bulk ingestion
+    KG_INGEST_BATCH_SIZE: int = 5000
+    # Find the knowledge graph entities mentioned in a question by matching the graph's entity
+    # names, rather than asking the LLM for keywords and their synonyms
+    KG_OFFLINE_ENTITY_EXTRACTION: bool = True
+    # Keyword sets whose synonyms are kept in memory by each app process, in front of the alias table
+    KG_SYNONYM_CACHE_MAX_ENTRIES: int = 1024
+    # How documents are queried in conversations created without a retrieval mode (a RetrievalModeEnum value)
+    DEFAULT_RETRIEVAL_MODE: str = "PER_DOCUMENT"
+    # Nodes retrieved across all documents in the consolidated retrieval mode, and the least
+    # number of them that may come from a single document
+    CONSOLIDATED_RETRIEVAL_TOP_K: int = 10
+    CONSOLIDATED_RETRIEVAL_MIN_PER_DOCUMENT: int = 3
+    # Sub-questions being answered at once by each app process, overall and per LLM provider
+    SUB_QUESTION_MAX_CONCURRENCY: int = 16
+    SUB_QUESTION_MAX_CONCURRENCY_PER_PROVIDER: int = 8
+    # Sub-questions not answered within this many seconds are left out of the answer
+    SUB_QUESTION_DEADLINE_SECONDS: float = 45.0
+    # Answers to sub-questions about a document are memoized per conversation
+    SUB_QUESTION_MEMO_MAX_ENTRIES: int = 128
+    SUB_QUESTION_MEMO_MAX_CONVERSATIONS: int = 1024
+    SUB_QUESTION_MEMO_TTL_SECONDS: int = 60 * 60
+    # Answers to the opening question of a conversation are reused for similar questions about the same documents
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_DOCUMENT_SETS: int = 256
+    ANSWER_CACHE_MAX_ANSWERS_PER_DOCUMENT_SET: int = 32
+    ANSWER_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.97
+    # Streamed chat message updates are merged into one flush per window, or once this many are pending
+    SSE_FLUSH_INTERVAL_SECONDS: float = 0.05
+    SSE_FLUSH_MAX_PENDING: int = 64
+    # Number of messages per page of a conversation's messages, by default and at most
+    MESSAGE_PAGE_SIZE: int = 50
+    MESSAGE_PAGE_MAX_SIZE: int = 200
+    # Tokens of the latest messages sent to the LLM as is, older ones are folded into a rolling summary
+    CHAT_HISTORY_TOKEN_BUDGET: int = 3000
+    CHAT_HISTORY_SUMMARY_MAX_TOKENS: int = 400
+    CHAT_HISTORY_SUMMARY_MODEL: str = "gpt-3.5-turbo"
+    # How often the assistant message being generated is checkpointed to the database
+    MESSAGE_CHECKPOINT_INTERVAL_SECONDS: float = 1.0
+    # Chunk size used when streaming objects out of S3
+    S3_READ_CHUNK_SIZE: int = 8 * 1024 * 1024
+    # Objects at least this large are fetched with byte-range requests
+    S3_RANGED_READ_THRESHOLD: int = 64 * 1024 * 1024
 
     # BACKEND_CORS_ORIGINS is a JSON-formatted list of origins
     # e.g: '["http://localhost", "http://localhost:4200", "http://localhost:3000", \
@@ -3,8 +3,8 @@
 from sqlalchemy import Column, DateTime, UUID
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
-from sqlalchemy import Column, String, Enum, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID, ENUM, JSONB
+from sqlalchemy import Column, Computed, String, Enum, ForeignKey, Integer, Float, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID, ENUM, JSONB, ARRAY
 from sqlalchemy.orm import relationship
 from enum import Enum
 from llama_index.callbacks.schema import CBEventType
@@ -43,6 +43,34 @@ class MessageSubProcessStatusEnum(str, Enum):
     FINISHED = "FINISHED"
 
 
+class IngestionJobStatusEnum(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCESS = "SUCCESS"
+    ERROR = "ERROR"
+
+
+class IngestionStageEnum(str, Enum):
+    DOWNLOAD = "DOWNLOAD"
+    EXTRACT = "EXTRACT"
+    EMBED = "EMBED"
+    PERSIST = "PERSIST"
+
+
+class KgAliasSourceEnum(str, Enum):
+    # A name of the entity in the knowledge graph
+    GRAPH = "GRAPH"
+    # A synonym the LLM gave for the keyword
+    LLM = "LLM"
+
+
+class RetrievalModeEnum(str, Enum):
+    # One query engine tool per document
+    PER_DOCUMENT = "PER_DOCUMENT"
+    # A single tool retrieving from all of the conversation's documents with one query
+    CONSOLIDATED = "CONSOLIDATED"
+
+
 # python doesn't allow enums to be extended, so we have to do this
 additional_message_subprocess_fields = {
     "CONSTRUCTED_QUERY_ENGINE": "constructed_query_engine",
@@ -69,6 +97,8 @@ class Document(Base):
     # URL to the actual document (e.g. a PDF)
     url = Column(String, nullable=False, unique=True)
     metadata_map = Column(JSONB, nullable=True)
+    # SHA-256 of the document contents, used to avoid re-indexing identical files
+    content_hash = Column(String, nullable=True, index=True)
     conversations = relationship("ConversationDocument", back_populates="document")
 
 
@@ -77,8 +107,14 @@ class Conversation(Base):
     A conversation with messages and linked documents
     """
 
-    messages = relationship("Message", back_populates="conversation")
+    messages = relationship("Message", back_populates="conversation", order_by="Message.created_at")
     conversation_documents = relationship("ConversationDocument", back_populates="conversation")
+    # Rolling summary of the messages older than the chat history window, and the
+    # created_at of the newest message it covers
+    history_summary = Column(String, nullable=True)
+    history_summary_until = Column(DateTime, nullable=True)
+    # How the conversation's documents are queried, settings.DEFAULT_RETRIEVAL_MODE when not set
+    retrieval_mode = Column(to_pg_enum(RetrievalModeEnum), nullable=True)
 
 
 class ConversationDocument(Base):
@@ -97,6 +133,9 @@ class Message(Base):
     A message in a conversation
     """
 
+    # Pages of a conversation's messages are read newest first
+    __table_args__ = (Index("ix_message_conversation_id_created_at", "conversation_id", "created_at", "id"),)
+
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversation.id"), index=True)
     content = Column(String)
     role = Column(to_pg_enum(MessageRoleEnum))
@@ -127,3 +166,104 @@ class KnowledgeGraph(Base):
     """
     
     index_id = Column(UUID(as_uuid=True), nullable=False, unique=True)
+
+
+# How knowledge graph entity names are normalized for lookups: trimmed, lowercased and with
+# single spaces. Format with the column or expression to normalize.
+KG_ENTITY_NORMALIZE_SQL = "lower(regexp_replace(btrim({}), '\\s+', ' ', 'g'))"
+
+
+class KgTriplet(Base):
+    """
+    A (subject, relation, object) triplet of the knowledge graph. Entities are looked up and
+    traversed by their normalized names, which Postgres keeps up to date.
+    """
+
+    __table_args__ = (
+        UniqueConstraint("subj", "rel", "obj"),
+        Index("ix_kgtriplet_subj_norm_created_at", "subj_norm", "created_at"),
+        Index("ix_kgtriplet_obj_norm", "obj_norm"),
+        # For fuzzy lookups of subjects with pg_trgm
+        Index(
+            "ix_kgtriplet_subj_norm_trgm",
+            "subj_norm",
+            postgresql_using="gin",
+            postgresql_ops={"subj_norm": "gin_trgm_ops"},
+        ),
+    )
+
+    subj = Column(String, nullable=False)
+    rel = Column(String, nullable=False)
+    obj = Column(String, nullable=False)
+    subj_norm = Column(String, Computed(KG_ENTITY_NORMALIZE_SQL.format("subj"), persisted=True), nullable=False)
+    obj_norm = Column(String, Computed(KG_ENTITY_NORMALIZE_SQL.format("obj"), persisted=True), nullable=False)
+
+
+class KgEntityAlias(Base):
+    """
+    An alias of a knowledge graph entity or of a keyword, keyed by the entity key of the entity
+    or keyword (see app.chat.kg_entities.get_entity_key)
+    """
+
+    __table_args__ = (UniqueConstraint("entity_key", "alias"),)
+
+    entity_key = Column(String, nullable=False)
+    alias = Column(String, nullable=False)
+    source = Column(to_pg_enum(KgAliasSourceEnum), nullable=False)
+
+
+class OcrPageCache(Base):
+    """
+    OCR output for a single page of a PDF, keyed by the PDF's content hash
+    """
+
+    __table_args__ = (UniqueConstraint("content_hash", "page_number"),)
+
+    content_hash = Column(String, nullable=False, index=True)
+    page_number = Column(Integer, nullable=False)
+    text = Column(String, nullable=False)
+
+
+class IngestionJob(Base):
+    """
+    A queued request to parse, embed and persist the index of a document
+    """
+
+    document_id = Column(UUID(as_uuid=True), ForeignKey("document.id"), nullable=False, index=True)
+    status = Column(
+        to_pg_enum(IngestionJobStatusEnum),
+        default=IngestionJobStatusEnum.QUEUED,
+        nullable=False,
+        index=True,
+    )
+    stage = Column(to_pg_enum(IngestionStageEnum), nullable=True)
+    # Maps each started stage to its status, e.g. {"DOWNLOAD": "SUCCESS", "EXTRACT": "RUNNING"}
+    progress = Column(JSONB, nullable=False, default=dict)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+
+
+class EmbeddingCache(Base):
+    """
+    A cached embedding of a chunk of text, keyed by embedding model and the SHA-256 of the text
+    """
+
+    __table_args__ = (UniqueConstraint("model_name", "text_hash"),)
+
+    model_name = Column(String, nullable=False)
+    text_hash = Column(String, nullable=False)
+    embedding = Column(ARRAY(Float), nullable=False)
+    # Used to evict the least recently used entries
+    last_used_at = Column(DateTime, server_default=func.now(), nullable=False, index=True)
+
+
+class StorageEntry(Base):
+    """
+    A LlamaIndex docstore, index store or graph store entry, keyed by collection and key
+    """
+
+    __table_args__ = (UniqueConstraint("collection", "key"),)
+
+    collection = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(JSONB, nullable=False)
@@ -5,6 +5,7 @@ from starlette.middleware.cors import CORSMiddleware
 from app.api.api import api_router
 from app.core.config import settings, AppEnvironment
 from app.loader_io import loader_io_router
+from app.chat.ingestion import start_ingestion_workers, stop_ingestion_workers
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 
@@ -45,6 +46,16 @@ app.include_router(api_router, prefix=settings.API_PREFIX)
 app.mount(f"/{settings.LOADER_IO_VERIFICATION_STR}", loader_io_router)
 
 
+@app.on_event("startup")
+async def on_startup():
+    start_ingestion_workers()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_ingestion_workers()
+
+
 def start():
     print("Running in AppEnvironment: " + settings.ENVIRONMENT.value)
     __setup_logging(settings.LOG_LEVEL)
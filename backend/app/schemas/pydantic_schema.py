@@ -10,10 +10,13 @@ from llama_index.schema import BaseNode, NodeWithScore
 from llama_index.callbacks.schema import EventPayload
 from llama_index.query_engine.sub_question_query_engine import SubQuestionAnswerPair
 from app.db.models.base import (
+    IngestionJobStatusEnum,
+    IngestionStageEnum,
     MessageRoleEnum,
     MessageStatusEnum,
     MessageSubProcessSourceEnum,
     MessageSubProcessStatusEnum,
+    RetrievalModeEnum,
 )
 from app.chat.constants import DB_DOC_ID_KEY
 
@@ -95,6 +98,10 @@ class QuestionAnswerPair(BaseMetadataObject):
 # later will be Union[QuestionAnswerPair, more to add later... ]
 class SubProcessMetadataKeysEnum(str, Enum):
     SUB_QUESTION = EventPayload.SUB_QUESTION.value
+    # Set when the sub-question's answer was reused from earlier in the conversation
+    MEMOIZED = "memoized"
+    # Set when the sub-question wasn't answered before its deadline
+    TIMED_OUT = "timed_out"
 
 
 # keeping the typing pretty loose here, in case there are changes to the metadata data formats.
@@ -116,6 +123,27 @@ class Message(Base):
     sub_processes: List[MessageSubProcess]
 
 
+class MessageContentDelta(BaseModel):
+    """
+    Text appended to the content of the assistant message being streamed
+    """
+
+    delta: str
+
+
+class MessageSubProcessUpsert(BaseModel):
+    """
+    A sub-process of the assistant message being streamed that has started or finished,
+    identified by the id of its callback event
+    """
+
+    event_id: str
+    source: MessageSubProcessSourceEnum
+    status: MessageSubProcessStatusEnum
+    metadata_map: Optional[SubProcessMetadataMap]
+    created_at: datetime
+
+
 class UserMessageCreate(BaseModel):
     content: str
 
@@ -157,15 +185,48 @@ class AccountsDocumentMetadata(DocumentMetadata):
 class Document(Base):
     url: str
     metadata_map: Optional[DocumentMetadata] = None
+    content_hash: Optional[str] = None
+
+
+class IngestionJob(Base):
+    document_id: UUID
+    status: IngestionJobStatusEnum
+    stage: Optional[IngestionStageEnum]
+    # Status of each stage that has started, keyed by stage name
+    progress: Dict[IngestionStageEnum, str]
+    attempts: int
+    error: Optional[str]
 
 
 class Conversation(Base):
     messages: List[Message]
     documents: List[Document]
+    history_summary: Optional[str]
+    history_summary_until: Optional[datetime]
+    retrieval_mode: Optional[RetrievalModeEnum]
+
+
+class ConversationHeader(Base):
+    documents: List[Document]
+    history_summary: Optional[str]
+    history_summary_until: Optional[datetime]
+    retrieval_mode: Optional[RetrievalModeEnum]
+
+
+class MessagePage(BaseModel):
+    """
+    A page of a conversation's messages, oldest first
+    """
+
+    messages: List[Message]
+    # Pass as `before` to get the previous page, None when this is the first page
+    next_before: Optional[UUID]
 
 
 class ConversationCreate(BaseModel):
     document_ids: List[UUID]
+    # Defaults to settings.DEFAULT_RETRIEVAL_MODE when not given
+    retrieval_mode: Optional[RetrievalModeEnum]
 
 
 class Links(BaseModel):
@@ -0,0 +1,82 @@
+import random
+import statistics
+import time
+from fire import Fire
+from app.chat.kg_adjacency import AdjacencyIndex
+from app.chat.kg_retriever_custom import REL_TEXT_LIMIT
+
+RELATIONS = ("has shareholder", "is shareholder of", "has acquired", "is acquired by", "is director of")
+
+
+def build_graph_dict(num_triplets: int, triplets_per_subject: int = 5):
+    num_subjects = max(num_triplets // triplets_per_subject, 1)
+    graph_dict = {}
+    for i in range(num_triplets):
+        subj = f"Company {i % num_subjects}"
+        obj = f"Company {random.randrange(num_subjects)}"
+        graph_dict.setdefault(subj, []).append([random.choice(RELATIONS), obj])
+    return graph_dict
+
+
+def recursive_rel_map(graph_dict, subj, depth, limit):
+    """
+    The traversal KnowledgeGraphRAGRetriever used to do, which case-folds a copy of the
+    whole graph on every call
+    """
+    graph_dict_lower = {k.lower(): v for k, v in graph_dict.items()}
+    if depth == 0:
+        return []
+    rel_map = []
+    rel_count = 0
+    if subj.lower() in graph_dict_lower:
+        for rel, obj in graph_dict_lower[subj.lower()]:
+            if rel_count >= limit:
+                break
+            rel_map.append([subj, rel, obj])
+            rel_map += recursive_rel_map(graph_dict, obj, depth - 1, limit)
+            rel_count += 1
+    return rel_map
+
+
+def time_ms(fn, subjects) -> float:
+    durations = []
+    for subj in subjects:
+        started = time.perf_counter()
+        fn(subj)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def main(
+    triplet_counts=(10_000, 100_000, 1_000_000),
+    depth: int = 2,
+    limit: int = REL_TEXT_LIMIT,
+    queries: int = 20,
+    recursive_max_triplets: int = 100_000,
+):
+    """
+    Compare the latency of a knowledge graph traversal with the adjacency index and with the
+    previous recursive traversal as the graph grows. The recursive traversal is only run on
+    graphs of up to recursive_max_triplets triplets, as it gets very slow on larger ones.
+    """
+    for num_triplets in triplet_counts:
+        graph_dict = build_graph_dict(num_triplets)
+        subjects = [subj.upper() for subj in random.sample(list(graph_dict), min(queries, len(graph_dict)))]
+
+        started = time.perf_counter()
+        index = AdjacencyIndex(graph_dict)
+        build_seconds = time.perf_counter() - started
+        indexed_ms = time_ms(lambda subj: index.get_rel_map(subj, depth, limit), subjects)
+
+        result = (
+            f"{num_triplets:>9,} triplets: adjacency index {indexed_ms:.3f}ms per traversal "
+            f"(built once in {build_seconds:.2f}s)"
+        )
+        if num_triplets <= recursive_max_triplets:
+            recursive_ms = time_ms(lambda subj: recursive_rel_map(graph_dict, subj, depth, limit), subjects[:3])
+            result += f", recursive {recursive_ms:.1f}ms per traversal"
+        print(result)
+
+
+if __name__ == "__main__":
+    Fire(main)
@@ -0,0 +1,79 @@
+import asyncio
+import random
+import statistics
+import time
+from fire import Fire
+from app.api import crud
+from app.chat.engine import build_description_for_document
+from app.chat.multi_document import get_max_per_document
+from app.chat.pg_vector import get_vector_store_singleton
+from app.chat.tokens import count_tokens
+from app.chat.tools import build_title_for_document
+from app.core.config import settings
+from app.db.session import SessionLocal
+
+EMBEDDING_DIMENSIONS = 1536
+# similarity_top_k of each per-document query engine, see index_to_query_engine
+PER_DOCUMENT_TOP_K = 3
+
+
+def random_embedding():
+    return [random.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+async def time_per_document(vector_store, doc_ids, embedding) -> float:
+    """
+    One filtered query per document, run concurrently as the sub-questions of a turn are
+    """
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        vector_store.aquery_documents(embedding, [doc_id], PER_DOCUMENT_TOP_K, PER_DOCUMENT_TOP_K)
+        for doc_id in doc_ids
+    ))
+    return time.perf_counter() - started
+
+
+async def time_consolidated(vector_store, doc_ids, embedding) -> float:
+    top_k = settings.CONSOLIDATED_RETRIEVAL_TOP_K
+    started = time.perf_counter()
+    await vector_store.aquery_documents(embedding, doc_ids, top_k, get_max_per_document(top_k, len(doc_ids)))
+    return time.perf_counter() - started
+
+
+async def _async_main(document_counts, repeats: int):
+    async with SessionLocal() as db:
+        documents = await crud.fetch_documents(db, limit=max(document_counts))
+    vector_store = await get_vector_store_singleton()
+
+    for num_documents in document_counts:
+        docs = documents[:num_documents]
+        if len(docs) < num_documents:
+            print(f"Only {len(docs)} documents in the database, skipping {num_documents}")
+            continue
+        doc_ids = [str(doc.id) for doc in docs]
+        per_document, consolidated = [], []
+        for _ in range(repeats):
+            embedding = random_embedding()
+            per_document.append(await time_per_document(vector_store, doc_ids, embedding))
+            consolidated.append(await time_consolidated(vector_store, doc_ids, embedding))
+
+        # The agent is sent one tool description per document, or one listing the titles
+        per_document_tokens = sum(count_tokens(build_description_for_document(doc)) for doc in docs)
+        consolidated_tokens = count_tokens("\n".join("- " + build_title_for_document(doc) for doc in docs))
+        print(
+            f"{num_documents:>3} documents: per-document {num_documents} queries "
+            f"{statistics.median(per_document) * 1000:.1f}ms, {per_document_tokens} tool tokens | "
+            f"consolidated 1 query {statistics.median(consolidated) * 1000:.1f}ms, {consolidated_tokens} tool tokens"
+        )
+
+
+def main(document_counts=(5, 20, 50), repeats: int = 10):
+    """
+    Compare the vector store queries and tool description tokens of the per-document and
+    consolidated retrieval modes for conversations about an increasing number of documents
+    """
+    asyncio.run(_async_main(list(document_counts), repeats))
+
+
+if __name__ == "__main__":
+    Fire(main)
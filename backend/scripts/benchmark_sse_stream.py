@@ -0,0 +1,72 @@
+import time
+from uuid import uuid4
+from fire import Fire
+from sse_starlette.sse import ServerSentEvent
+from app.chat.messaging import StreamedMessage, StreamedMessageSubProcess
+from app.chat.streaming import MessageStream, StreamFormatEnum
+from app.db.models.base import Message, MessageRoleEnum, MessageStatusEnum, MessageSubProcessSourceEnum
+
+
+def build_stream_objects(tokens: int, sub_questions: int):
+    """
+    The objects handle_chat_message streams for an answer of `tokens` tokens that
+    took `sub_questions` sub-questions, each reported as a start and an end event
+    """
+    objects = []
+    for _ in range(sub_questions):
+        event_id = str(uuid4())
+        for has_ended in (False, True):
+            objects.append(StreamedMessageSubProcess(
+                source=MessageSubProcessSourceEnum.SUB_QUESTION,
+                has_ended=has_ended,
+                event_id=event_id,
+                metadata_map=None,
+            ))
+    objects += [StreamedMessage(delta=" token") for _ in range(tokens)]
+
+    return objects
+
+
+def run(stream_format: StreamFormatEnum, objects) -> dict:
+    message = Message(
+        id=str(uuid4()),
+        conversation_id=str(uuid4()),
+        content="",
+        role=MessageRoleEnum.assistant,
+        status=MessageStatusEnum.PENDING,
+        sub_processes=[],
+    )
+    message_stream = MessageStream(message, stream_format)
+    started = time.process_time()
+    frames = [message_stream.start()] + [message_stream.apply(message_obj) for message_obj in objects]
+    frames.append(message_stream.snapshot())
+    sent = sum(
+        len(frame.encode() if isinstance(frame, ServerSentEvent) else ServerSentEvent(data=frame).encode())
+        for frame in frames
+        if frame is not None
+    )
+    cpu_seconds = time.process_time() - started
+
+    return {"frames": sum(1 for frame in frames if frame is not None), "bytes": sent, "cpu_seconds": cpu_seconds}
+
+
+def main(tokens: int = 2000, sub_questions: int = 5):
+    """
+    Compare the bytes sent and the CPU time spent serializing one answer in each stream format
+    """
+    objects = build_stream_objects(tokens, sub_questions)
+    results = {stream_format: run(stream_format, objects) for stream_format in StreamFormatEnum}
+    for stream_format, result in results.items():
+        print(
+            f"{stream_format.value:>8}: {result['frames']} frames, {result['bytes']:,} bytes, "
+            f"{result['cpu_seconds'] * 1000:.1f}ms CPU"
+        )
+    snapshot, delta = results[StreamFormatEnum.SNAPSHOT], results[StreamFormatEnum.DELTA]
+    print(
+        f"delta saves {1 - delta['bytes'] / snapshot['bytes']:.1%} of the bytes and "
+        f"{1 - delta['cpu_seconds'] / max(snapshot['cpu_seconds'], 1e-9):.1%} of the CPU time"
+    )
+
+
+if __name__ == "__main__":
+    Fire(main)
@@ -0,0 +1,57 @@
+import asyncio
+import hashlib
+import random
+import uvicorn
+from fire import Fire
+from fastapi import FastAPI, HTTPException, Request
+
+
+def build_app(dimensions: int, latency: float, failure_rate: float) -> FastAPI:
+    """
+    A stand-in for the OpenAI embeddings API that returns deterministic vectors,
+    with configurable latency and failure rate for exercising the embedding pipeline.
+    """
+    app = FastAPI()
+
+    @app.post("/embeddings")
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(latency)
+        if random.random() < failure_rate:
+            raise HTTPException(status_code=429, detail="Rate limit reached")
+
+        data = []
+        for idx, text in enumerate(inputs):
+            seed = int(hashlib.sha256(str(text).encode("utf-8")).hexdigest(), 16)
+            rng = random.Random(seed)
+            data.append({"object": "embedding", "index": idx, "embedding": [rng.uniform(-1, 1) for _ in range(dimensions)]})
+
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def run_fake_embedding_server(
+    port: int = 8089, dimensions: int = 1536, latency: float = 0.2, failure_rate: float = 0.0
+):
+    """
+    Run a fake embedding server. Point the app at it with
+    EMBEDDING_API_BASE=http://localhost:8089/v1
+
+    :param port: Port to listen on.
+    :param dimensions: Size of the returned vectors.
+    :param latency: Seconds to wait before answering each request.
+    :param failure_rate: Fraction of requests answered with a 429.
+    """
+    uvicorn.run(build_app(dimensions, latency, failure_rate), host="0.0.0.0", port=port)
+
+
+if __name__ == "__main__":
+    Fire(run_fake_embedding_server)
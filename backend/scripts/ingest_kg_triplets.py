@@ -0,0 +1,42 @@
+import asyncio
+from typing import AsyncIterator, Optional
+import anyio
+from fire import Fire
+from app.chat.kg_ingestion import TripletFormatEnum, aiter_lines, ingest_triplets
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+async def aiter_file(path: str) -> AsyncIterator[bytes]:
+    async with await anyio.open_file(path, "rb") as f:
+        while chunk := await f.read(READ_CHUNK_SIZE):
+            yield chunk
+
+
+async def async_main_ingest_kg_triplets(path: str, format: Optional[str], batch_size: Optional[int]):
+    triplet_format = TripletFormatEnum(format or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"))
+    stats = await ingest_triplets(aiter_lines(aiter_file(path)), triplet_format, batch_size=batch_size)
+
+    print(
+        f"{stats.lines - stats.invalid:,} triplets read in {stats.seconds:.1f}s "
+        f"({stats.triplets_per_second:,.0f} triplets/sec): {stats.inserted:,} inserted, "
+        f"{stats.duplicates:,} duplicates, {stats.invalid:,} invalid lines, {stats.batches} batches"
+    )
+    for error in stats.errors:
+        print(f"  {error}")
+
+
+def main_ingest_kg_triplets(path: str, format: Optional[str] = None, batch_size: Optional[int] = None):
+    """
+    Bulk insert the (subject, relation, object) triplets of a CSV or JSONL file into the
+    knowledge graph. The format is guessed from the file extension unless given.
+
+    With the S3 storage backend the whole graph is read, added to and written back, so only one
+    ingest may run at a time: don't run this alongside another run or a POST /api/data/kg-triplets,
+    as the triplets of whichever finishes first would be lost.
+    """
+    asyncio.run(async_main_ingest_kg_triplets(path, format, batch_size))
+
+
+if __name__ == "__main__":
+    Fire(main_ingest_kg_triplets)
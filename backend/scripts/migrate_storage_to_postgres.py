@@ -0,0 +1,52 @@
+import asyncio
+import json
+from fire import Fire
+from tqdm import tqdm
+from app.core.config import settings
+from app.chat.engine import get_s3_fs
+from app.chat.pg_storage import PostgresGraphStore, persist_storage_data
+from app.chat.storage import DOCSTORE_FNAME, INDEX_STORE_FNAME, get_shard_dir, load_manifest
+
+
+def load_json(fs, path: str) -> dict:
+    try:
+        return json.loads(fs.cat_file(path))
+    except FileNotFoundError:
+        print(f"No {path}, skipping")
+        return {}
+
+
+async def async_main_migrate_storage_to_postgres():
+    """
+    Copy the docstore, index store and graph store from the S3 JSON blobs (both the legacy
+    whole-context blobs and the per-document shards) into the storageentry and kgtriplet tables.
+    Safe to run more than once, as every entry is upserted.
+    """
+
+    fs = get_s3_fs()
+    persist_dir = settings.S3_BUCKET_NAME
+
+    print("Migrating legacy storage context")
+    await persist_storage_data(
+        load_json(fs, f"{persist_dir}/{DOCSTORE_FNAME}"),
+        load_json(fs, f"{persist_dir}/{INDEX_STORE_FNAME}"),
+    )
+    graph_dict = load_json(fs, f"{persist_dir}/graph_store.json").get("graph_dict", {})
+    await PostgresGraphStore().aput_all(graph_dict)
+    print(f"Migrated the triplets of {len(graph_dict)} knowledge graph subjects")
+
+    manifest = load_manifest(persist_dir, fs)
+    for doc_id in tqdm(manifest, desc="Migrating document shards"):
+        shard_dir = get_shard_dir(persist_dir, doc_id)
+        await persist_storage_data(
+            load_json(fs, f"{shard_dir}/{DOCSTORE_FNAME}"),
+            load_json(fs, f"{shard_dir}/{INDEX_STORE_FNAME}"),
+        )
+
+
+def main_migrate_storage_to_postgres():
+    asyncio.run(async_main_migrate_storage_to_postgres())
+
+
+if __name__ == "__main__":
+    Fire(main_migrate_storage_to_postgres)
@@ -0,0 +1,21 @@
+import asyncio
+from fire import Fire
+from app.chat.ingestion import ingestion_worker
+from app.core.config import settings
+
+
+async def async_run_ingestion_worker(concurrency: int):
+    await asyncio.gather(*[ingestion_worker(worker_number) for worker_number in range(concurrency)])
+
+
+def run_ingestion_worker(concurrency: int = settings.INGESTION_WORKER_CONCURRENCY):
+    """
+    Run ingestion workers outside of the API process.
+
+    :param concurrency: Number of jobs to process concurrently.
+    """
+    asyncio.run(async_run_ingestion_worker(concurrency))
+
+
+if __name__ == "__main__":
+    Fire(run_ingestion_worker)
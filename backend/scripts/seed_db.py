@@ -6,7 +6,9 @@ from app.db.models.base import KnowledgeGraph
 from app.schemas.pydantic_schema import DocumentTypeEnum
 from app.api.crud import create_kg_index, fetch_kg_index
 from app.db.session import SessionLocal
-from app.core.config import settings
+from app.core.config import StorageBackendEnum, settings
+from app.chat.pg_storage import PostgresGraphStore
+from app.chat.kg_aliases import aput_graph_aliases
 
 from llama_index import (
     ServiceContext,
@@ -74,32 +76,44 @@ async def load_kg():
     return kg_index
 
 
-async def update_kg():
-    s3_fs = get_s3_fs()
-    persist_dir = f"{settings.S3_BUCKET_NAME}"
-    kg_index = await load_kg()
+SEED_TRIPLETS = [
+    ("Peter Berry", "is shareholder of", "SME LENDING"),
+    ("Peter Berry", "is shareholder of", "SME TECHNOLOGIES"),
+
+    ("Andy Davis", "is shareholder of", "SME LENDING"),
+    ("Andy Davis", "is shareholder of", "SME TECHNOLOGIES"),
+
+    ("Ronnie Jayson", "is shareholder of", "SME TECHNOLOGIES"),
 
-    kg_index.upsert_triplet(("Peter Berry", "is shareholder of", "SME LENDING"))
-    kg_index.upsert_triplet(("Peter Berry", "is shareholder of", "SME TECHNOLOGIES"))
+    ("John Roberts", "is shareholder of", "BANK TECH"),
+    ("Sarah Smith", "is shareholder of", "BANK TECH"),
 
-    kg_index.upsert_triplet(("Andy Davis", "is shareholder of", "SME LENDING"))
-    kg_index.upsert_triplet(("Andy Davis", "is shareholder of", "SME TECHNOLOGIES"))
+    ("SME LENDING", "has shareholder", "Peter Berry"),
+    ("SME TECHNOLOGIES", "has shareholder", "Peter Berry"),
+    ("SME LENDING", "has shareholder", "Andy Davis"),
+    ("SME TECHNOLOGIES", "has shareholder", "Andy Davis"),
+    ("SME TECHNOLOGIES", "has shareholder", "Ronnie Jayson"),
+    ("BANK TECH", "has shareholder", "John Roberts"),
+    ("BANK TECH", "has shareholder", "Sarah Smith"),
 
-    kg_index.upsert_triplet(("Ronnie Jayson", "is shareholder of", "SME TECHNOLOGIES"))
+    ("BANK TECH", "is acquired by", "SME TECHNOLOGIES"),
+    ("SME TECHNOLOGIES", "has acquired", "BANK TECH"),
+]
 
-    kg_index.upsert_triplet(("John Roberts", "is shareholder of", "BANK TECH"))
-    kg_index.upsert_triplet(("Sarah Smith", "is shareholder of", "BANK TECH"))
 
-    kg_index.upsert_triplet(("SME LENDING", "has shareholder", "Peter Berry"))
-    kg_index.upsert_triplet(("SME TECHNOLOGIES", "has shareholder", "Peter Berry"))
-    kg_index.upsert_triplet(("SME LENDING", "has shareholder", "Andy Davis"))
-    kg_index.upsert_triplet(("SME TECHNOLOGIES", "has shareholder", "Andy Davis"))
-    kg_index.upsert_triplet(("SME TECHNOLOGIES", "has shareholder", "Ronnie Jayson"))
-    kg_index.upsert_triplet(("BANK TECH", "has shareholder", "John Roberts"))
-    kg_index.upsert_triplet(("BANK TECH", "has shareholder", "Sarah Smith"))
+async def update_kg():
+    if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.POSTGRES:
+        inserted = await PostgresGraphStore().aupsert_triplets(SEED_TRIPLETS)
+        await aput_graph_aliases(name for subj, _, obj in SEED_TRIPLETS for name in (subj, obj))
+        print(f"Inserted {inserted} triplets into the knowledge graph")
+        return
+
+    s3_fs = get_s3_fs()
+    persist_dir = f"{settings.S3_BUCKET_NAME}"
+    kg_index = await load_kg()
 
-    kg_index.upsert_triplet(("BANK TECH", "is acquired by", "SME TECHNOLOGIES"))
-    kg_index.upsert_triplet(("SME TECHNOLOGIES", "has acquired", "BANK TECH"))
+    for triplet in SEED_TRIPLETS:
+        kg_index.upsert_triplet(triplet)
 
     # Store the index in the s3 bucket
     kg_index.storage_context.persist(persist_dir=persist_dir, fs=s3_fs)
@@ -113,7 +127,6 @@ if __name__ == "__main__":
     if args.action == 'build':
         asyncio.run(build_kg())
     elif args.action == 'update':
-        kg_index = asyncio.run(update_kg())
-        print(f'🚨 put this in the engine yo! just search for index_id="{kg_index.index_id}"')
+        asyncio.run(update_kg())
     else:
         raise ValueError('Invalid action')
\ No newline at end of file
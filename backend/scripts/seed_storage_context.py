@@ -1,26 +1,47 @@
 from tqdm import tqdm
 from fire import Fire
 import asyncio
+from llama_index import StorageContext
 from app.db.session import SessionLocal
 from app.api import crud
+from app.core.config import StorageBackendEnum, settings
+from app.chat.pg_storage import INDEX_STORE_COLLECTION, PostgresKVStore
+from app.chat.storage import load_manifest
 from app.chat.engine import (
     get_tool_service_context,
-    build_doc_id_to_index_map,
+    index_documents,
     get_s3_fs,
 )
 
 
-async def async_main_seed_storage_context():
+async def async_main_seed_storage_context(batch_size: int = settings.SEED_BATCH_SIZE):
     fs = get_s3_fs()
     async with SessionLocal() as db:
         docs = await crud.fetch_documents(db)
+
+    # Only index documents that don't have an index yet
+    if settings.INDEX_STORAGE_BACKEND == StorageBackendEnum.POSTGRES:
+        indexed = await PostgresKVStore().aget_many([str(doc.id) for doc in docs], collection=INDEX_STORE_COLLECTION)
+        docs = [doc for doc in docs if str(doc.id) not in indexed]
+    else:
+        manifest = load_manifest(settings.S3_BUCKET_NAME, fs)
+        docs = [doc for doc in docs if str(doc.id) not in manifest]
+        # Documents indexed before the storage was split per document are still in the legacy blobs
+        try:
+            index_store = StorageContext.from_defaults(persist_dir=settings.S3_BUCKET_NAME, fs=fs).index_store
+            docs = [doc for doc in docs if index_store.get_index_struct(str(doc.id)) is None]
+        except FileNotFoundError:
+            pass
+
     service_context = get_tool_service_context([])
-    for doc in tqdm(docs, desc="Seeding storage with DB documents"):
-        await build_doc_id_to_index_map(service_context, [doc], fs=fs)
+    batches = [docs[start:start + batch_size] for start in range(0, len(docs), batch_size)]
+    for batch in tqdm(batches, desc="Seeding storage with DB documents"):
+        # Nodes from every document in the batch are embedded together
+        await index_documents(service_context, batch, fs=fs)
 
 
-def main_seed_storage_context():
-    asyncio.run(async_main_seed_storage_context())
+def main_seed_storage_context(batch_size: int = settings.SEED_BATCH_SIZE):
+    asyncio.run(async_main_seed_storage_context(batch_size=batch_size))
 
 
 if __name__ == "__main__":
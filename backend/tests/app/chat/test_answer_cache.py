@@ -0,0 +1,46 @@
+from app.chat.answer_cache import CachedSubProcess, SemanticAnswerCache, normalize_question
+from app.db.models.base import MessageSubProcessSourceEnum
+
+
+KEY = (("doc-a", "hash-a"), ("doc-b", "hash-b"))
+
+
+def build_cache(ttl_seconds: float = 60) -> SemanticAnswerCache:
+    return SemanticAnswerCache(
+        max_document_sets=2,
+        max_answers_per_document_set=2,
+        ttl_seconds=ttl_seconds,
+        similarity_threshold=0.95,
+    )
+
+
+def test_similar_questions_about_the_same_documents_hit():
+    cache = build_cache()
+    sub_processes = [CachedSubProcess(MessageSubProcessSourceEnum.SUB_QUESTION, {"sub_question": {}})]
+    cache.put_answer(KEY, "What are the key risks?", [1.0, 0.0, 0.0], "The key risks are...", sub_processes)
+
+    hit = cache.get_answer(KEY, [0.99, 0.05, 0.0])
+
+    assert hit is not None and hit.content == "The key risks are..." and hit.sub_processes == sub_processes
+    assert cache.get_answer(KEY, [0.0, 1.0, 0.0]) is None
+    assert cache.get_answer((("doc-a", "hash-a"),), [1.0, 0.0, 0.0]) is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+
+def test_expired_and_invalidated_answers_miss():
+    cache = build_cache(ttl_seconds=-1)
+    cache.put_answer(KEY, "q", [1.0, 0.0], "expired", [])
+
+    assert cache.get_answer(KEY, [1.0, 0.0]) is None
+    assert cache.stats.expirations == 1
+
+    cache = build_cache()
+    cache.put_answer(KEY, "q", [1.0, 0.0], "answer", [])
+    cache.invalidate_document("doc-b")
+
+    assert cache.get_answer(KEY, [1.0, 0.0]) is None
+    assert cache.stats.invalidations == 1
+
+
+def test_normalize_question():
+    assert normalize_question("  What are the\n key RISKS?? ") == "what are the key risks"
@@ -0,0 +1,113 @@
+import asyncio
+from typing import List
+from llama_index.embeddings.base import BaseEmbedding
+from app.chat import embedding
+from app.chat.embedding import EmbeddingStats, batch_by_tokens, embed_texts, evict_cached_embeddings_if_full
+from tests.app.chat.test_history import FakeSession
+
+
+class FakeEmbedding(BaseEmbedding):
+    """
+    Embeds each text as [len(text)] and fails the first `failures` batch requests.
+    """
+
+    failures: int = 0
+    batches: List[List[str]] = []
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return [float(len(query))]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return [float(len(query))]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return [float(len(text))]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("Rate limit reached")
+        self.batches.append(texts)
+        return [[float(len(text))] for text in texts]
+
+
+class TestBatchByTokens:
+    """
+    Test the batch_by_tokens function.
+    """
+
+    def test_batch_by_tokens_respects_token_budget(self):
+        assert batch_by_tokens([4, 4, 4, 4], max_tokens=8, max_batch_size=10) == [[0, 1], [2, 3]]
+
+    def test_batch_by_tokens_respects_batch_size(self):
+        assert batch_by_tokens([1, 1, 1], max_tokens=100, max_batch_size=2) == [[0, 1], [2]]
+
+    def test_batch_by_tokens_oversized_text_gets_own_batch(self):
+        assert batch_by_tokens([1, 50, 1], max_tokens=10, max_batch_size=10) == [[0], [1], [2]]
+
+    def test_batch_by_tokens_empty(self):
+        assert batch_by_tokens([], max_tokens=10, max_batch_size=10) == []
+
+
+class TestEmbedTexts:
+    """
+    Test the embed_texts function.
+    """
+
+    def test_embed_texts_preserves_order(self):
+        embed_model = FakeEmbedding(embed_batch_size=100, batches=[])
+        texts = ["a" * length for length in range(1, 40)]
+        embeddings = asyncio.run(
+            embed_texts(embed_model, texts, max_tokens=20, max_batch_size=5, concurrency=3)
+        )
+        assert embeddings == [[float(length)] for length in range(1, 40)]
+        assert len(embed_model.batches) > 1
+        assert all(len(batch) <= 5 for batch in embed_model.batches)
+
+    def test_embed_texts_retries_failed_batches(self, monkeypatch):
+        monkeypatch.setattr("app.chat.embedding.settings.EMBEDDING_RETRY_BASE_SECONDS", 0)
+        embed_model = FakeEmbedding(embed_batch_size=100, batches=[], failures=2)
+        stats = EmbeddingStats()
+        embeddings = asyncio.run(
+            embed_texts(embed_model, ["hello", "world"], max_retries=3, stats=stats)
+        )
+        assert embeddings == [[5.0], [5.0]]
+        assert stats.retries == 2
+        assert stats.texts == 2
+
+
+class TestEmbeddingCacheEviction:
+    """
+    Test the evict_cached_embeddings_if_full function.
+    """
+
+    def test_evicts_only_when_estimated_full_and_at_most_once_per_interval(self, monkeypatch):
+        estimates = iter([900, 1200, 1200])
+        evictions = []
+        now = [0.0]
+
+        async def estimate_cached_embeddings(db):
+            return next(estimates)
+
+        async def evict_cached_embeddings(db, max_entries):
+            evictions.append(max_entries)
+            return 200
+
+        monkeypatch.setattr(embedding, "SessionLocal", FakeSession)
+        monkeypatch.setattr(embedding, "last_eviction_check", None)
+        monkeypatch.setattr(embedding.time, "monotonic", lambda: now[0])
+        monkeypatch.setattr(embedding.crud, "estimate_cached_embeddings", estimate_cached_embeddings)
+        monkeypatch.setattr(embedding.crud, "evict_cached_embeddings", evict_cached_embeddings)
+        monkeypatch.setattr(embedding.settings, "EMBEDDING_CACHE_MAX_ENTRIES", 1000)
+        monkeypatch.setattr(embedding.settings, "EMBEDDING_CACHE_EVICTION_INTERVAL_SECONDS", 60)
+
+        assert asyncio.run(evict_cached_embeddings_if_full()) == 0
+        now[0] = 30.0
+        assert asyncio.run(evict_cached_embeddings_if_full()) == 0
+        now[0] = 61.0
+        assert asyncio.run(evict_cached_embeddings_if_full()) == 200
+        assert evictions == [1000]
@@ -4,7 +4,7 @@ from datetime import datetime
 from llama_index.llms import ChatMessage
 from backend.app.schemas.pydantic_schema import Message
 from app.db.models.base import MessageStatusEnum, MessageRoleEnum
-from app.chat.engine import get_chat_history
+from app.chat.history import get_chat_history
 
 
 class MockMessage(Message):
@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, List, Optional
+from uuid import uuid4
+from llama_index.callbacks.base import BaseCallbackHandler, CallbackManager
+from llama_index.callbacks.schema import CBEventType
+from llama_index.indices.query.base import BaseQueryEngine
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.response.schema import Response
+from app.chat.engine_cache import (
+    MemoizedQueryEngine,
+    SubQuestionMemo,
+    current_callback_handler,
+    current_sub_question_memo,
+    get_chat_tools_key,
+    request_callback_handler,
+)
+from app.schemas.pydantic_schema import Document
+
+
+class RecordingCallbackHandler(BaseCallbackHandler):
+    def __init__(self) -> None:
+        super().__init__([CBEventType.CHUNKING], [CBEventType.CHUNKING])
+        self.events: List[str] = []
+
+    def on_event_start(self, event_type: CBEventType, payload: Optional[dict] = None, event_id: str = "", **kwargs: Any) -> str:
+        self.events.append(event_id)
+        return event_id
+
+    def on_event_end(self, event_type: CBEventType, payload: Optional[dict] = None, event_id: str = "", **kwargs: Any) -> None:
+        pass
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(self, trace_id: Optional[str] = None, trace_map: Optional[dict] = None) -> None:
+        pass
+
+
+def test_events_reach_the_handler_of_their_own_request():
+    callback_manager = CallbackManager([request_callback_handler])
+    handlers = [RecordingCallbackHandler(), RecordingCallbackHandler()]
+
+    async def handle_message(handler: RecordingCallbackHandler, event_id: str) -> None:
+        current_callback_handler.set(handler)
+
+        # Like the sub-questions of a SubQuestionQueryEngine, answered in child tasks
+        async def answer_sub_question() -> None:
+            await asyncio.sleep(0)
+            callback_manager.on_event_start(CBEventType.QUERY, event_id=event_id)
+            callback_manager.on_event_start(CBEventType.CHUNKING, event_id=f"{event_id}-ignored")
+
+        await asyncio.gather(answer_sub_question())
+
+    async def main() -> None:
+        await asyncio.gather(handle_message(handlers[0], "first"), handle_message(handlers[1], "second"))
+
+    asyncio.run(main())
+
+    assert handlers[0].events == ["first"]
+    assert handlers[1].events == ["second"]
+
+
+def test_chat_tools_key_ignores_document_order():
+    first, second = uuid4(), uuid4()
+    documents = [Document(id=first, url="a.pdf", content_hash="a"), Document(id=second, url="b.pdf", content_hash="b")]
+
+    assert get_chat_tools_key(documents) == get_chat_tools_key(list(reversed(documents)))
+    assert get_chat_tools_key(documents) != get_chat_tools_key([documents[0], Document(id=second, url="b.pdf", content_hash="c")])
+
+
+class CountingQueryEngine(BaseQueryEngine):
+    def __init__(self) -> None:
+        super().__init__(None)
+        self.queries: List[str] = []
+
+    def _get_prompt_modules(self) -> dict:
+        return {}
+
+    def _query(self, query_bundle: QueryBundle) -> Response:
+        self.queries.append(query_bundle.query_str)
+        return Response(response=f"answer {len(self.queries)}")
+
+    async def _aquery(self, query_bundle: QueryBundle) -> Response:
+        return self._query(query_bundle)
+
+
+def test_sub_questions_are_memoized_per_conversation():
+    inner = CountingQueryEngine()
+    query_engine = MemoizedQueryEngine("doc-a", inner)
+
+    async def ask(memo: SubQuestionMemo, question: str) -> str:
+        current_sub_question_memo.set(memo)
+        return str(await query_engine.aquery(question))
+
+    memo, other_memo = SubQuestionMemo(maxsize=8), SubQuestionMemo(maxsize=8)
+    assert asyncio.run(ask(memo, "What are the risks?")) == "answer 1"
+    assert asyncio.run(ask(memo, "what are the  risks")) == "answer 1"
+    assert asyncio.run(ask(other_memo, "What are the risks?")) == "answer 2"
+
+    assert inner.queries == ["What are the risks?", "What are the risks?"]
+    assert memo.was_hit("doc-a", "What are the risks?")
+    assert not other_memo.was_hit("doc-a", "What are the risks?")
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime
+from typing import Any, List
+from uuid import uuid4
+from llama_index.llms.base import CompletionResponse, MessageRole
+from app.api import crud
+from app.chat import history
+from app.chat.history import MESSAGE_TOKEN_OVERHEAD, build_chat_history, select_history_window
+from app.chat.tokens import count_tokens
+from app.db.models.base import MessageRoleEnum, MessageStatusEnum
+from app.schemas.pydantic_schema import Conversation, ConversationHeader, Message
+
+
+def build_messages(contents: List[str]) -> List[Message]:
+    conversation_id = uuid4()
+    return [
+        Message(
+            id=uuid4(),
+            conversation_id=conversation_id,
+            content=content,
+            role=MessageRoleEnum.user if i % 2 == 0 else MessageRoleEnum.assistant,
+            status=MessageStatusEnum.SUCCESS,
+            created_at=datetime(2023, 1, 1, 12, i),
+            sub_processes=[],
+        )
+        for i, content in enumerate(contents)
+    ]
+
+
+CONTENTS = ["First question", "First answer", "Second question", "Second answer", "Third question", "Third answer"]
+
+
+def budget_for(contents: List[str]) -> int:
+    return sum(count_tokens(content) + MESSAGE_TOKEN_OVERHEAD for content in contents)
+
+
+def test_window_keeps_latest_turns_within_budget():
+    messages = build_messages(CONTENTS)
+
+    # The budget fits "Second answer" too, but the window doesn't start with an answer
+    window = select_history_window(messages, budget_for(CONTENTS[3:]))
+
+    assert [m.content for m in window.messages] == CONTENTS[4:]
+    assert [m.content for m in window.to_summarize] == CONTENTS[:4]
+
+    window = select_history_window(messages, budget_for(CONTENTS[3:]), summary_until=messages[1].created_at)
+
+    assert [m.content for m in window.to_summarize] == CONTENTS[2:4]
+
+
+class FakeLLM:
+    def __init__(self) -> None:
+        self.prompts: List[str] = []
+
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        self.prompts.append(prompt)
+        return CompletionResponse(text=f"summary {len(self.prompts)}")
+
+
+class FakeSession:
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+def test_summary_is_only_recomputed_when_the_window_moves(monkeypatch):
+    saved = []
+
+    async def update_conversation_history_summary(db, conversation_id, summary, until):
+        saved.append((summary, until))
+
+    monkeypatch.setattr(history, "SessionLocal", FakeSession)
+    monkeypatch.setattr(history.crud, "update_conversation_history_summary", update_conversation_history_summary)
+    messages = build_messages(CONTENTS)
+    conversation = Conversation(id=uuid4(), messages=messages, documents=[])
+    llm = FakeLLM()
+
+    chat_history = asyncio.run(build_chat_history(conversation, budget_for(CONTENTS[4:]), llm=llm))
+
+    assert saved == [("summary 1", messages[3].created_at)]
+    assert chat_history[0].role == MessageRole.SYSTEM and "summary 1" in chat_history[0].content
+    assert [m.content for m in chat_history[1:]] == CONTENTS[4:]
+
+    conversation.history_summary, conversation.history_summary_until = saved[-1]
+    asyncio.run(build_chat_history(conversation, budget_for(CONTENTS[4:]), llm=llm))
+
+    assert len(llm.prompts) == 1
+
+
+def test_chat_loads_every_message_not_yet_summarized(monkeypatch):
+    messages = build_messages(CONTENTS)
+    header = ConversationHeader(
+        id=uuid4(), documents=[], history_summary="summary 1", history_summary_until=messages[1].created_at
+    )
+    calls = []
+
+    async def fetch_conversation_header(db, conversation_id):
+        return header
+
+    async def fetch_messages(db, conversation_id, limit, after=None, **kwargs):
+        calls.append((limit, after))
+        return [m for m in messages if m.created_at > after]
+
+    monkeypatch.setattr(crud, "fetch_conversation_header", fetch_conversation_header)
+    monkeypatch.setattr(crud, "fetch_messages", fetch_messages)
+
+    conversation = asyncio.run(crud.fetch_conversation_for_chat(None, str(header.id)))
+
+    assert calls == [(None, messages[1].created_at)]
+    assert [m.content for m in conversation.messages] == CONTENTS[2:]
@@ -0,0 +1,28 @@
+from app.chat.index_cache import DocumentIndexCache
+
+
+def test_lru_eviction_and_stats():
+    cache = DocumentIndexCache(maxsize=2)
+    cache.put_index("a", "hash-a", "index-a")
+    cache.put_index("b", "hash-b", "index-b")
+    assert cache.get_index("a", "hash-a") == "index-a"
+
+    # "b" is the least recently used entry
+    cache.put_index("c", "hash-c", "index-c")
+
+    assert cache.get_index("b", "hash-b") is None
+    assert cache.get_index("a", "hash-a") == "index-a"
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
+
+
+def test_changed_contents_and_invalidation():
+    cache = DocumentIndexCache(maxsize=2)
+    cache.put_index("a", "hash-a", "index-a")
+
+    assert cache.get_index("a", "new-hash-a") is None
+
+    cache.invalidate("a")
+    cache.invalidate("missing")
+
+    assert cache.get_index("a", "hash-a") is None
+    assert cache.stats.invalidations == 1
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+from sqlalchemy.dialects import postgresql
+from app.chat import ingestion
+from app.db.models.base import IngestionJobStatusEnum
+from app.schemas.pydantic_schema import IngestionJob
+from tests.app.chat.test_history import FakeSession
+
+
+def build_job(attempts: int) -> IngestionJob:
+    return IngestionJob(
+        id=uuid4(), document_id=uuid4(), status=IngestionJobStatusEnum.RUNNING, stage=None, progress={},
+        attempts=attempts, error=None,
+    )
+
+
+def patch_updates(monkeypatch) -> list:
+    updates = []
+
+    async def update_ingestion_job(db, job_id, **values):
+        updates.append(values)
+
+    monkeypatch.setattr(ingestion, "SessionLocal", FakeSession)
+    monkeypatch.setattr(ingestion.crud, "update_ingestion_job", update_ingestion_job)
+    return updates
+
+
+def test_running_job_sends_heartbeats(monkeypatch):
+    updates = patch_updates(monkeypatch)
+    monkeypatch.setattr(ingestion.settings, "INGESTION_HEARTBEAT_INTERVAL_SECONDS", 0.01)
+
+    async def run_ingestion_job(job):
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(ingestion, "run_ingestion_job", run_ingestion_job)
+
+    asyncio.run(ingestion.run_claimed_ingestion_job(build_job(attempts=1)))
+
+    assert len(updates) >= 2
+    assert all(set(values) == {"updated_at"} for values in updates)
+
+
+def test_cancelled_job_is_queued_again(monkeypatch):
+    updates = patch_updates(monkeypatch)
+
+    async def run_ingestion_job(job):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(ingestion, "run_ingestion_job", run_ingestion_job)
+
+    async def run():
+        task = asyncio.create_task(ingestion.run_claimed_ingestion_job(build_job(attempts=2)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+    assert updates == [{"status": IngestionJobStatusEnum.QUEUED, "attempts": 1}]
+
+
+class RecordingSession:
+    def __init__(self) -> None:
+        self.statements = []
+
+    async def execute(self, stmt):
+        self.statements.append(str(stmt.compile(dialect=postgresql.dialect())))
+        return self
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return None
+
+    async def commit(self) -> None:
+        pass
+
+
+def test_stale_jobs_out_of_attempts_are_failed_not_reclaimed():
+    db = RecordingSession()
+
+    assert asyncio.run(ingestion.crud.claim_ingestion_job(db, timedelta(minutes=30), 3)) is None
+
+    fail_stale, claim = db.statements
+    assert fail_stale.startswith("UPDATE ingestionjob SET status=")
+    assert "ingestionjob.attempts >= " in fail_stale
+    assert "ingestionjob.attempts < " in claim
+    assert "FOR UPDATE SKIP LOCKED" in claim
@@ -0,0 +1,40 @@
+from app.chat.kg_adjacency import AdjacencyIndex, get_graph_version
+from app.chat.pg_storage import PostgresGraphStore
+
+
+GRAPH_DICT = {
+    "SME LENDING": [["has shareholder", "Peter Berry"], ["has shareholder", "Andy Davis"]],
+    "Peter Berry": [["is shareholder of", "SME TECHNOLOGIES"], ["is shareholder of", "SME LENDING"]],
+    "Andy Davis": [["is shareholder of", "SME LENDING"]],
+    "SME TECHNOLOGIES": [["has acquired", "BANK TECH"]],
+}
+
+
+def test_traversal_is_case_insensitive_and_nearest_first():
+    index = AdjacencyIndex(GRAPH_DICT)
+
+    assert index.get_rel_map("sme lending", depth=2, limit=30) == [
+        ["sme lending", "has shareholder", "Peter Berry"],
+        ["sme lending", "has shareholder", "Andy Davis"],
+        ["Peter Berry", "is shareholder of", "SME TECHNOLOGIES"],
+        ["Peter Berry", "is shareholder of", "SME LENDING"],
+        ["Andy Davis", "is shareholder of", "SME LENDING"],
+    ]
+
+
+def test_traversal_limits():
+    index = AdjacencyIndex(GRAPH_DICT)
+
+    # SME LENDING is not expanded again through its shareholders
+    assert len(index.get_rel_map("SME LENDING", depth=5, limit=30)) == 6
+    assert len(index.get_rel_map("SME LENDING", depth=2, limit=3)) == 3
+    assert index.get_rel_map("SME LENDING", depth=2, limit=30, max_rels_per_subject=1) == [
+        ["SME LENDING", "has shareholder", "Peter Berry"],
+        ["Peter Berry", "is shareholder of", "SME TECHNOLOGIES"],
+    ]
+    assert index.get_rel_map("Unknown", depth=2, limit=30) == []
+
+
+def test_graph_version():
+    assert get_graph_version(PostgresGraphStore()) == PostgresGraphStore._version
+    assert get_graph_version(object()) is None
@@ -0,0 +1,115 @@
+import ast
+import asyncio
+from types import SimpleNamespace
+from typing import Dict, List, Sequence, Tuple
+from llama_index.storage.storage_context import StorageContext
+from app.chat import kg_aliases
+from app.chat.kg_aliases import SynonymExpansionCache, aput_graph_aliases, get_expansion_key, parse_keyword_synonyms
+from app.chat.kg_retriever_custom import KnowledgeGraphRAGRetriever
+from app.chat.pg_storage import PostgresGraphStore
+from app.db.models.base import KgAliasSourceEnum
+from tests.app.chat.test_history import FakeSession
+
+
+class FakeAliasTable:
+    def __init__(self) -> None:
+        self.rows: Dict[Tuple[str, str], KgAliasSourceEnum] = {}
+
+    async def fetch_kg_aliases(self, db, entity_keys: Sequence[str]) -> Dict[str, List[str]]:
+        aliases: Dict[str, List[str]] = {}
+        for entity_key, alias in self.rows:
+            if entity_key in entity_keys:
+                aliases.setdefault(entity_key, []).append(alias)
+        return aliases
+
+    async def insert_kg_aliases(self, db, aliases: Sequence[Tuple[str, str]], source: KgAliasSourceEnum) -> None:
+        for row in aliases:
+            self.rows.setdefault(row, source)
+
+
+def patch_alias_table(monkeypatch) -> FakeAliasTable:
+    table = FakeAliasTable()
+    monkeypatch.setattr(kg_aliases, "SessionLocal", FakeSession)
+    monkeypatch.setattr(kg_aliases.crud, "fetch_kg_aliases", table.fetch_kg_aliases)
+    monkeypatch.setattr(kg_aliases.crud, "insert_kg_aliases", table.insert_kg_aliases)
+    monkeypatch.setattr(kg_aliases, "synonym_expansion_cache", SynonymExpansionCache(16))
+    return table
+
+
+class FakeLLMPredictor:
+    def __init__(self) -> None:
+        self.questions: List[str] = []
+
+    async def apredict(self, prompt, max_keywords: int, question: str) -> str:
+        self.questions.append(question)
+        keywords = ast.literal_eval(question)
+        return "\n".join(f"{keyword}: {keyword} Ltd, {keyword.upper()}" for keyword in keywords)
+
+
+def build_retriever(monkeypatch) -> KnowledgeGraphRAGRetriever:
+    storage_context = StorageContext.from_defaults(graph_store=PostgresGraphStore())
+    service_context = SimpleNamespace(llm_predictor=FakeLLMPredictor())
+    retriever = KnowledgeGraphRAGRetriever(service_context=service_context, storage_context=storage_context)
+    monkeypatch.setattr("app.chat.kg_retriever_custom.synonym_expansion_cache", kg_aliases.synonym_expansion_cache)
+    return retriever
+
+
+def test_expansion_key_ignores_order_case_and_company_suffixes():
+    assert get_expansion_key(["SME Technologies Ltd", "Bank Tech"]) == get_expansion_key(
+        ["bank tech", "SME TECHNOLOGIES", "sme technologies"]
+    )
+
+
+def test_graph_aliases_group_the_spellings_of_an_entity(monkeypatch):
+    table = patch_alias_table(monkeypatch)
+    kg_aliases.synonym_expansion_cache.put_expansion(["SME LENDING"], ["stale"])
+
+    asyncio.run(aput_graph_aliases(["SME LENDING", "SME Lending Ltd", "SME LENDING"]))
+
+    assert table.rows == {
+        ("sme lending", "SME LENDING"): KgAliasSourceEnum.GRAPH,
+        ("sme lending", "SME Lending Ltd"): KgAliasSourceEnum.GRAPH,
+    }
+    assert kg_aliases.synonym_expansion_cache.currsize == 0
+
+
+def test_keyword_synonyms_are_split_per_keyword():
+    response = """
+    SME Technologies: SME Tech, 'SME TECHNOLOGIES LTD'
+    - bank tech: Bank Technologies
+    Unrelated: Something
+    """
+
+    assert parse_keyword_synonyms(response, ["SME Technologies", "Bank Tech", "Peter Berry"], 3) == {
+        "SME Technologies": ["SME Tech", "SME TECHNOLOGIES LTD"],
+        "Bank Tech": ["Bank Technologies"],
+        "Peter Berry": [],
+    }
+    # At most max_synonyms in total
+    assert parse_keyword_synonyms(response, ["SME Technologies", "Bank Tech"], 2)["Bank Tech"] == []
+
+
+def test_synonyms_are_expanded_by_the_llm_once(monkeypatch):
+    table = patch_alias_table(monkeypatch)
+    asyncio.run(aput_graph_aliases(["BANK TECH", "Bank Tech Ltd"]))
+    retriever = build_retriever(monkeypatch)
+    questions = retriever._service_context.llm_predictor.questions
+
+    synonyms = asyncio.run(retriever._aexpand_synonyms(["Bank Tech", "SME Technologies", "Peter Berry"]))
+
+    # Only the keywords missing from the alias table are asked about, in a single call
+    assert questions == ["['SME Technologies', 'Peter Berry']"]
+    assert sorted(synonyms) == [
+        "BANK TECH", "Bank Tech Ltd", "PETER BERRY", "Peter Berry Ltd", "SME TECHNOLOGIES", "SME Technologies Ltd",
+    ]
+    assert table.rows[("sme technologies", "SME TECHNOLOGIES")] == KgAliasSourceEnum.LLM
+
+    # Repeated from the LRU cache, and from the alias table once the cache is gone
+    asyncio.run(retriever._aexpand_synonyms(["sme technologies", "BANK TECH", "Peter Berry"]))
+    kg_aliases.synonym_expansion_cache.clear()
+    synonyms = asyncio.run(retriever._aexpand_synonyms(["SME Technologies Ltd"]))
+
+    assert len(questions) == 1
+    assert "SME TECHNOLOGIES" in synonyms
+    stats = kg_aliases.synonym_expansion_cache.stats
+    assert (stats.hits, stats.misses, stats.table_hits, stats.llm_expansions) == (1, 2, 2, 2)
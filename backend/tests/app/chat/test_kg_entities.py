@@ -0,0 +1,93 @@
+import asyncio
+from llama_index.graph_stores import SimpleGraphStore
+from app.chat.kg_entities import EntityMatcher, GraphEntityExtractor, get_entity_key
+from app.chat.pg_storage import PostgresGraphStore
+
+
+def test_entity_key_strips_company_suffixes():
+    assert get_entity_key("SME Lending Ltd.") == ("sme", "lending")
+    assert get_entity_key("SME LENDING PUBLIC LIMITED COMPANY") == ("sme", "lending")
+    assert get_entity_key("Acme Co. Limited") == ("acme",)
+    # A name that is only a suffix keeps it
+    assert get_entity_key("Limited") == ("limited",)
+
+
+def test_matcher_finds_the_longest_names_mentioned():
+    matcher = EntityMatcher(["SME LENDING", "SME Lending Ltd", "SME TECHNOLOGIES", "SME", "Peter Berry", "Co"])
+
+    assert matcher.match("Who are the shareholders of sme lending limited and Peter Berry's companies?") == [
+        "SME LENDING",
+        "SME Lending Ltd",
+        "Peter Berry",
+    ]
+    assert matcher.match("Tell me about SME plc") == ["SME"]
+    assert matcher.match("What does the co own?") == []
+
+
+def test_extractor_rebuilds_in_the_background_when_the_graph_changes():
+    graph_store = SimpleGraphStore()
+    graph_store.upsert_triplet("BANK TECH", "has shareholder", "Sarah Smith")
+    graph_store.version = 1
+    extractor = GraphEntityExtractor(graph_store)
+    query = "Did SME Technologies buy Bank Tech?"
+
+    async def run() -> None:
+        assert await extractor.aextract(query) == ["BANK TECH"]
+
+        graph_store.upsert_triplet("SME TECHNOLOGIES", "has acquired", "BANK TECH")
+
+        assert await extractor.aextract(query) == ["BANK TECH"]
+
+        graph_store.version = 2
+
+        # Matched with the previous matcher while the new one is built
+        assert await extractor.aextract(query) == ["BANK TECH"]
+        await asyncio.sleep(0)
+        assert await extractor.aextract(query) == ["SME TECHNOLOGIES", "BANK TECH"]
+
+    asyncio.run(run())
+
+
+class FakePostgresGraphStore(PostgresGraphStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.names = ["BANK TECH"]
+        self.write_count = 1
+        self.builds = 0
+        self.build_started = asyncio.Event()
+        self.build_done = asyncio.Event()
+
+    async def aget_write_count(self) -> int:
+        return self.write_count
+
+    async def aget_entity_names(self):
+        self.builds += 1
+        if self.builds > 1:
+            self.build_started.set()
+            await self.build_done.wait()
+        return list(self.names)
+
+
+def test_extractor_sees_other_processes_writes_by_their_write_count():
+    async def run() -> None:
+        graph_store = FakePostgresGraphStore()
+        extractor = GraphEntityExtractor(graph_store)
+        query = "Did SME Technologies buy Bank Tech?"
+
+        assert await asyncio.gather(extractor.aextract(query), extractor.aextract(query)) == [["BANK TECH"]] * 2
+
+        # Written by another process, so the version doesn't change
+        graph_store.names.append("SME TECHNOLOGIES")
+        graph_store.write_count = 2
+
+        assert await extractor.aextract(query) == ["BANK TECH"]
+        await graph_store.build_started.wait()
+        # A single rebuild, while the previous matcher keeps being used
+        assert await extractor.aextract(query) == ["BANK TECH"]
+        graph_store.build_done.set()
+        await asyncio.sleep(0)
+
+        assert await extractor.aextract(query) == ["SME TECHNOLOGIES", "BANK TECH"]
+        assert graph_store.builds == 2
+
+    asyncio.run(run())
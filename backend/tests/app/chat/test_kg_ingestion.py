@@ -0,0 +1,105 @@
+import asyncio
+from typing import AsyncIterator, List, Sequence, Set, Tuple
+import fsspec
+from llama_index.graph_stores import SimpleGraphStore
+from app.chat import kg_ingestion
+from app.chat.engine_cache import chat_tools_cache
+from app.chat.kg_ingestion import S3GraphStoreWriter, TripletFormatEnum, aiter_lines, ingest_triplets, parse_triplet
+
+
+async def aiter_chunks(data: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+async def collect_lines(data: bytes, chunk_size: int) -> List[str]:
+    return [line async for line in aiter_lines(aiter_chunks(data, chunk_size))]
+
+
+class FakeGraphStore:
+    def __init__(self) -> None:
+        self.triplets: Set[Tuple[str, str, str]] = set()
+        self.batches: List[Sequence[Tuple[str, str, str]]] = []
+
+    async def aupsert_triplets(self, triplets: Sequence[Tuple[str, str, str]]) -> int:
+        self.batches.append(triplets)
+        new = set(triplets) - self.triplets
+        self.triplets |= new
+        return len(new)
+
+
+def test_lines_are_split_across_chunks():
+    data = "Société Générale,owns,SG\r\nb,c,d\nlast".encode()
+
+    # A chunk size of 1 also splits the multi-byte characters
+    assert asyncio.run(collect_lines(data, 1)) == ["Société Générale,owns,SG", "b,c,d", "last"]
+
+
+def test_parse_triplet():
+    assert parse_triplet('"SME LENDING, LTD", has shareholder ,Peter Berry', TripletFormatEnum.CSV) == (
+        "SME LENDING, LTD", "has shareholder", "Peter Berry"
+    )
+    assert parse_triplet("Subject,Relation,Object", TripletFormatEnum.CSV) is None
+    assert parse_triplet('{"subj": "a", "rel": "b", "obj": "c"}', TripletFormatEnum.JSONL) == ("a", "b", "c")
+    assert parse_triplet('["a", "b", "c"]', TripletFormatEnum.JSONL) == ("a", "b", "c")
+
+
+def test_ingestion_dedupes_batches_and_counts_invalid_lines():
+    lines = ["subject,relation,object", "a,r,b", "a,r,b", "a,r", "c,r,d", "", "a,r,b", "e,r,f"]
+    graph_store = FakeGraphStore()
+
+    async def aiter_strs() -> AsyncIterator[str]:
+        for line in lines:
+            yield line
+
+    stats = asyncio.run(ingest_triplets(aiter_strs(), TripletFormatEnum.CSV, graph_store=graph_store, batch_size=2))
+
+    assert graph_store.batches == [[("a", "r", "b"), ("c", "r", "d")], [("a", "r", "b"), ("e", "r", "f")]]
+    assert (stats.lines, stats.invalid, stats.inserted, stats.duplicates, stats.batches) == (6, 1, 3, 2, 2)
+    assert stats.errors == ["line 4: expected a subject, a relation and an object"]
+
+
+def test_s3_writer_adds_new_triplets_to_the_stored_graph(tmp_path):
+    fs = fsspec.filesystem("file")
+    graph_store = SimpleGraphStore()
+    graph_store.upsert_triplet("a", "r", "b")
+    graph_store.persist(str(tmp_path / "graph_store.json"), fs=fs)
+    writer = S3GraphStoreWriter(fs=fs, persist_dir=str(tmp_path))
+
+    assert asyncio.run(writer.aupsert_triplets([("a", "r", "b"), ("a", "r", "c"), ("d", "r", "b")])) == 2
+    assert asyncio.run(writer.aupsert_triplets([("a", "r", "c")])) == 0
+    # Only written back when flushed
+    assert SimpleGraphStore.from_persist_dir(str(tmp_path), fs=fs).get("d") == []
+    asyncio.run(writer.aflush())
+
+    stored = SimpleGraphStore.from_persist_dir(str(tmp_path), fs=fs)
+    assert stored.get("a") == [["r", "b"], ["r", "c"]]
+    assert stored.get("d") == [["r", "b"]]
+
+
+def test_s3_ingests_run_one_at_a_time_and_invalidate_the_graph_tools(tmp_path, monkeypatch):
+    fs = fsspec.filesystem("file")
+    monkeypatch.setattr(kg_ingestion, "s3_ingest_lock", asyncio.Lock())
+    chat_tools_cache[("default", ())] = "graph tools"
+    chat_tools_cache[("default", (("doc", None),))] = "document tools"
+
+    async def aiter_triplets(name: str) -> AsyncIterator[str]:
+        for i in range(3):
+            yield f"{name},r,{i}"
+            await asyncio.sleep(0)
+
+    async def run() -> None:
+        await asyncio.gather(*(
+            ingest_triplets(
+                aiter_triplets(name), TripletFormatEnum.CSV,
+                graph_store=S3GraphStoreWriter(fs=fs, persist_dir=str(tmp_path)), batch_size=1,
+            )
+            for name in ("a", "b")
+        ))
+
+    asyncio.run(run())
+
+    stored = SimpleGraphStore.from_persist_dir(str(tmp_path), fs=fs)
+    assert len(stored.get("a")) == len(stored.get("b")) == 3
+    assert ("default", ()) not in chat_tools_cache
+    assert chat_tools_cache.pop(("default", (("doc", None),))) == "document tools"
@@ -0,0 +1,51 @@
+import asyncio
+from typing import Any, Dict, List
+from app.chat import message_writer
+from app.chat.message_writer import MessageWriteBehind
+from app.chat.messaging import StreamedMessage, StreamedMessageSubProcess
+from app.chat.streaming import StreamFormatEnum
+from app.db.models.base import Message, MessageRoleEnum, MessageStatusEnum, MessageSubProcessSourceEnum
+from tests.app.chat.test_streaming import build_message_stream
+
+
+class FakeSession:
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+def test_checkpoints_write_only_what_changed(monkeypatch):
+    writes: List[Dict[str, Any]] = []
+
+    async def upsert_message_sub_processes(db, sub_processes):
+        if sub_processes:
+            writes.append({"sub_processes": [(row["id"], row["status"]) for row in sub_processes]})
+
+    async def update_message(db, message_id, **values):
+        writes.append(values)
+
+    monkeypatch.setattr(message_writer, "SessionLocal", FakeSession)
+    monkeypatch.setattr(message_writer.crud, "upsert_message_sub_processes", upsert_message_sub_processes)
+    monkeypatch.setattr(message_writer.crud, "update_message", update_message)
+
+    message_stream = build_message_stream(StreamFormatEnum.DELTA)
+    user_message = Message(conversation_id=message_stream.message.conversation_id, role=MessageRoleEnum.user)
+    writer = MessageWriteBehind(message_stream, user_message)
+    sub_process = dict(source=MessageSubProcessSourceEnum.SUB_QUESTION, event_id="event", metadata_map=None)
+
+    message_stream.apply_batch([StreamedMessageSubProcess(has_ended=False, **sub_process), StreamedMessage(delta="Hi")])
+    asyncio.run(writer.checkpoint())
+    # Nothing changed since the last checkpoint
+    asyncio.run(writer.checkpoint())
+    message_stream.apply(StreamedMessageSubProcess(has_ended=True, **sub_process))
+    asyncio.run(writer.finish(MessageStatusEnum.SUCCESS))
+
+    sub_process_id = message_stream.event_id_to_sub_process["event"].id
+    assert writes == [
+        {"sub_processes": [(sub_process_id, "PENDING")]},
+        {"content": "Hi"},
+        {"sub_processes": [(sub_process_id, "FINISHED")]},
+        {"status": MessageStatusEnum.SUCCESS},
+    ]
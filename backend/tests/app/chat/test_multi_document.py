@@ -0,0 +1,68 @@
+from uuid import uuid4
+from llama_index.schema import TextNode
+from sqlalchemy.dialects import postgresql
+from app.chat.constants import DB_DOC_ID_KEY
+from app.chat.multi_document import get_max_per_document, get_retrieval_mode
+from app.chat.pg_vector import CustomPGVectorStore
+from app.core.config import settings
+from app.db.models.base import RetrievalModeEnum
+from app.schemas.pydantic_schema import Conversation
+
+
+def test_max_per_document_is_an_even_share_with_a_floor():
+    assert get_max_per_document(10, 2) == 5
+    assert get_max_per_document(10, 50) == settings.CONSOLIDATED_RETRIEVAL_MIN_PER_DOCUMENT
+    assert get_max_per_document(10, 0) == 10
+
+
+def test_retrieval_mode_defaults_to_the_setting():
+    conversation = Conversation(id=uuid4(), messages=[], documents=[])
+
+    assert get_retrieval_mode(conversation) == RetrievalModeEnum(settings.DEFAULT_RETRIEVAL_MODE)
+
+    conversation.retrieval_mode = RetrievalModeEnum.CONSOLIDATED
+
+    assert get_retrieval_mode(conversation) == RetrievalModeEnum.CONSOLIDATED
+
+
+def test_documents_query_is_a_single_filtered_ranked_query():
+    store = CustomPGVectorStore.from_params("localhost", 5432, "db", "user", "password", "pg_vector_store")
+
+    sql = str(store._build_documents_query([0.1, 0.2], ["doc-a", "doc-b"], 10, 3).compile(dialect=postgresql.dialect()))
+
+    assert sql.count("FROM public.data_pg_vector_store") == 1
+    assert "PARTITION BY public.data_pg_vector_store.metadata_ ->> 'db_document_id'" in sql
+    assert "document_rank <=" in sql
+
+
+class FakeSyncSession:
+    def __init__(self) -> None:
+        self.statements = []
+
+    def __enter__(self) -> "FakeSyncSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def begin(self) -> "FakeSyncSession":
+        return self
+
+    def execute(self, stmt, rows=None) -> None:
+        self.statements.append((str(stmt.compile(dialect=postgresql.dialect())), rows))
+
+
+def test_replacing_documents_deletes_their_nodes_before_inserting(monkeypatch):
+    store = CustomPGVectorStore.from_params("localhost", 5432, "db", "user", "password", "pg_vector_store")
+    session = FakeSyncSession()
+    monkeypatch.setattr(CustomPGVectorStore, "_initialize", lambda self: None)
+    monkeypatch.setattr(store, "_session", lambda: session, raising=False)
+    node = TextNode(text="chunk", embedding=[0.1, 0.2], metadata={DB_DOC_ID_KEY: "doc-a"})
+
+    assert store.replace_documents(["doc-a"], [node]) == [node.node_id]
+
+    (delete_sql, _), (insert_sql, rows) = session.statements
+    assert delete_sql.startswith("DELETE FROM public.data_pg_vector_store")
+    assert "metadata_ ->> 'db_document_id') IN" in delete_sql
+    assert insert_sql.startswith("INSERT INTO public.data_pg_vector_store")
+    assert [row["node_id"] for row in rows] == [node.node_id]
@@ -0,0 +1,50 @@
+from app.chat.pdf_reader import (
+    MIN_PAGES_PER_SHARD,
+    MIXED_PAGE_IMAGE_COVERAGE,
+    PageKindEnum,
+    classify_page,
+    split_page_ranges,
+)
+
+
+class TestSplitPageRanges:
+    """
+    Test the split_page_ranges function.
+    """
+
+    def test_split_page_ranges_covers_every_page_in_order(self):
+        ranges = split_page_ranges(300, 8)
+        assert len(ranges) == 8
+        assert ranges[0][0] == 0
+        assert ranges[-1][1] == 300
+        for (_, prev_stop), (next_start, _) in zip(ranges, ranges[1:]):
+            assert prev_stop == next_start
+
+    def test_split_page_ranges_small_document_single_shard(self):
+        assert split_page_ranges(MIN_PAGES_PER_SHARD - 1, 8) == [(0, MIN_PAGES_PER_SHARD - 1)]
+
+    def test_split_page_ranges_limits_shards_by_page_count(self):
+        ranges = split_page_ranges(MIN_PAGES_PER_SHARD * 2, 8)
+        assert ranges == [(0, MIN_PAGES_PER_SHARD), (MIN_PAGES_PER_SHARD, MIN_PAGES_PER_SHARD * 2)]
+
+    def test_split_page_ranges_empty_document(self):
+        assert split_page_ranges(0, 8) == []
+
+
+class TestClassifyPage:
+    """
+    Test the classify_page function.
+    """
+
+    def test_classify_page_text(self):
+        assert classify_page("Strategic report " * 50, 0.9) == PageKindEnum.TEXT
+
+    def test_classify_page_scanned(self):
+        assert classify_page("  \n", 1.0) == PageKindEnum.SCANNED
+
+    def test_classify_page_empty(self):
+        assert classify_page("", 0.0) == PageKindEnum.EMPTY
+
+    def test_classify_page_mixed(self):
+        assert classify_page("Page 3", MIXED_PAGE_IMAGE_COVERAGE) == PageKindEnum.MIXED
+        assert classify_page("Page 3", MIXED_PAGE_IMAGE_COVERAGE / 2) == PageKindEnum.TEXT
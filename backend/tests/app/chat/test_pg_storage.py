@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List, Sequence, Tuple
+from app.api import crud
+from app.chat import pg_storage
+from llama_index.storage.storage_context import StorageContext
+from app.chat.kg_retriever_custom import KnowledgeGraphRAGRetriever
+from app.chat.pg_storage import STORAGE_UPSERT_BATCH_SIZE, PostgresGraphStore
+from tests.app.chat.test_history import FakeSession
+
+
+GRAPH_DICT = {
+    "SME LENDING": [["has shareholder", "Peter Berry"], ["has shareholder", "Andy Davis"]],
+    "Peter Berry": [["is shareholder of", "SME TECHNOLOGIES"]],
+}
+
+
+def test_rel_map_is_a_single_query(monkeypatch):
+    calls = []
+
+    async def fetch_kg_rel_map(db, subjs, depth, limit, max_rels_per_subject=None):
+        calls.append((subjs, depth, limit, max_rels_per_subject))
+        return {"SME LENDING": [["SME LENDING", "has shareholder", "Peter Berry"]]}
+
+    monkeypatch.setattr(pg_storage, "SessionLocal", FakeSession)
+    monkeypatch.setattr(pg_storage.crud, "fetch_kg_rel_map", fetch_kg_rel_map)
+
+    rel_map = asyncio.run(PostgresGraphStore().aget_rel_map(["SME LENDING"], depth=2, limit=30))
+
+    assert rel_map == {"SME LENDING": [["SME LENDING", "has shareholder", "Peter Berry"]]}
+    assert calls == [(["SME LENDING"], 2, 30, None)]
+
+
+def test_sync_retrieval_caps_relations_and_falls_back_to_similar_subjects(monkeypatch):
+    calls = []
+
+    async def aget_rel_map(self, subjs, depth, limit, max_rels_per_subject):
+        calls.append((subjs, max_rels_per_subject))
+        return {subj: [[subj, "has shareholder", "Peter Berry"]] for subj in subjs if subj == "SME LENDING"}
+
+    async def aget_similar_subjects(self, name):
+        return ["SME LENDING"]
+
+    monkeypatch.setattr(PostgresGraphStore, "aget_rel_map", aget_rel_map)
+    monkeypatch.setattr(PostgresGraphStore, "aget_similar_subjects", aget_similar_subjects)
+    retriever = KnowledgeGraphRAGRetriever(
+        service_context=SimpleNamespace(llm_predictor=None),
+        storage_context=StorageContext.from_defaults(graph_store=PostgresGraphStore()),
+        max_rels_per_subject=2,
+    )
+
+    knowledge_sequence, _ = retriever._get_knowledge_sequence(["SME Lendng"])
+
+    assert knowledge_sequence == ["['SME LENDING', 'has shareholder', 'Peter Berry']"]
+    assert calls == [(["SME Lendng"], 2), (["SME LENDING"], 2)]
+
+
+def test_put_all_inserts_triplets_in_batches(monkeypatch):
+    batches: List[Sequence[Tuple[str, str, str]]] = []
+
+    async def insert_kg_triplets(db, triplets, statement_size):
+        assert statement_size == STORAGE_UPSERT_BATCH_SIZE
+        batches.append(triplets)
+        return len(triplets)
+
+    monkeypatch.setattr(pg_storage, "SessionLocal", FakeSession)
+    monkeypatch.setattr(pg_storage.crud, "insert_kg_triplets", insert_kg_triplets)
+    graph_store = PostgresGraphStore()
+    version = graph_store.version
+
+    asyncio.run(graph_store.aput_all(GRAPH_DICT))
+    inserted = asyncio.run(graph_store.aupsert_triplets([("Subject", "rel", f"Object {i}") for i in range(STORAGE_UPSERT_BATCH_SIZE + 1)]))
+
+    assert batches[0] == [
+        ("SME LENDING", "has shareholder", "Peter Berry"),
+        ("SME LENDING", "has shareholder", "Andy Davis"),
+        ("Peter Berry", "is shareholder of", "SME TECHNOLOGIES"),
+    ]
+    assert [len(batch) for batch in batches[1:]] == [STORAGE_UPSERT_BATCH_SIZE + 1]
+    assert inserted == STORAGE_UPSERT_BATCH_SIZE + 1
+    assert graph_store.version == version + 2
+
+
+class RecordingSession:
+    def __init__(self) -> None:
+        self.statement_rows: List[int] = []
+        self.commits = 0
+
+    async def execute(self, stmt):
+        rows = len(stmt.compile().params) // 3
+        self.statement_rows.append(rows)
+        return SimpleNamespace(rowcount=rows)
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+
+def test_triplets_are_inserted_in_one_transaction():
+    db = RecordingSession()
+
+    inserted = asyncio.run(crud.insert_kg_triplets(db, [("Subject", "rel", f"Object {i}") for i in range(5)], statement_size=2))
+
+    assert db.statement_rows == [2, 2, 1]
+    assert db.commits == 1
+    assert inserted == 5
@@ -0,0 +1,47 @@
+import fsspec
+from llama_index import StorageContext
+from llama_index.data_structs import IndexDict
+from llama_index.schema import Document as LlamaIndexDocument
+from llama_index.vector_stores import SimpleVectorStore
+from app.chat.storage import load_document_storage_context, load_manifest, persist_document_shards
+
+
+def build_storage_context(doc_id: str) -> StorageContext:
+    storage_context = StorageContext.from_defaults()
+    storage_context.docstore.add_documents([LlamaIndexDocument(text=f"page of {doc_id}", id_=f"{doc_id}-page")])
+    storage_context.index_store.add_index_struct(IndexDict(index_id=doc_id))
+    return storage_context
+
+
+def test_persist_writes_only_new_shards_and_manifest():
+    fs = fsspec.filesystem("memory")
+    persist_dir = "test-bucket-persist"
+    persist_document_shards(persist_dir, {"a": build_storage_context("a")}, fs)
+    shard_a = fs.cat_file(f"{persist_dir}/documents/a/docstore.json")
+
+    persist_document_shards(persist_dir, {"b": build_storage_context("b")}, fs)
+
+    assert fs.cat_file(f"{persist_dir}/documents/a/docstore.json") == shard_a
+    assert set(load_manifest(persist_dir, fs)) == {"a", "b"}
+
+
+def test_load_fetches_only_requested_shards():
+    fs = fsspec.filesystem("memory")
+    persist_dir = "test-bucket-load"
+    persist_document_shards(persist_dir, {doc_id: build_storage_context(doc_id) for doc_id in ["a", "b"]}, fs)
+
+    storage_context, missing = load_document_storage_context(persist_dir, ["a", "c"], SimpleVectorStore(), fs)
+
+    assert missing == ["c"]
+    assert storage_context.index_store.get_index_struct("a") is not None
+    assert storage_context.index_store.get_index_struct("b") is None
+    assert storage_context.docstore.get_document("a-page").text == "page of a"
+    assert storage_context.docstore.get_document("b-page", raise_error=False) is None
+
+
+def test_load_without_shards():
+    fs = fsspec.filesystem("memory")
+    storage_context, missing = load_document_storage_context("test-bucket-empty", ["a"], SimpleVectorStore(), fs)
+
+    assert missing == ["a"]
+    assert load_manifest("test-bucket-empty", fs) == {}
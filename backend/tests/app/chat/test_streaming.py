@@ -0,0 +1,96 @@
+import anyio
+import json
+from uuid import uuid4
+from app.chat.messaging import StreamedMessage, StreamedMessageSubProcess
+from app.chat.streaming import (
+    CONTENT_DELTA_EVENT,
+    DELTA_MEDIA_TYPE,
+    MessageStream,
+    StreamFormatEnum,
+    SUB_PROCESS_EVENT,
+    StreamStats,
+    coalesce_events,
+    get_stream_format,
+)
+from app.db.models.base import Message, MessageRoleEnum, MessageStatusEnum, MessageSubProcessSourceEnum
+
+
+def build_message_stream(stream_format: StreamFormatEnum) -> MessageStream:
+    message = Message(
+        id=str(uuid4()),
+        conversation_id=str(uuid4()),
+        content="",
+        role=MessageRoleEnum.assistant,
+        status=MessageStatusEnum.PENDING,
+        sub_processes=[],
+    )
+    return MessageStream(message, stream_format)
+
+
+def stream_objects():
+    sub_process = dict(source=MessageSubProcessSourceEnum.SUB_QUESTION, event_id="event", metadata_map=None)
+    return [
+        StreamedMessageSubProcess(has_ended=False, **sub_process),
+        StreamedMessage(delta="Hello"),
+        StreamedMessageSubProcess(has_ended=True, **sub_process),
+        StreamedMessage(delta=" world"),
+    ]
+
+
+def test_delta_events_build_the_same_message_as_snapshots():
+    snapshot_stream = build_message_stream(StreamFormatEnum.SNAPSHOT)
+    delta_stream = build_message_stream(StreamFormatEnum.DELTA)
+
+    assert snapshot_stream.start() is None
+    assert json.loads(delta_stream.start().data)["status"] == MessageStatusEnum.PENDING.value
+
+    snapshots = [snapshot_stream.apply(message_obj) for message_obj in stream_objects()]
+    deltas = [delta_stream.apply(message_obj) for message_obj in stream_objects()]
+
+    assert json.loads(snapshots[-1])["content"] == "Hello world"
+    assert [delta.event for delta in deltas] == [SUB_PROCESS_EVENT, CONTENT_DELTA_EVENT, SUB_PROCESS_EVENT, CONTENT_DELTA_EVENT]
+    assert [json.loads(delta.data)["delta"] for delta in deltas if delta.event == CONTENT_DELTA_EVENT] == ["Hello", " world"]
+    started, finished = [json.loads(delta.data) for delta in deltas if delta.event == SUB_PROCESS_EVENT]
+    assert (started["status"], finished["status"]) == ("PENDING", "FINISHED")
+    assert started["created_at"] == finished["created_at"]
+
+    final = json.loads(delta_stream.snapshot())
+    assert final["content"] == "Hello world"
+    assert len(final["sub_processes"]) == 1
+
+
+def test_get_stream_format():
+    assert get_stream_format(None, "text/event-stream") == StreamFormatEnum.SNAPSHOT
+    assert get_stream_format(None, f"text/event-stream, {DELTA_MEDIA_TYPE}") == StreamFormatEnum.DELTA
+    assert get_stream_format(StreamFormatEnum.SNAPSHOT, DELTA_MEDIA_TYPE) == StreamFormatEnum.SNAPSHOT
+
+
+def test_coalesce_events_merges_objects_within_the_flush_interval():
+    async def main():
+        send_chan, recv_chan = anyio.create_memory_object_stream(100)
+        message_stream = build_message_stream(StreamFormatEnum.DELTA)
+        stats = StreamStats()
+        events = []
+
+        async def produce():
+            async with send_chan:
+                for message_obj in stream_objects():
+                    await send_chan.send(message_obj)
+                await anyio.sleep(0.2)
+                await send_chan.send(StreamedMessage(delta="!"))
+
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(produce)
+            async for event in coalesce_events(recv_chan, message_stream, flush_interval=0.05, stats=stats):
+                events.append(event)
+
+        return events, stats, message_stream
+
+    events, stats, message_stream = anyio.run(main)
+
+    # The first four objects are merged into one sub-process upsert and one content delta
+    assert [event.event for event in events] == [SUB_PROCESS_EVENT, CONTENT_DELTA_EVENT, CONTENT_DELTA_EVENT]
+    assert json.loads(events[0].data)["status"] == "FINISHED"
+    assert [json.loads(event.data)["delta"] for event in events[1:]] == ["Hello world", "!"]
+    assert (stats.objects, stats.frames) == (5, 3)
+    assert message_stream.content == "Hello world!"
@@ -0,0 +1,128 @@
+import asyncio
+from typing import Any, List, Optional
+from llama_index.callbacks.base import BaseCallbackHandler, CallbackManager
+from llama_index.callbacks.schema import CBEventType
+from llama_index.indices.query.base import BaseQueryEngine
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.question_gen.types import SubQuestion
+from llama_index.response.schema import Response
+from llama_index.tools import QueryEngineTool, ToolMetadata
+from llama_index.llms import OpenAI
+from app.chat.sub_questions import (
+    TIMED_OUT_PAYLOAD_KEY,
+    GovernedSubQuestionQueryEngine,
+    SubQuestionGovernor,
+    get_llm_provider,
+)
+
+
+class SleepingQueryEngine(BaseQueryEngine):
+    def __init__(self, seconds: float, concurrency: List[int]) -> None:
+        super().__init__(None)
+        self.seconds = seconds
+        self.concurrency = concurrency
+
+    def _get_prompt_modules(self) -> dict:
+        return {}
+
+    def _query(self, query_bundle: QueryBundle) -> Response:
+        raise NotImplementedError
+
+    async def _aquery(self, query_bundle: QueryBundle) -> Response:
+        self.concurrency[0] += 1
+        self.concurrency[1] = max(self.concurrency[1], self.concurrency[0])
+        try:
+            await asyncio.sleep(self.seconds)
+        finally:
+            self.concurrency[0] -= 1
+        return Response(response=query_bundle.query_str)
+
+
+class EndPayloadRecorder(BaseCallbackHandler):
+    def __init__(self) -> None:
+        super().__init__([], [])
+        self.end_payloads: List[dict] = []
+
+    def on_event_start(self, event_type: CBEventType, payload: Optional[dict] = None, event_id: str = "", **kwargs: Any) -> str:
+        return event_id
+
+    def on_event_end(self, event_type: CBEventType, payload: Optional[dict] = None, event_id: str = "", **kwargs: Any) -> None:
+        if event_type == CBEventType.SUB_QUESTION:
+            self.end_payloads.append(payload)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(self, trace_id: Optional[str] = None, trace_map: Optional[dict] = None) -> None:
+        pass
+
+
+def test_sub_questions_are_bounded_and_stragglers_dropped():
+    concurrency = [0, 0]
+    tools = [
+        QueryEngineTool(query_engine=SleepingQueryEngine(seconds, concurrency), metadata=ToolMetadata(name=name, description=name))
+        for name, seconds in [("fast", 0.01), ("slow", 5)]
+    ]
+    recorder = EndPayloadRecorder()
+    governor = SubQuestionGovernor(max_concurrency=3, max_concurrency_per_provider=2)
+    engine = GovernedSubQuestionQueryEngine(
+        question_gen=None,
+        response_synthesizer=None,
+        query_engine_tools=tools,
+        callback_manager=CallbackManager([recorder]),
+        verbose=False,
+        use_async=True,
+        deadline_seconds=0.1,
+        governor=governor,
+    )
+    sub_questions = [
+        SubQuestion(sub_question="q1", tool_name="fast"),
+        SubQuestion(sub_question="q2", tool_name="slow"),
+        SubQuestion(sub_question="q3", tool_name="fast"),
+    ]
+
+    async def run():
+        return await asyncio.gather(*[engine._aquery_subq(sub_q) for sub_q in sub_questions])
+
+    qa_pairs = asyncio.run(run())
+
+    assert [qa_pair.answer if qa_pair else None for qa_pair in qa_pairs] == ["q1", None, "q3"]
+    # One provider allows two sub-questions at a time
+    assert concurrency[1] == 2
+    assert governor.tool_latencies["slow"].timeouts == 1
+    assert governor.tool_latencies["fast"].count == 2
+    assert sum(1 for payload in recorder.end_payloads if payload and payload.get(TIMED_OUT_PAYLOAD_KEY)) == 1
+
+
+def test_waiting_for_a_slot_counts_against_the_deadline():
+    concurrency = [0, 0]
+    tools = [
+        QueryEngineTool(query_engine=SleepingQueryEngine(0.15, concurrency), metadata=ToolMetadata(name=name, description=name))
+        for name in ["first", "second"]
+    ]
+    governor = SubQuestionGovernor(max_concurrency=1, max_concurrency_per_provider=1)
+    engine = GovernedSubQuestionQueryEngine(
+        question_gen=None,
+        response_synthesizer=None,
+        query_engine_tools=tools,
+        callback_manager=CallbackManager([]),
+        verbose=False,
+        use_async=True,
+        deadline_seconds=0.25,
+        governor=governor,
+    )
+    sub_questions = [SubQuestion(sub_question=f"q{i}", tool_name=name) for i, name in enumerate(["first", "second"])]
+
+    async def run():
+        return await asyncio.gather(*[engine._aquery_subq(sub_q) for sub_q in sub_questions])
+
+    qa_pairs = asyncio.run(run())
+
+    # The second sub-question only gets a slot 0.15s in, too late to finish within 0.25s
+    assert [qa_pair.answer if qa_pair else None for qa_pair in qa_pairs] == ["q0", None]
+    assert governor.tool_latencies["second"].timeouts == 1
+
+
+def test_provider_is_named_after_the_llm():
+    assert get_llm_provider(OpenAI(api_key="sk-test")) == "openai"
+    assert get_llm_provider(None) == "openai"